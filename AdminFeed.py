@@ -0,0 +1,113 @@
+import threading
+
+
+class AdminFilter:
+    """Ce qu'un dashboard veut recevoir : types de message, émetteurs, taux d'échantillonnage
+
+    Les admins qui déclarent le même filtre partagent la même instance : leur lot est
+    construit et sérialisé une seule fois.
+    """
+
+    def __init__(self, message_types=None, emitters=None, sample=1.0):
+        self.message_types = frozenset(message_types or ())
+        self.emitters = frozenset(emitters or ())
+        self.sample = min(max(float(sample), 0.0), 1.0)
+        self.credit = 0.0        # échantillonnage déterministe : garde sample événements sur 1
+
+    @property
+    def key(self):
+        return (self.message_types, self.emitters, self.sample)
+
+    def matches(self, event):
+        return (not self.message_types or event['message_type'] in self.message_types) \
+            and (not self.emitters or event['emitter'] in self.emitters)
+
+    def select(self, events):
+        selected = []
+        for event in events:
+            if not self.matches(event):
+                continue
+            self.credit += self.sample
+            if self.credit >= 1.0:
+                self.credit -= 1.0
+                selected.append(event)
+        return selected
+
+
+class RoutingFeed:
+    """Notifications de routage pour les admins, regroupées par lots
+
+    Les événements sont mis en tampon et publiés toutes les window secondes, ou dès que
+    max_events sont en attente : un seul ADMIN_ROUTING_BATCH par filtre distinct, au lieu
+    d'un message par message routé et par admin.
+    """
+
+    def __init__(self, window, max_events, publish):
+        self.window = window
+        self.max_events = max_events
+        self.publish = publish   # publish(events, admin_ids) ; admin_ids None = admins sans filtre
+        self.events = []
+        self.filters = {}        # id du client admin -> AdminFilter
+        self.shared = {}         # clé du filtre -> AdminFilter partagé
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def set_filter(self, admin_id, message_types=None, emitters=None, sample=1.0):
+        new_filter = AdminFilter(message_types, emitters, sample)
+        with self.lock:
+            self.filters[admin_id] = self.shared.setdefault(new_filter.key, new_filter)
+            return self.filters[admin_id]
+
+    def forget(self, admin_id):
+        with self.lock:
+            self.filters.pop(admin_id, None)
+            used = {id(f) for f in self.filters.values()}
+            self.shared = {key: f for key, f in self.shared.items() if id(f) in used}
+
+    def interested(self, event, nb_admins):
+        """Faux si aucun admin ne garderait l'événement : il n'est même pas mis en tampon"""
+        with self.lock:
+            if nb_admins > len(self.filters):
+                return True
+            return any(f.matches(event) for f in self.shared.values())
+
+    def add(self, event):
+        flush_now = False
+        with self.lock:
+            self.events.append(event)
+            if len(self.events) >= self.max_events or not self.window:
+                flush_now = True
+            elif self.timer is None:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if flush_now:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            events, self.events = self.events, []
+            if not events:
+                return
+            batches = self.split(events)
+        for batch, admin_ids in batches:
+            self.publish(batch, admin_ids)
+
+    def batches(self, events):
+        """Lots [(événements, admin_ids)] pour des événements déjà regroupés (ex. lot d'un autre serveur)"""
+        with self.lock:
+            return self.split(events)
+
+    def split(self, events):
+        batches = [(events, None)]
+        groups = {}
+        for admin_id, admin_filter in self.filters.items():
+            groups.setdefault(id(admin_filter), (admin_filter, []))[1].append(admin_id)
+        for admin_filter, admin_ids in groups.values():
+            selected = admin_filter.select(events)
+            if selected:
+                batches.append((selected, admin_ids))
+        return batches
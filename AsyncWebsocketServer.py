@@ -0,0 +1,238 @@
+import asyncio
+import struct
+import threading
+
+from Outbox import TEXT, Outbox
+from WSFrame import (OPCODE_BINARY, OPCODE_CLOSE, OPCODE_CONTINUATION, OPCODE_PING,
+                     OPCODE_PONG, OPCODE_TEXT, accept_key, encode_frame, unmask)
+
+
+class AsyncWebsocketServer:
+    """Moteur WebSocket asyncio : toutes les connexions sur une seule boucle d'événements.
+
+    Expose la même API que websocket_server.WebsocketServer (set_fn_*, send_message,
+    run_forever, shutdown_gracefully) pour que WSServer puisse l'utiliser tel quel.
+    """
+
+    # Les trames binaires reçues sont transmises telles quelles (bytes) à fn_message_received
+    supports_binary = True
+
+    def __init__(self, host, port, max_message_size=64 * 1024 * 1024, outbox_options=None, reuse_port=False):
+        self.host = host
+        self.port = port
+        # SO_REUSEPORT : plusieurs processus écoutent le même port, le noyau répartit les connexions
+        self.reuse_port = reuse_port
+        self.max_message_size = max_message_size
+        self.outbox_options = outbox_options or {}
+        self.clients = []
+        self.id_counter = 0
+        self.loop = None
+        self.loop_thread_id = None
+        self.server = None
+        self.fn_new_client = None
+        self.fn_client_left = None
+        self.fn_message_received = None
+
+    def set_fn_new_client(self, fn):
+        self.fn_new_client = fn
+
+    def set_fn_client_left(self, fn):
+        self.fn_client_left = fn
+
+    def set_fn_message_received(self, fn):
+        self.fn_message_received = fn
+
+    # --- Envoi ---
+
+    def send_message(self, client, msg, kind=TEXT):
+        """Envoie un message texte (str ou bytes UTF-8) à un client"""
+        self.send_frame(client, encode_frame(msg, OPCODE_TEXT), kind)
+
+    def send_frame(self, client, frame, kind=TEXT, sequenced=False):
+        """Met une trame déjà construite dans la file sortante du client (thread-safe)"""
+        # Dans la boucle on ne peut pas attendre de la place : la tâche de vidage tourne sur ce même thread
+        client['outbox'].put(frame, kind, can_block=threading.get_ident() != self.loop_thread_id, sequenced=sequenced)
+
+    def send_message_to_all(self, msg):
+        frame = encode_frame(msg, OPCODE_TEXT)
+        for client in list(self.clients):
+            self.send_frame(client, frame)
+
+    def drop_client(self, client):
+        """Ferme la connexion (thread-safe), la boucle de lecture appellera fn_client_left"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(client['handler'].transport.abort)
+
+    @staticmethod
+    def _write(writer, frame):
+        if not writer.is_closing():
+            writer.write(frame)
+
+    # --- Cycle de vie ---
+
+    def run_forever(self):
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            pass
+
+    def shutdown_gracefully(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._close_all)
+
+    def _close_all(self):
+        for client in list(self.clients):
+            self._write(client['handler'], encode_frame(struct.pack("!H", 1001), OPCODE_CLOSE))
+            client['handler'].close()
+        if self.server is not None:
+            self.server.close()
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                 reuse_port=self.reuse_port or None)
+        async with self.server:
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    # --- Connexion ---
+
+    async def _handshake(self, reader, writer):
+        request = await reader.readuntil(b"\r\n\r\n")
+        headers = {}
+        for line in request.decode("latin-1").split("\r\n")[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        key = headers.get("sec-websocket-key")
+        if not key or "websocket" not in headers.get("upgrade", "").lower():
+            writer.write(b"HTTP/1.1 400 Bad Request\r\n\r\n")
+            return False
+        writer.write(
+            b"HTTP/1.1 101 Switching Protocols\r\n"
+            b"Upgrade: websocket\r\n"
+            b"Connection: Upgrade\r\n"
+            b"Sec-WebSocket-Accept: " + accept_key(key).encode("ascii") + b"\r\n\r\n"
+        )
+        await writer.drain()
+        return True
+
+    async def _read_frame(self, reader):
+        b1, b2 = await reader.readexactly(2)
+        fin = b1 & 0x80
+        opcode = b1 & 0x0F
+        masked = b2 & 0x80
+        length = b2 & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", await reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await reader.readexactly(8))[0]
+        if length > self.max_message_size:
+            raise ValueError(f"Trame trop grande ({length} octets)")
+        mask = await reader.readexactly(4) if masked else None
+        payload = await reader.readexactly(length)
+        if mask:
+            payload = unmask(payload, mask)
+        return fin, opcode, payload
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            if not await self._handshake(reader, writer):
+                writer.close()
+                return
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+
+        self.id_counter += 1
+        client = {
+            'id': self.id_counter,
+            'handler': writer,
+            'address': writer.get_extra_info('peername'),
+            'outbox': self._create_outbox(writer),
+        }
+        drain_task = asyncio.ensure_future(self._drain(client))
+        self.clients.append(client)
+        if self.fn_new_client:
+            self.fn_new_client(client, self)
+
+        fragments = []
+        fragment_opcode = None
+        try:
+            while True:
+                fin, opcode, payload = await self._read_frame(reader)
+                if opcode == OPCODE_CLOSE:
+                    self._write(writer, encode_frame(payload[:2], OPCODE_CLOSE))
+                    break
+                if opcode == OPCODE_PING:
+                    self._write(writer, encode_frame(payload, OPCODE_PONG))
+                    continue
+                if opcode == OPCODE_PONG:
+                    continue
+                if opcode in (OPCODE_TEXT, OPCODE_BINARY):
+                    fragment_opcode = opcode
+                    fragments = [payload]
+                elif opcode == OPCODE_CONTINUATION and fragment_opcode is not None:
+                    fragments.append(payload)
+                else:
+                    break
+                if not fin:
+                    continue
+
+                data = b"".join(fragments)
+                fragments = []
+                if fragment_opcode == OPCODE_TEXT:
+                    data = data.decode("utf-8")
+                fragment_opcode = None
+                if self.fn_message_received:
+                    self.fn_message_received(client, self, data)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            if client in self.clients:
+                self.clients.remove(client)
+            if self.fn_client_left:
+                self.fn_client_left(client, self)
+            client['outbox'].close()
+            drain_task.cancel()
+            writer.close()
+
+    def _create_outbox(self, writer):
+        loop = self.loop
+        ready = asyncio.Event()
+        outbox = Outbox(**self.outbox_options)
+
+        def wake():
+            if threading.get_ident() == self.loop_thread_id:
+                ready.set()
+            else:
+                loop.call_soon_threadsafe(ready.set)
+
+        # Client trop lent : on coupe la connexion, la boucle de lecture appellera fn_client_left
+        outbox.on_laggard = lambda: loop.call_soon_threadsafe(writer.transport.abort)
+        outbox.on_ready = wake
+        outbox.ready = ready
+        return outbox
+
+    async def _drain(self, client):
+        """Vide la file sortante du client en respectant le contrôle de flux de la socket"""
+        outbox = client['outbox']
+        writer = client['handler']
+        # Tampon d'écriture réduit : la trame suivante est choisie (par priorité) dès que la
+        # socket a absorbé la précédente, au lieu de s'empiler derrière un gros média
+        writer.transport.set_write_buffer_limits(high=64 * 1024)
+        try:
+            while not outbox.closed:
+                frame = outbox.pop()
+                if frame is None:
+                    outbox.ready.clear()
+                    if not outbox.length:
+                        await outbox.ready.wait()
+                    continue
+                writer.write(frame)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
@@ -0,0 +1,88 @@
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+class StdlibCodec:
+    """json de la bibliothèque standard : toujours disponible, renvoie du texte"""
+    name = "json"
+
+    @staticmethod
+    def dumps(data):
+        return json.dumps(data)
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    """orjson : encodage/décodage en C, renvoie directement des octets UTF-8"""
+    name = "orjson"
+
+    @staticmethod
+    def dumps(data):
+        return orjson.dumps(data)
+
+    @staticmethod
+    def loads(data):
+        return orjson.loads(data)
+
+
+class MsgspecCodec:
+    name = "msgspec"
+
+    @staticmethod
+    def dumps(data):
+        return msgspec.json.encode(data)
+
+    @staticmethod
+    def loads(data):
+        return msgspec.json.decode(data)
+
+
+CODECS = {
+    StdlibCodec.name: StdlibCodec,
+    OrjsonCodec.name: OrjsonCodec,
+    MsgspecCodec.name: MsgspecCodec,
+}
+
+AVAILABLE = {
+    StdlibCodec.name: True,
+    OrjsonCodec.name: orjson is not None,
+    MsgspecCodec.name: msgspec is not None,
+}
+
+
+def select_codec(name=None):
+    """Codec demandé (ou WS_JSON_CODEC), sinon le plus rapide installé : orjson, msgspec, json"""
+    name = name or os.environ.get("WS_JSON_CODEC")
+    if name:
+        if name not in CODECS:
+            raise ValueError(f"Codec JSON inconnu '{name}', attendu parmi {tuple(CODECS)}")
+        if not AVAILABLE[name]:
+            raise ImportError(f"Codec JSON '{name}' non installé")
+        return CODECS[name]
+    for candidate in (OrjsonCodec, MsgspecCodec):
+        if AVAILABLE[candidate.name]:
+            return candidate
+    return StdlibCodec
+
+
+# Codec utilisé par Message.to_json / from_json, choisi au démarrage
+codec = select_codec()
+
+
+def set_codec(name):
+    global codec
+    codec = select_codec(name)
+    return codec
@@ -0,0 +1,85 @@
+import threading
+import time
+
+from Message import MessageType, SENSOR_ID
+
+# Mesures continues : seule la plus récente a de l'intérêt pour l'affichage
+CONFLATABLE_SENSORS = {
+    SENSOR_ID.LIGHT,
+    SENSOR_ID.JOYSTICK,
+    SENSOR_ID.TEMPERATURE,
+    SENSOR_ID.ACCELEROMETER,
+}
+
+
+class SensorConflator:
+    """Conflation « dernière valeur » des ENVOI_SENSOR, par (émetteur, sensor_id, destinataire)
+
+    La première mesure d'une clé part tout de suite ; celles qui arrivent ensuite dans la
+    fenêtre remplacent la mesure en attente, qui est relayée à la fin de la fenêtre. La
+    diffusion coûte donc au plus une trame par clé et par fenêtre, quelle que soit la
+    fréquence d'échantillonnage. Les événements (BUTTON, RFID, LED...) ne sont jamais fusionnés.
+    """
+
+    def __init__(self, window, deliver, sensors=None):
+        self.window = window
+        self.deliver = deliver   # deliver(message, client) : le relais normal de WSServer
+        self.sensors = set(CONFLATABLE_SENSORS if sensors is None else sensors)
+        self.last_sent = {}      # clé -> instant du dernier envoi
+        self.pending = {}        # clé -> (message, client) en attente de la fin de fenêtre
+        self.conflated = 0       # mesures remplacées sans avoir été envoyées
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def offer(self, message, client):
+        """True si la mesure est prise en charge ici (envoyée ou retenue), False pour le relais normal"""
+        if message.message_type != MessageType.ENVOI.SENSOR or message.sensor_id not in self.sensors:
+            return False
+        key = (message.emitter, message.sensor_id, message.receiver)
+        now = time.monotonic()
+        with self.lock:
+            if key not in self.pending and now - self.last_sent.get(key, 0) >= self.window:
+                self.last_sent[key] = now
+                send_now = True
+            else:
+                if key in self.pending:
+                    self.conflated += 1
+                self.pending[key] = (message, client)
+                send_now = False
+                self.start()
+        if send_now:
+            self.deliver(message, client)
+        return True
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.flush_loop, daemon=True)
+            self.thread.start()
+
+    def flush_loop(self):
+        while True:
+            time.sleep(self.window / 2)
+            self.flush()
+
+    def flush(self):
+        """Relaie les mesures en attente dont la fenêtre est écoulée"""
+        now = time.monotonic()
+        ready = []
+        with self.lock:
+            for key, entry in list(self.pending.items()):
+                if now - self.last_sent.get(key, 0) >= self.window:
+                    del self.pending[key]
+                    self.last_sent[key] = now
+                    ready.append(entry)
+        for message, client in ready:
+            self.deliver(message, client)
+
+    def forget(self, emitter):
+        """Oublie les clés d'un émetteur déconnecté"""
+        with self.lock:
+            for key in [k for k in self.last_sent if k[0] == emitter]:
+                self.last_sent.pop(key, None)
+                self.pending.pop(key, None)
+
+    def stats(self):
+        return {'window': self.window, 'pending': len(self.pending), 'conflated': self.conflated}
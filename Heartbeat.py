@@ -0,0 +1,114 @@
+import math
+import threading
+import time
+
+
+class TimingWheel:
+    """Roue temporelle : une case par tick, chaque case contient les clés qui arrivent à échéance
+
+    Planifier et avancer coûtent O(1) par clé, quel que soit le nombre de connexions : pas
+    un timer par client, un seul thread qui avance la roue d'une case par tick.
+    """
+
+    def __init__(self, tick, nb_slots):
+        self.tick = tick
+        self.slots = [set() for _ in range(nb_slots)]
+        self.position = 0
+
+    def schedule(self, key, delay):
+        ticks = min(max(1, math.ceil(delay / self.tick)), len(self.slots) - 1)
+        self.slots[(self.position + ticks) % len(self.slots)].add(key)
+
+    def advance(self):
+        """Passe à la case suivante et renvoie les clés arrivées à échéance"""
+        self.position = (self.position + 1) % len(self.slots)
+        due = self.slots[self.position]
+        self.slots[self.position] = set()
+        return due
+
+
+class Heartbeat:
+    """Ping des connexions inactives et fermeture de celles qui ne répondent plus
+
+    seen() est appelé pour chaque message reçu : une simple écriture dans un dict. Quand sa
+    case arrive à échéance, un client actif depuis moins de interval est simplement replanifié ;
+    sinon il reçoit un ping et a timeout secondes pour envoyer quoi que ce soit (le "pong"
+    de WSClient suffit), faute de quoi il est fermé (reap).
+    """
+
+    def __init__(self, interval, timeout, ping, reap, report, tick=1.0):
+        self.interval = interval
+        self.timeout = timeout
+        self.ping = ping         # ping(client)
+        self.reap = reap         # reap(client) : ferme la connexion, fn_client_left fera le ménage
+        self.report = report     # report(clients) : clients fermés pendant ce tick
+        self.wheel = TimingWheel(tick, int(max(interval, timeout) / tick) + 2)
+        self.clients = {}        # id -> client
+        self.last_seen = {}      # id -> instant (monotonic) du dernier message reçu
+        self.pinged = {}         # id -> instant du ping resté sans réponse
+        self.reaped = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, client):
+        with self.lock:
+            self.clients[client['id']] = client
+            self.last_seen[client['id']] = time.monotonic()
+            self.wheel.schedule(client['id'], self.interval)
+            self.start()
+
+    def remove(self, client):
+        with self.lock:
+            self.clients.pop(client['id'], None)
+            self.last_seen.pop(client['id'], None)
+            self.pinged.pop(client['id'], None)
+
+    def seen(self, client):
+        if client['id'] in self.last_seen:
+            self.last_seen[client['id']] = time.monotonic()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.wheel.tick)
+            self.advance()
+
+    def advance(self):
+        now = time.monotonic()
+        pings, reaped = [], []
+        with self.lock:
+            for client_id in self.wheel.advance():
+                client = self.clients.get(client_id)
+                if client is None:
+                    continue
+                last_seen = self.last_seen[client_id]
+                pinged_at = self.pinged.get(client_id)
+                if pinged_at is not None and last_seen < pinged_at:
+                    # Ping sans réponse
+                    if now - pinged_at >= self.timeout:
+                        reaped.append(client)
+                        del self.clients[client_id], self.last_seen[client_id], self.pinged[client_id]
+                    else:
+                        self.wheel.schedule(client_id, self.timeout - (now - pinged_at))
+                elif now - last_seen < self.interval:
+                    self.pinged.pop(client_id, None)
+                    self.wheel.schedule(client_id, self.interval - (now - last_seen))
+                else:
+                    self.pinged[client_id] = now
+                    pings.append(client)
+                    self.wheel.schedule(client_id, self.timeout)
+            self.reaped += len(reaped)
+        for client in pings:
+            self.ping(client)
+        if reaped:
+            # Signalé avant la fermeture : les clients sont encore dans le registre (usernames)
+            self.report(reaped)
+        for client in reaped:
+            self.reap(client)
+
+    def stats(self):
+        return {'tracked': len(self.clients), 'awaiting_pong': len(self.pinged), 'reaped': self.reaped}
@@ -0,0 +1,141 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+# Réglages par défaut, modifiables par variables d'environnement :
+#   WS_LOG_LEVEL=DEBUG|INFO|WARNING   WS_LOG_JSON=1 (JSON lines)   WS_LOG_SAMPLE=50 (événements/s par type)
+ROOT = "ws"
+TRUNCATE = 200
+
+_listener = None
+_lock = threading.Lock()
+
+
+def truncate(value, limit=TRUNCATE):
+    """Représentation courte d'une valeur (un média base64 de plusieurs Mo devient quelques octets + sa taille)"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} octets>"
+    text = value if isinstance(value, str) else repr(value)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... <{len(text)} caractères>"
+
+
+class TextFormatter(logging.Formatter):
+    """Ligne lisible : heure niveau logger message clé=valeur..."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s %(message)s", "%H:%M:%S")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par événement, pour ingestion (Loki, ELK...)"""
+
+    def format(self, record):
+        data = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            data.update(fields)
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Sous charge, garde au plus rate événements par seconde pour chaque (logger, événement)
+
+    Les niveaux WARNING et au-dessus passent toujours. Le nombre d'événements écartés est
+    reporté dans le champ 'sampled_out' du prochain événement gardé.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self.windows = {}        # (logger, événement) -> [début de la seconde, gardés, écartés]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        with self.lock:
+            return self.admit(record)
+
+    def admit(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        window = self.windows.get(key)
+        if window is None or now - window[0] >= 1.0:
+            dropped = window[2] if window else 0
+            window = self.windows[key] = [now, 0, 0]
+            if dropped:
+                record.fields = dict(getattr(record, 'fields', None) or {}, sampled_out=dropped)
+        if window[1] >= self.rate:
+            window[2] += 1
+            return False
+        window[1] += 1
+        return True
+
+
+def setup_logging(level=None, json_lines=None, sample=None, stream=None):
+    """Configure le logger 'ws' : file en mémoire vidée par un thread (QueueListener)
+
+    Les threads de connexion ne font que mettre l'enregistrement en file ; l'écriture sur
+    la console (lente, surtout sur un terminal) se fait en arrière-plan. Un nouvel appel
+    remplace la configuration précédente.
+    """
+    global _listener
+    level = level or os.environ.get("WS_LOG_LEVEL", "INFO")
+    if json_lines is None:
+        json_lines = os.environ.get("WS_LOG_JSON", "") not in ("", "0")
+    if sample is None and os.environ.get("WS_LOG_SAMPLE"):
+        sample = float(os.environ["WS_LOG_SAMPLE"])
+
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+        output = logging.StreamHandler(stream)
+        output.setFormatter(JsonFormatter() if json_lines else TextFormatter())
+        records = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(records, output, respect_handler_level=False)
+        _listener.start()
+
+        logger = logging.getLogger(ROOT)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        handler = logging.handlers.QueueHandler(records)
+        if sample:
+            handler.addFilter(SamplingFilter(sample))
+        logger.addHandler(handler)
+        logger.setLevel(level.upper() if isinstance(level, str) else level)
+        logger.propagate = False
+    return logger
+
+
+def get_logger(name):
+    """Logger 'ws.<name>' ; configure la journalisation avec les réglages par défaut au premier appel"""
+    if _listener is None:
+        setup_logging()
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+@atexit.register
+def _flush():
+    if _listener is not None:
+        _listener.stop()
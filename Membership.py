@@ -0,0 +1,75 @@
+import threading
+
+
+class MembershipFeed:
+    """Flux versionné des usernames connectés : un instantané, puis des deltas join/leave
+
+    Les changements sont regroupés pendant window secondes : lors d'une rafale de
+    reconnexions (coupure Wi-Fi), N connexions produisent un seul delta, une seule liste
+    pour les clients historiques et un seul lot d'événements admin, au lieu de N diffusions
+    de la liste complète à N clients. Un join suivi d'un leave dans le même lot s'annulent.
+    """
+
+    def __init__(self, window, publish):
+        self.window = window
+        self.publish = publish   # publish(delta, events) : diffusion par WSServer
+        self.version = 0
+        self.users = {}          # usernames publiés (dict : conserve l'ordre d'arrivée)
+        self.joined = {}
+        self.left = {}
+        self.events = []         # événements admin du lot en cours
+        self.timer = None
+        self.lock = threading.RLock()
+
+    def join(self, username, event=None):
+        with self.lock:
+            if username in self.left:
+                del self.left[username]
+            elif username not in self.users:
+                self.joined[username] = None
+            self.record(event)
+
+    def leave(self, username, event=None):
+        with self.lock:
+            if username in self.joined:
+                del self.joined[username]
+            elif username in self.users:
+                self.left[username] = None
+            self.record(event)
+
+    def event(self, event):
+        """Événement admin sans changement de la liste (ex. venu d'un autre serveur)"""
+        with self.lock:
+            self.record(event)
+
+    def record(self, event):
+        if event is not None:
+            self.events.append(event)
+        if self.window:
+            if self.timer is None:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        else:
+            self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            return {'version': self.version, 'users': list(self.users)}
+
+    def flush(self):
+        """Publie le lot en cours ; la version n'avance que si la liste a changé"""
+        with self.lock:
+            self.timer = None
+            delta = None
+            if self.joined or self.left:
+                self.version += 1
+                for username in self.left:
+                    del self.users[username]
+                self.users.update(self.joined)
+                delta = {'version': self.version, 'joined': list(self.joined), 'left': list(self.left)}
+            events = self.events
+            self.joined, self.left, self.events = {}, {}, []
+            if delta or events:
+                # Publication sous le verrou : les deltas partent dans l'ordre des versions
+                self.publish(delta, events)
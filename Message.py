@@ -1,4 +1,10 @@
+import base64
 import json
+import re
+import struct
+
+import Codec
+import SensorCodec
 
 class ENVOI_TYPE:
     TEXT = "ENVOI_TEXT"
@@ -7,6 +13,13 @@ class ENVOI_TYPE:
     VIDEO = "ENVOI_VIDEO"
     SENSOR = "ENVOI_SENSOR"
     CLIENT_LIST = "ENVOI_CLIENT_LIST"
+    CHUNK = "ENVOI_CHUNK"
+    CHUNK_ACK = "ENVOI_CHUNK_ACK"
+    SUBSCRIBE = "ENVOI_SUBSCRIBE"      # value = {'sensor_ids': [...], 'emitters': [...]}
+    UNSUBSCRIBE = "ENVOI_UNSUBSCRIBE"
+    ROOM_CREATE = "ENVOI_ROOM_CREATE"  # value = nom du salon ; on l'adresse ensuite avec receiver="#nom"
+    ROOM_JOIN = "ENVOI_ROOM_JOIN"
+    ROOM_LEAVE = "ENVOI_ROOM_LEAVE"
  
 class RECEPTION_TYPE:
     TEXT = "RECEPTION_TEXT"
@@ -15,12 +28,19 @@ class RECEPTION_TYPE:
     VIDEO = "RECEPTION_VIDEO"
     SENSOR = "RECEPTION_SENSOR"
     CLIENT_LIST = "RECEPTION_CLIENT_LIST"
+    MEMBERSHIP = "RECEPTION_MEMBERSHIP"  # {'version', 'users'} (instantané) ou {'version', 'joined', 'left'} (delta)
+    CHUNK = "RECEPTION_CHUNK"
+    CHUNK_ACK = "RECEPTION_CHUNK_ACK"
  
 class ADMIN_TYPE:
     ROUTING_LOG = "ADMIN_ROUTING_LOG"
+    ROUTING_BATCH = "ADMIN_ROUTING_BATCH"  # lot de notifications de routage : [{'emitter', 'receiver', 'message_type', 'timestamp'}]
+    FILTER = "ADMIN_FILTER"  # admin -> serveur : {'message_types': [...], 'emitters': [...], 'sample': 0.1}
     CLIENT_CONNECTED = "ADMIN_CLIENT_CONNECTED"
     CLIENT_DISCONNECTED = "ADMIN_CLIENT_DISCONNECTED"
     CLIENT_LIST_FULL = "ADMIN_CLIENT_LIST_FULL"
+    CLIENT_EVENTS = "ADMIN_CLIENT_EVENTS"  # lot de connexions/déconnexions : [{'event', 'username', ...}]
+    REAPED = "ADMIN_REAPED"  # connexions fermées faute de réponse au ping : {'count', 'usernames', 'total'}
  
 class SENSOR_ID:
     LIGHT = "LIGHT"
@@ -29,6 +49,7 @@ class SENSOR_ID:
     TEMPERATURE = "TEMPERATURE"
     RFID = "RFID"
     LED = "LED"
+    ACCELEROMETER = "ACCELEROMETER"
  
 class MessageType:
     DECLARATION = "DECLARATION"
@@ -37,15 +58,114 @@ class MessageType:
     WARNING = "WARNING"
     SYS_MESSAGE = "SYS_MESSAGE"
     ADMIN = ADMIN_TYPE
+
+class CAPABILITY:
+    BINARY = "binary"  # médias en trames binaires (voir Message.to_binary)
+    MEMBERSHIP = "membership_deltas"  # liste des clients en deltas versionnés (RECEPTION_MEMBERSHIP)
+    ACK = "cumulative_ack"  # accusés cumulés {'ack': n} au lieu d'un "MESSAGE OK" par message
+    REPLAY = "replay"  # reprise après coupure : DECLARATION {'resume': dernier numéro vu}, le serveur rejoue le trou
+    GATEWAY = "gateway"  # plusieurs appareils sur une connexion : DECLARATION {'devices': [...]}, SYS {'attach'/'detach': [...]}
+
+# Messages numérotés par connexion. Le numéro n'est pas transmis : serveur et client comptent ces
+# messages dans l'ordre où ils passent sur la socket (le serveur à l'écriture, après les priorités
+# et les abandons de l'Outbox), la trame reste donc la même pour tous les destinataires
+SEQUENCED_TYPES = frozenset((RECEPTION_TYPE.TEXT, RECEPTION_TYPE.IMAGE, RECEPTION_TYPE.AUDIO, RECEPTION_TYPE.VIDEO))
+
+# Préfixe historique des médias en base64 dans le JSON ("IMG:<base64>")
+MEDIA_PREFIX = {
+    ENVOI_TYPE.IMAGE: "IMG",
+    ENVOI_TYPE.AUDIO: "AUDIO",
+    ENVOI_TYPE.VIDEO: "VIDEO",
+    RECEPTION_TYPE.IMAGE: "IMG",
+    RECEPTION_TYPE.AUDIO: "AUDIO",
+    RECEPTION_TYPE.VIDEO: "VIDEO",
+}
+
+# Format binaire : en-tête compact suivi des octets bruts du média
+#   version(1) type(1) len(emitter)(1) len(receiver)(1) len(mime)(1) len(payload)(4)
+#   emitter | receiver | mime | payload
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("!BBBBBI")
+BINARY_TYPE_CODES = {
+    ENVOI_TYPE.IMAGE: 1,
+    ENVOI_TYPE.AUDIO: 2,
+    ENVOI_TYPE.VIDEO: 3,
+    RECEPTION_TYPE.IMAGE: 4,
+    RECEPTION_TYPE.AUDIO: 5,
+    RECEPTION_TYPE.VIDEO: 6,
+    ENVOI_TYPE.CHUNK: 7,
+    RECEPTION_TYPE.CHUNK: 8,
+    ENVOI_TYPE.SENSOR: 9,
+    RECEPTION_TYPE.SENSOR: 10,
+}
+BINARY_TYPES = {code: message_type for message_type, code in BINARY_TYPE_CODES.items()}
+
+# Morceau d'un transfert découpé (voir Transfer.py), placé après les chaînes de l'en-tête :
+#   id(16) index(4) count(4) chunk_size(4) size(8) crc32(4) media(1)
+CHUNK_TYPES = (ENVOI_TYPE.CHUNK, RECEPTION_TYPE.CHUNK)
+CHUNK_HEADER = struct.Struct("!16sIIIQIB")
+
+# Les métadonnées d'un morceau viennent de l'émetteur : id sert de nom de fichier chez le destinataire
+TRANSFER_ID = re.compile(r"[0-9a-f]{32}")   # uuid4().hex, voir Transfer.OutgoingTransfer
+MAX_CHUNK_COUNT = 0xFFFFFFFF                 # champ count de CHUNK_HEADER
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+CHUNK_MEDIA = (ENVOI_TYPE.IMAGE, ENVOI_TYPE.AUDIO, ENVOI_TYPE.VIDEO)
+
+
+def bounded_int(value, low, high):
+    return isinstance(value, int) and not isinstance(value, bool) and low <= value <= high
+
+
+def transfer_error(transfer):
+    """Raison du refus des métadonnées d'un morceau, ou None si elles sont valides"""
+    if not isinstance(transfer, dict):
+        return "transfer manquant"
+    if not isinstance(transfer.get('id'), str) or not TRANSFER_ID.fullmatch(transfer['id']):
+        return "id de transfert invalide"
+    if not bounded_int(transfer.get('count'), 1, MAX_CHUNK_COUNT) \
+            or not bounded_int(transfer.get('chunk_size'), 1, MAX_CHUNK_SIZE):
+        return "count ou chunk_size invalide"
+    if not bounded_int(transfer.get('index'), 0, transfer['count'] - 1):
+        return "index invalide"
+    if not bounded_int(transfer.get('size'), 0, transfer['count'] * transfer['chunk_size']) \
+            or not bounded_int(transfer.get('crc'), 0, 0xFFFFFFFF):
+        return "size ou crc invalide"
+    if transfer.get('media') not in CHUNK_MEDIA:
+        return "media invalide"
+    return None
+
+# Mesure d'un capteur (voir SensorCodec), placée après les chaînes de l'en-tête :
+#   version de l'encodage(1) code du capteur(1), suivis des valeurs empaquetées selon standard.json
+SENSOR_TYPES = (ENVOI_TYPE.SENSOR, RECEPTION_TYPE.SENSOR)
+SENSOR_HEADER = struct.Struct("!BB")
+
+# ENVOI_X -> RECEPTION_X, déduit des deux classes : un type ajouté des deux côtés (comme dans
+# standard.json) est relayé par le serveur sans autre changement
+RECEPTION_FOR = {
+    getattr(ENVOI_TYPE, name): getattr(RECEPTION_TYPE, name)
+    for name in vars(ENVOI_TYPE)
+    if not name.startswith("_") and hasattr(RECEPTION_TYPE, name)
+}
  
 
 class Message:
-    def __init__(self, message_type: MessageType, value, emitter, receiver=None,sensor_id=None):
+    __slots__ = ("message_type", "value", "emitter", "receiver", "sensor_id", "mime", "transfer")
+
+    def __init__(self, message_type: MessageType, value, emitter, receiver=None,sensor_id=None, mime=None, transfer=None):
         self.message_type = message_type
         self.value = value
         self.emitter = emitter
         self.receiver = receiver
         self.sensor_id = sensor_id
+        self.mime = mime
+        self.transfer = transfer  # métadonnées d'un transfert découpé (id, index, count, chunk_size, size, crc, media)
+
+    def is_binary(self):
+        """Vrai si value contient les octets bruts d'un média, ou une mesure conforme à son schéma
+        (transportable en trame binaire)"""
+        if self.message_type in SENSOR_TYPES:
+            return SensorCodec.can_pack(self.sensor_id, self.value)
+        return isinstance(self.value, (bytes, bytearray, memoryview)) and self.message_type in BINARY_TYPE_CODES
 
     @staticmethod
     def default_message():
@@ -53,27 +173,218 @@ class Message:
 
     @staticmethod
     def from_json(json_data):
-        data = json.loads(json_data)
+        """Décode un message JSON (texte ou octets UTF-8) avec le codec courant"""
+        data = Codec.codec.loads(json_data)
         message_type = data['message_type']
         emitter = data['data']['emitter']
         receiver = data['data'].get('receiver', None)
         value = data['data']['value']
         sensor_id = data['data'].get('sensor_id', None)
-        return Message(message_type, value, emitter, receiver, sensor_id)
+        transfer = data['data'].get('transfer', None)
+        mime = data['data'].get('mime', None)
+        if message_type in CHUNK_TYPES:
+            value = base64.b64decode(value)
+        return Message(message_type, value, emitter, receiver, sensor_id, mime=mime, transfer=transfer)
+
+    @staticmethod
+    def from_binary(binary_data):
+        version, type_code, emitter_len, receiver_len, mime_len, payload_len = BINARY_HEADER.unpack_from(binary_data)
+        if version != BINARY_VERSION or type_code not in BINARY_TYPES:
+            raise ValueError(f"Trame binaire invalide (version={version}, type={type_code})")
+        offset = BINARY_HEADER.size
+        emitter = bytes(binary_data[offset:offset + emitter_len]).decode("utf-8")
+        offset += emitter_len
+        receiver = bytes(binary_data[offset:offset + receiver_len]).decode("utf-8") or None
+        offset += receiver_len
+        mime = bytes(binary_data[offset:offset + mime_len]).decode("utf-8") or None
+        offset += mime_len
+        message_type = BINARY_TYPES[type_code]
+        transfer = None
+        if message_type in CHUNK_TYPES:
+            transfer_id, index, count, chunk_size, size, crc, media = CHUNK_HEADER.unpack_from(binary_data, offset)
+            transfer = {'id': transfer_id.hex(), 'index': index, 'count': count, 'chunk_size': chunk_size,
+                        'size': size, 'crc': crc, 'media': BINARY_TYPES.get(media)}
+            offset += CHUNK_HEADER.size
+        if message_type in SENSOR_TYPES:
+            encoding, code = SENSOR_HEADER.unpack_from(binary_data, offset)
+            if encoding != SensorCodec.VERSION or code not in SensorCodec.SENSORS_BY_CODE:
+                raise ValueError(f"Mesure binaire invalide (encodage={encoding}, capteur={code})")
+            sensor_id = SensorCodec.SENSORS_BY_CODE[code]
+            value = SensorCodec.unpack(sensor_id, binary_data, offset + SENSOR_HEADER.size, payload_len)
+            return Message(message_type, value, emitter, receiver, sensor_id=sensor_id)
+        value = bytes(binary_data[offset:offset + payload_len])
+        return Message(message_type, value, emitter, receiver, mime=mime, transfer=transfer)
+
+    def to_binary(self):
+        emitter = (self.emitter or "").encode("utf-8")
+        receiver = (self.receiver or "").encode("utf-8")
+        mime = (self.mime or "").encode("utf-8")
+        value = self.value
+        extra_header = b""
+        if self.message_type in CHUNK_TYPES:
+            t = self.transfer
+            extra_header = CHUNK_HEADER.pack(bytes.fromhex(t['id']), t['index'], t['count'], t['chunk_size'],
+                                             t['size'], t['crc'], BINARY_TYPE_CODES[t['media']])
+        elif self.message_type in SENSOR_TYPES:
+            value = SensorCodec.pack(self.sensor_id, value)
+            extra_header = SENSOR_HEADER.pack(SensorCodec.VERSION, SensorCodec.SENSOR_CODES[self.sensor_id])
+        header = BINARY_HEADER.pack(BINARY_VERSION, BINARY_TYPE_CODES[self.message_type],
+                                    len(emitter), len(receiver), len(mime), len(value))
+        return b"".join((header, emitter, receiver, mime, extra_header, value))
 
     def to_json(self):
+        """Encode le message avec le codec courant : str (json) ou octets UTF-8 (orjson, msgspec)"""
+        value = self.value
+        if isinstance(value, (bytes, bytearray, memoryview)) and self.message_type in BINARY_TYPE_CODES:
+            # Client historique : on retombe sur "IMG:<base64>" dans le JSON
+            value = base64.b64encode(value).decode('utf-8')
+            if self.message_type in MEDIA_PREFIX:
+                value = f"{MEDIA_PREFIX[self.message_type]}:{value}"
         data = {
             'message_type': self.message_type,
             'data': {
                 'emitter': self.emitter,
                 'receiver': self.receiver,
-                'value': self.value
             }
         }
         if self.sensor_id:
             data['data']['sensor_id'] = self.sensor_id
+        if self.transfer:
+            data['data']['transfer'] = self.transfer
+        if self.mime:
+            data['data']['mime'] = self.mime
+        # value en dernier : l'en-tête se lit sans parcourir le contenu (voir Envelope)
+        data['data']['value'] = value
  
-        return json.dumps(data)
+        return Codec.codec.dumps(data)
+
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class Envelope:
+    """En-tête d'un message reçu (type, émetteur, destinataire...) lu sans matérialiser value
+
+    Pour le JSON, les clés de "data" sont lues dans l'ordre jusqu'à "value" : ce qui suit
+    (plusieurs Mo de base64) n'est ni décodé ni recopié dans un objet Python. Pour une trame
+    binaire, seul l'en-tête fixe est lu. retyped() renvoie la charge utile d'origine avec
+    seulement le type réécrit (ENVOI_* -> RECEPTION_*), prête à relayer telle quelle.
+    """
+
+    __slots__ = ("raw", "message_type", "emitter", "receiver", "sensor_id", "transfer", "type_span")
+
+    def __init__(self, raw, message_type, emitter, receiver, sensor_id=None, transfer=None, type_span=None):
+        self.raw = raw
+        self.message_type = message_type
+        self.emitter = emitter
+        self.receiver = receiver
+        self.sensor_id = sensor_id
+        self.transfer = transfer
+        self.type_span = type_span   # (début, fin) du type dans le JSON
+
+    def is_binary(self):
+        return not isinstance(self.raw, str)
+
+    def __len__(self):
+        return len(self.raw)
+
+    @staticmethod
+    def peek(raw):
+        """Envelope du message, ou None si l'en-tête ne précède pas value (à décoder en entier)"""
+        try:
+            if isinstance(raw, str):
+                return Envelope.peek_json(raw)
+            if bytes(raw[:1]) == b"{":
+                # JSON en octets UTF-8 (to_json avec orjson, msgspec) ; une trame binaire commence par sa version
+                return Envelope.peek_json(bytes(raw).decode("utf-8"))
+            return Envelope.peek_binary(raw)
+        except (ValueError, KeyError, IndexError, struct.error):
+            return None
+
+    @staticmethod
+    def peek_json(text):
+        pos = Envelope.expect(text, 0, "{")
+        key, pos = Envelope.decode(text, pos)
+        if key != 'message_type':
+            return None
+        pos = Envelope.expect(text, pos, ":")
+        type_start = Envelope.skip(text, pos)
+        message_type, pos = Envelope.decode(text, type_start)
+        type_span = (type_start, pos)
+        pos = Envelope.expect(text, pos, ",")
+        key, pos = Envelope.decode(text, pos)
+        if key != 'data':
+            return None
+        pos = Envelope.expect(text, Envelope.expect(text, pos, ":"), "{")
+        fields = {}
+        while True:
+            key, pos = Envelope.decode(text, pos)
+            pos = Envelope.expect(text, pos, ":")
+            if key == 'value':
+                break
+            fields[key], pos = Envelope.decode(text, pos)
+            pos = Envelope.skip(text, pos)
+            if text[pos] != ",":
+                return None
+            pos += 1
+        # Clés dans un autre ordre (value avant receiver...) : décodage complet par from_json
+        if 'emitter' not in fields or 'receiver' not in fields \
+                or (message_type in SENSOR_TYPES and 'sensor_id' not in fields):
+            return None
+        return Envelope(text, message_type, fields.get('emitter'), fields.get('receiver'),
+                        fields.get('sensor_id'), fields.get('transfer'), type_span)
+
+    @staticmethod
+    def peek_binary(binary_data):
+        version, type_code, emitter_len, receiver_len, mime_len, payload_len = BINARY_HEADER.unpack_from(binary_data)
+        if version != BINARY_VERSION or type_code not in BINARY_TYPES:
+            return None
+        offset = BINARY_HEADER.size
+        emitter = bytes(binary_data[offset:offset + emitter_len]).decode("utf-8")
+        offset += emitter_len
+        receiver = bytes(binary_data[offset:offset + receiver_len]).decode("utf-8") or None
+        offset += receiver_len + mime_len
+        message_type = BINARY_TYPES[type_code]
+        transfer = None
+        if message_type in CHUNK_TYPES:
+            transfer_id, index, count, chunk_size, size, crc, media = CHUNK_HEADER.unpack_from(binary_data, offset)
+            transfer = {'id': transfer_id.hex(), 'index': index, 'count': count, 'chunk_size': chunk_size,
+                        'size': size, 'crc': crc, 'media': BINARY_TYPES.get(media)}
+        sensor_id = None
+        if message_type in SENSOR_TYPES:
+            # Nécessaire pour router vers les abonnés de ce flux
+            sensor_id = SensorCodec.SENSORS_BY_CODE[SENSOR_HEADER.unpack_from(binary_data, offset)[1]]
+        return Envelope(binary_data, message_type, emitter, receiver, sensor_id=sensor_id, transfer=transfer)
+
+    @staticmethod
+    def skip(text, pos):
+        while text[pos] in _WHITESPACE:
+            pos += 1
+        return pos
+
+    @staticmethod
+    def expect(text, pos, char):
+        pos = Envelope.skip(text, pos)
+        if text[pos] != char:
+            raise ValueError(f"'{char}' attendu à la position {pos}")
+        return pos + 1
+
+    @staticmethod
+    def decode(text, pos):
+        return _decoder.raw_decode(text, Envelope.skip(text, pos))
+
+    def retyped(self, message_type):
+        """Charge utile d'origine avec le seul type remplacé"""
+        if self.is_binary():
+            return b"".join((self.raw[:1], bytes((BINARY_TYPE_CODES[message_type],)), self.raw[2:]))
+        start, end = self.type_span
+        return "".join((self.raw[:start], json.dumps(message_type), self.raw[end:]))
+
+    def to_message(self, message_type=None):
+        """Message complet (décodage de value), pour les destinataires qui ont besoin d'un autre format"""
+        raw = self.retyped(message_type) if message_type else self.raw
+        return Message.from_binary(raw) if self.is_binary() else Message.from_json(raw)
 
 message = Message(MessageType.DECLARATION, emitter="System", receiver="All", value="This is a test message")
 messageRebuild = Message.from_json(message.to_json())
@@ -0,0 +1,365 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Enregistrement : en-tête, destinataire (UTF-8), charge utile (message RECEPTION_* tel qu'envoyé)
+#   len(payload)(4) crc32(4) id(8) horodatage(8) flags(1) len(receiver)(2)
+RECORD = struct.Struct("!IIQdBH")
+FLAG_BINARY = 1
+FSYNC_POLICIES = ("always", "interval", "never")
+# Répertoire privé de l'utilisateur : le journal contient les messages des clients
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".ws_offline")
+
+
+class Segment:
+    """Un fichier du journal ; lu par mmap (relu en entier seulement s'il a grandi depuis)"""
+
+    def __init__(self, directory, number):
+        self.number = number
+        self.path = os.path.join(directory, f"{number:012d}.log")
+        self.size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        self.records = 0         # enregistrements écrits dans ce segment
+        self.live = 0            # ... pas encore livrés ni écartés
+        self.min_id = None       # plus petit id présent (les copies de compaction gardent leur id)
+        self.map = None
+
+    def add(self, record_id, live=True):
+        self.records += 1
+        self.live += live
+        if self.min_id is None or record_id < self.min_id:
+            self.min_id = record_id
+
+    def read(self, position, length):
+        if self.map is None or len(self.map) < position + length:
+            self.close()
+            with open(self.path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map[position:position + length]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+class OfflineStore:
+    """Messages directs pour des destinataires hors ligne, dans un journal segmenté sur disque
+
+    Les charges utiles ne restent pas en mémoire : l'index par destinataire ne garde que leur
+    position (segment, offset, taille). Chaque destinataire est servi dans l'ordre, donc un
+    curseur par destinataire (dernier id livré ou écarté, dans cursors.json) suffit à savoir
+    ce qui reste. Un segment dont tout a été livré est supprimé ; un segment clos presque vide
+    (moins de compact_ratio d'enregistrements vivants) est compacté : ses enregistrements
+    vivants sont recopiés à la fin du journal avec le même id, puis le fichier est supprimé.
+
+    fsync : 'always' (dès chaque message), 'interval' (au plus toutes les fsync_interval s),
+    'never' (laissé au système). Les fsync sont faits par un thread dédié : append() ne bloque
+    jamais sur le disque (il peut être appelé depuis la boucle asyncio).
+
+    Le répertoire est créé en 0700 et verrouillé (fichier lock) : un seul processus par journal,
+    un second OfflineStore sur le même répertoire lève RuntimeError.
+    """
+
+    def __init__(self, directory=None, segment_size=16 * 1024 * 1024, fsync="interval", fsync_interval=1.0,
+                 max_age=7 * 24 * 3600, max_bytes=256 * 1024 * 1024, max_per_receiver=1000, compact_ratio=0.25):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Politique fsync inconnue '{fsync}', attendu parmi {FSYNC_POLICIES}")
+        self.directory = directory or DEFAULT_DIRECTORY
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        os.chmod(self.directory, 0o700)
+        self.lock_file = self.acquire()
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.max_per_receiver = max_per_receiver
+        self.compact_ratio = compact_ratio
+        self.cursors_path = os.path.join(self.directory, "cursors.json")
+        self.index = {}          # destinataire -> deque([id, segment, position, taille, horodatage, binaire])
+        self.cursors = {}        # destinataire -> dernier id livré ou écarté
+        self.segments = {}       # numéro -> Segment, dans l'ordre
+        self.next_id = 1
+        self.bytes = 0           # taille des enregistrements en attente
+        self.dropped = 0
+        self.active = None
+        self.file = None
+        self.lock = threading.RLock()
+        # Thread de fsync : fichiers écrits depuis le dernier fsync, segments clos à synchroniser puis fermer
+        self.sync_cond = threading.Condition()   # signal seulement, jamais tenu pendant un fsync
+        self.fsync_lock = threading.Lock()       # un fichier n'est pas fermé pendant son fsync
+        self.dirty = False
+        self.retired = []
+        self.closed = False
+        self.load()
+        self.syncer = threading.Thread(target=self.sync_loop, daemon=True, name="offline-fsync")
+        self.syncer.start()
+
+    def acquire(self):
+        """Verrou exclusif du répertoire, gardé jusqu'à close()"""
+        lock_file = open(os.path.join(self.directory, "lock"), "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                raise RuntimeError(f"Journal hors ligne {self.directory} déjà utilisé par un autre processus") from None
+        return lock_file
+
+    # --- Ouverture ---
+
+    def load(self):
+        """Reconstruit l'index en relisant les segments (un enregistrement tronqué en fin de fichier est coupé)"""
+        if os.path.exists(self.cursors_path):
+            with open(self.cursors_path, "r", encoding="utf-8") as f:
+                self.cursors = json.load(f)
+        numbers = sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".log") and name[:-4].isdigit())
+        seen = set()
+        for number in numbers:
+            segment = self.segments[number] = Segment(self.directory, number)
+            position = 0
+            size = segment.size
+            while position + RECORD.size <= size:
+                payload_len, crc, record_id, stamp, flags, receiver_len = RECORD.unpack_from(segment.read(position, RECORD.size))
+                end = position + RECORD.size + receiver_len + payload_len
+                if end > size or zlib.crc32(segment.read(position + RECORD.size, end - position - RECORD.size)) != crc:
+                    break
+                receiver = segment.read(position + RECORD.size, receiver_len).decode("utf-8")
+                self.next_id = max(self.next_id, record_id + 1)
+                # Copie laissée par une compaction interrompue : même id, on garde la première
+                live = record_id > self.cursors.get(receiver, 0) and record_id not in seen
+                segment.add(record_id, live)
+                if live:
+                    seen.add(record_id)
+                    self.index.setdefault(receiver, []).append([record_id, number, position, end - position, stamp, bool(flags & FLAG_BINARY)])
+                    self.bytes += end - position
+                position = end
+            segment.close()
+            if position < size:
+                with open(segment.path, "r+b") as f:
+                    f.truncate(position)
+                segment.size = position
+        self.index = {receiver: deque(sorted(entries)) for receiver, entries in self.index.items()}
+        self.open_active(numbers[-1] if numbers else 0)
+        with self.lock:
+            self.maintain()
+
+    def open_active(self, number):
+        if self.file is not None:
+            # Segment clos : synchronisé puis fermé par le thread de fsync
+            with self.sync_cond:
+                self.retired.append(self.file)
+                self.sync_cond.notify()
+        if number not in self.segments:
+            self.segments[number] = Segment(self.directory, number)
+        self.active = self.segments[number]
+        self.file = open(self.active.path, "ab")
+
+    # --- Écriture ---
+
+    def append(self, receiver, payload, binary=False):
+        """Ajoute un message pour receiver ; écarte les plus anciens au-delà des limites de rétention"""
+        with self.lock:
+            entry = self.write(receiver, self.next_id, time.time(), payload, binary)
+            self.next_id += 1
+            self.index.setdefault(receiver, deque()).append(entry)
+            if len(self.index[receiver]) > self.max_per_receiver:
+                self.discard(receiver, len(self.index[receiver]) - self.max_per_receiver)
+                self.save_cursors(durable=False)
+            if self.bytes > self.max_bytes:
+                while self.bytes > self.max_bytes:
+                    # Destinataire dont le plus ancien message est le plus vieux
+                    oldest = min(self.index, key=lambda r: self.index[r][0][0])
+                    self.discard(oldest, 1)
+                self.save_cursors(durable=False)
+
+    def write(self, receiver, record_id, stamp, payload, binary):
+        if self.active.size >= self.segment_size:
+            self.open_active(self.active.number + 1)
+        receiver_bytes = receiver.encode("utf-8")
+        body = receiver_bytes + bytes(payload)
+        header = RECORD.pack(len(body) - len(receiver_bytes), zlib.crc32(body), record_id, stamp,
+                             FLAG_BINARY if binary else 0, len(receiver_bytes))
+        segment = self.active
+        position = segment.size
+        self.file.write(header + body)
+        self.file.flush()
+        segment.size += len(header) + len(body)
+        segment.add(record_id)
+        self.bytes += len(header) + len(body)
+        if self.fsync != "never":
+            with self.sync_cond:
+                self.dirty = True
+                if self.fsync == "always":
+                    self.sync_cond.notify()
+        return [record_id, segment.number, position, len(header) + len(body), stamp, binary]
+
+    def sync_loop(self):
+        """fsync en arrière-plan : dès l'écriture ('always') ou toutes les fsync_interval secondes"""
+        while True:
+            with self.sync_cond:
+                if not self.retired and not (self.dirty and self.fsync == "always"):
+                    self.sync_cond.wait(None if self.fsync == "never" else self.fsync_interval)
+                if self.closed:
+                    return
+                retired, self.retired = self.retired, []
+                dirty, self.dirty = self.dirty, False
+            with self.fsync_lock:
+                for f in retired:
+                    if self.fsync != "never":
+                        os.fsync(f.fileno())
+                    f.close()
+                if dirty and self.file is not None:
+                    os.fsync(self.file.fileno())
+
+    def sync(self):
+        """fsync immédiat de tout ce qui a été écrit (compaction, fermeture), sur le thread appelant"""
+        with self.sync_cond:
+            retired, self.retired = self.retired, []
+            self.dirty = False
+        with self.fsync_lock:
+            for f in retired:
+                os.fsync(f.fileno())
+                f.close()
+            if self.file is not None:
+                os.fsync(self.file.fileno())
+
+    def save_cursors(self, durable=True):
+        """Remplacement atomique : un crash laisse l'ancienne version ou la nouvelle
+
+        durable=False depuis append() : pas de fsync sur le thread qui écrit (au pire, après un crash,
+        des messages déjà écartés par la rétention sont encore présents)"""
+        path = self.cursors_path + ".tmp"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.cursors, f)
+            if durable and self.fsync == "always":
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(path, self.cursors_path)
+
+    # --- Lecture ---
+
+    def has(self, receiver):
+        return bool(self.index.get(receiver))
+
+    def pending(self, receiver):
+        queue = self.index.get(receiver)
+        return len(queue) if queue else 0
+
+    def take(self, receiver, limit=64):
+        """Retire jusqu'à limit messages de receiver, dans l'ordre : [(charge utile, binaire)]"""
+        with self.lock:
+            queue = self.index.get(receiver)
+            if not queue:
+                return []
+            taken = []
+            while queue and len(taken) < limit:
+                record_id, number, position, length, stamp, binary = queue[0]
+                record = self.segments[number].read(position, length)
+                receiver_len = RECORD.unpack_from(record)[5]
+                taken.append((record[RECORD.size + receiver_len:], binary))
+                self.discard(receiver, 1, count_dropped=False)
+            self.save_cursors()
+            self.maintain()
+            return taken
+
+    def discard(self, receiver, count, count_dropped=True):
+        queue = self.index[receiver]
+        for _ in range(min(count, len(queue))):
+            record_id, number, _, length, _, _ = queue.popleft()
+            self.cursors[receiver] = record_id
+            self.segments[number].live -= 1
+            self.bytes -= length
+            if count_dropped:
+                self.dropped += 1
+        if not queue:
+            del self.index[receiver]
+
+    # --- Rétention et compaction ---
+
+    def maintain(self):
+        """Écarte les messages trop vieux, supprime les segments vides et compacte les segments clairsemés"""
+        with self.lock:
+            deadline = time.time() - self.max_age
+            changed = False
+            for receiver in list(self.index):
+                queue = self.index[receiver]
+                expired = 0
+                while expired < len(queue) and queue[expired][4] < deadline:
+                    expired += 1
+                if expired:
+                    self.discard(receiver, expired)
+                    changed = True
+            for number, segment in list(self.segments.items()):
+                if segment is self.active:
+                    continue
+                if segment.live == 0:
+                    self.remove_segment(number)
+                elif segment.live < segment.records * self.compact_ratio:
+                    self.compact(segment)
+            # Curseur inutile quand plus aucun segment ne contient d'enregistrement de ce destinataire
+            floor = min((s.min_id for s in self.segments.values() if s.min_id is not None), default=self.next_id)
+            stale = [receiver for receiver, cursor in self.cursors.items() if cursor < floor and receiver not in self.index]
+            for receiver in stale:
+                del self.cursors[receiver]
+            if changed or stale:
+                self.save_cursors()
+
+    def compact(self, segment):
+        relocated = []
+        for receiver, queue in self.index.items():
+            for entry in queue:
+                if entry[1] == segment.number:
+                    relocated.append((receiver, entry))
+        for receiver, entry in relocated:
+            record_id, number, position, length, stamp, binary = entry
+            record = segment.read(position, length)
+            receiver_len = RECORD.unpack_from(record)[5]
+            entry[:] = self.write(receiver, record_id, stamp, record[RECORD.size + receiver_len:], binary)
+            segment.live -= 1
+            self.bytes -= length
+        # Les copies sont sur disque avant de supprimer l'original
+        self.sync()
+        self.remove_segment(segment.number)
+
+    def remove_segment(self, number):
+        segment = self.segments.pop(number)
+        segment.close()
+        os.remove(segment.path)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'receivers': len(self.index),
+                'pending': sum(len(q) for q in self.index.values()),
+                'bytes': self.bytes,
+                'segments': len(self.segments),
+                'dropped': self.dropped,
+            }
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.sync()
+                with self.sync_cond:
+                    self.closed = True
+                    self.sync_cond.notify()
+                with self.fsync_lock:
+                    self.file.close()
+                    self.file = None
+            for segment in self.segments.values():
+                segment.close()
+            if self.lock_file is not None:
+                # Fermer le fichier libère le verrou
+                self.lock_file.close()
+                self.lock_file = None
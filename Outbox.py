@@ -0,0 +1,249 @@
+import threading
+import time
+from collections import deque
+
+from Message import MessageType
+
+# Classe de trafic d'un message sortant : choisit sa voie de priorité et la politique appliquée quand la file est pleine
+CONTROL = "control"
+SENSOR = "sensor"
+TEXT = "text"
+MEDIA = "media"
+
+# Ordre de service des voies : la première non vide passe en premier
+LANES = (CONTROL, SENSOR, TEXT, MEDIA)
+
+TRAFFIC_CLASS = {
+    MessageType.SYS_MESSAGE: CONTROL,
+    MessageType.WARNING: CONTROL,
+    MessageType.RECEPTION.CLIENT_LIST: CONTROL,
+    MessageType.RECEPTION.MEMBERSHIP: CONTROL,
+    MessageType.RECEPTION.CHUNK_ACK: CONTROL,
+    MessageType.ADMIN.ROUTING_LOG: CONTROL,
+    MessageType.ADMIN.ROUTING_BATCH: CONTROL,
+    MessageType.ADMIN.CLIENT_CONNECTED: CONTROL,
+    MessageType.ADMIN.CLIENT_DISCONNECTED: CONTROL,
+    MessageType.ADMIN.CLIENT_LIST_FULL: CONTROL,
+    MessageType.ADMIN.CLIENT_EVENTS: CONTROL,
+    MessageType.ADMIN.REAPED: CONTROL,
+    MessageType.RECEPTION.SENSOR: SENSOR,
+    MessageType.RECEPTION.TEXT: TEXT,
+    MessageType.RECEPTION.IMAGE: MEDIA,
+    MessageType.RECEPTION.AUDIO: MEDIA,
+    MessageType.RECEPTION.VIDEO: MEDIA,
+    MessageType.RECEPTION.CHUNK: MEDIA,
+}
+
+# Politique quand la file est pleine : (action, timeout en secondes)
+#   drop_oldest : jette la plus ancienne trame de la même classe (télémétrie : seule la dernière compte)
+#   block       : attend de la place jusqu'au timeout, puis abandonne la trame
+#   disconnect  : coupe le client, il ne suit pas
+DEFAULT_POLICIES = {
+    CONTROL: ("block", 1.0),
+    SENSOR: ("drop_oldest", 0),
+    TEXT: ("block", 2.0),
+    MEDIA: ("block", 5.0),
+}
+
+
+def traffic_class(message_type):
+    return TRAFFIC_CLASS.get(message_type, TEXT)
+
+
+class Lane:
+    """File d'une classe de trafic + mesure du temps passé en file"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.queue = deque()     # (instant de mise en file, trame, numérotée)
+        self.sent = 0
+        self.dropped = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def stats(self):
+        return {
+            'depth': len(self.queue),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'avg_wait_ms': round(self.total_wait / self.sent * 1000, 3) if self.sent else 0.0,
+            'max_wait_ms': round(self.max_wait * 1000, 3),
+        }
+
+
+class Outbox:
+    """File sortante bornée d'une connexion, vidée par la couche I/O (thread ou tâche asyncio)
+
+    Une voie par classe de trafic, servies par priorité (LANES) : une commande LED ou une
+    mesure capteur passe devant les morceaux d'une vidéo déjà en file. Toutes les
+    starvation_every trames, la voie non vide la moins prioritaire est servie pour que les
+    médias avancent quand même sous un flux continu de télémétrie.
+    """
+
+    def __init__(self, max_frames=1000, max_bytes=32 * 1024 * 1024, policies=None, laggard_limit=3, on_laggard=None, starvation_every=16):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.policies = dict(DEFAULT_POLICIES)
+        if policies:
+            self.policies.update(policies)
+        # Nombre de débordements consécutifs (block expiré) avant de déconnecter le client
+        self.laggard_limit = laggard_limit
+        self.on_laggard = on_laggard
+        self.starvation_every = starvation_every
+        self.on_ready = None     # réveil du vidage (tâche asyncio), appelé après chaque ajout
+        self.lanes = {kind: Lane(kind) for kind in LANES}
+        self.length = 0
+        self.bytes = 0
+        self.closed = False
+        self.overflows = 0
+        self.pops = 0
+        # Numérotation implicite (voir Message.SEQUENCED_TYPES) : trames numérotées écrites, et
+        # dernier numéro acquitté par le client
+        self.delivered = 0
+        self.acked = 0
+        self.replay = None       # ReplayBuffer du username (voir Replay.py) : reçoit chaque trame numérotée écrite
+        self.replay_offset = 0
+        self.cond = threading.Condition()
+
+    def full(self, frame):
+        return self.length > 0 and (self.length >= self.max_frames or self.bytes + len(frame) > self.max_bytes)
+
+    def put(self, frame, kind=TEXT, can_block=True, sequenced=False):
+        """Ajoute une trame selon la politique de sa classe ; False si elle a été abandonnée
+
+        sequenced : la trame reçoit le numéro suivant au moment où elle sort de la file
+        """
+        action, timeout = self.policies.get(kind, DEFAULT_POLICIES[TEXT])
+        lane = self.lanes[kind]
+        with self.cond:
+            if self.closed:
+                return False
+            if self.full(frame):
+                if action == "drop_oldest":
+                    if lane.queue:
+                        _, dropped, _ = lane.queue.popleft()
+                        lane.dropped += 1
+                        self.length -= 1
+                        self.bytes -= len(dropped)
+                    if self.full(frame):
+                        # File pleine d'autres classes : la trame entrante est perdue, sans compter
+                        # comme un débordement (une mesure jetée ne fait pas déconnecter le client)
+                        lane.dropped += 1
+                        return False
+                elif action == "block" and can_block:
+                    deadline = time.monotonic() + timeout
+                    while self.full(frame) and not self.closed:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self.cond.wait(remaining)
+                if action == "disconnect" or self.full(frame):
+                    return self.overflow(kind)
+            lane.queue.append((time.monotonic(), frame, sequenced))
+            self.length += 1
+            self.bytes += len(frame)
+            self.cond.notify_all()
+        if self.on_ready:
+            self.on_ready()
+        return True
+
+    def overflow(self, kind):
+        self.lanes[kind].dropped += 1
+        self.overflows += 1
+        action = self.policies.get(kind, DEFAULT_POLICIES[TEXT])[0]
+        if action == "disconnect" or self.overflows >= self.laggard_limit:
+            self.closed = True
+            self.cond.notify_all()
+            if self.on_laggard:
+                self.on_laggard()
+        return False
+
+    def next_lane(self):
+        non_empty = [lane for lane in self.lanes.values() if lane.queue]
+        if not non_empty:
+            return None
+        self.pops += 1
+        if self.pops % self.starvation_every == 0:
+            return non_empty[-1]
+        return non_empty[0]
+
+    def pop(self, timeout=None):
+        """Retire la prochaine trame (voie la plus prioritaire) ; attend jusqu'à timeout si vide (None si rien)"""
+        with self.cond:
+            if not self.length and timeout:
+                self.cond.wait(timeout)
+            lane = self.next_lane()
+            if lane is None:
+                return None
+            queued_at, frame, sequenced = lane.queue.popleft()
+            if sequenced:
+                self.delivered += 1
+                if self.replay is not None:
+                    self.replay.append(frame, lane.kind, self)
+            wait = time.monotonic() - queued_at
+            lane.sent += 1
+            lane.total_wait += wait
+            lane.max_wait = max(lane.max_wait, wait)
+            self.length -= 1
+            self.bytes -= len(frame)
+            self.overflows = 0
+            self.cond.notify_all()
+            return frame
+
+    def attach_replay(self, replay):
+        """Enregistre désormais les trames numérotées dans replay ; renvoie l'offset flux du username - connexion"""
+        with self.cond:
+            with replay.lock:
+                replay.owner = self
+                self.replay = replay
+                self.replay_offset = replay.last_seq - self.delivered
+                return self.replay_offset
+
+    def release_replay(self):
+        """Fin de la connexion : confie les trames numérotées encore en file au tampon de rejeu, puis s'en détache"""
+        with self.cond:
+            self.keep_unsent()
+            self.replay = None
+
+    def keep_unsent(self):
+        if self.replay is None:
+            return
+        # Trames numérotées jamais écrites : gardées pour le rejeu, dans l'ordre de mise en file
+        unsent = sorted(((queued_at, frame, lane.kind) for lane in self.lanes.values()
+                         for queued_at, frame, sequenced in lane.queue if sequenced), key=lambda entry: entry[0])
+        for lane in self.lanes.values():
+            lane.queue = deque(entry for entry in lane.queue if not entry[2])
+        self.length -= len(unsent)
+        self.bytes -= sum(len(frame) for _, frame, _ in unsent)
+        for _, frame, kind in unsent:
+            self.replay.append(frame, kind, self)
+
+    def ack(self, seq):
+        """Accusé cumulé du client : il a reçu toutes les trames numérotées jusqu'à seq"""
+        with self.cond:
+            if self.acked < seq <= self.delivered:
+                self.acked = seq
+                if self.replay is not None:
+                    # Reçu par le client : plus besoin de le garder pour un rejeu
+                    self.replay.release(self.replay_offset + seq, self)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.keep_unsent()
+            for lane in self.lanes.values():
+                lane.queue.clear()
+            self.length = 0
+            self.bytes = 0
+            self.cond.notify_all()
+        if self.on_ready:
+            self.on_ready()
+
+    def stats(self):
+        return {
+            'queue_depth': self.length,
+            'queue_bytes': self.bytes,
+            'delivered': self.delivered,
+            'acked': self.acked,
+            'lanes': {kind: lane.stats() for kind, lane in self.lanes.items()},
+        }
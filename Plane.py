@@ -0,0 +1,380 @@
+import hmac
+import os
+import queue
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+import Codec
+from Log import get_logger
+
+# Paquet entre serveurs : type(1) len(en-tête)(4) len(charge utile)(4) | en-tête JSON | charge utile
+# La charge utile est le message RECEPTION_* déjà encodé (JSON ou binaire) : relayé sans réencodage
+PACKET_HEADER = struct.Struct("!BII")
+HELLO = 1        # premier paquet d'une connexion : {'peer', 'token'}
+PRESENCE = 2     # usernames connectés chez l'émetteur : {'joined', 'left', 'events', 'reset'}
+DELIVER = 3      # message à livrer aux clients locaux : {'receiver', 'emitter', 'sensor_id', 'binary'}
+ROOM = 4         # opération sur un salon, rejouée partout : {'op', 'room', 'username'}
+ROUTING = 5      # lot de notifications de routage pour les admins : {'events'}
+KEEPALIVE = 6    # connexion inactive : prouve que le pair est vivant
+MAX_HELLO = 4096 # taille maximale de l'en-tête du HELLO, lu avant authentification
+
+
+def encode_packet(kind, header, payload=b""):
+    header = Codec.codec.dumps(header)
+    if isinstance(header, str):
+        header = header.encode("utf-8")
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    return b"".join((PACKET_HEADER.pack(kind, len(header), len(payload)), header, payload))
+
+
+def read_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("connexion fermée")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def read_packet(sock):
+    kind, header_len, payload_len = PACKET_HEADER.unpack(read_exactly(sock, PACKET_HEADER.size))
+    header = Codec.codec.loads(read_exactly(sock, header_len))
+    payload = read_exactly(sock, payload_len) if payload_len else b""
+    return kind, header, payload
+
+
+def read_hello(sock):
+    """En-tête du premier paquet, lu avant toute authentification : un HELLO court et sans charge utile,
+    sinon ValueError (un pair inconnu ne fait jamais lire plus de MAX_HELLO octets)"""
+    kind, header_len, payload_len = PACKET_HEADER.unpack(read_exactly(sock, PACKET_HEADER.size))
+    if kind != HELLO or header_len > MAX_HELLO or payload_len:
+        raise ValueError(f"HELLO invalide (type={kind}, en-tête={header_len}, charge utile={payload_len})")
+    header = Codec.codec.loads(read_exactly(sock, header_len))
+    if not isinstance(header, dict):
+        raise ValueError("HELLO invalide : en-tête non objet")
+    return header
+
+
+class Presence:
+    """Annuaire des usernames connectés chez les autres serveurs : username -> pair"""
+
+    def __init__(self):
+        self.owner = {}          # username -> identifiant du pair
+        self.by_peer = {}        # pair -> set(username)
+        self.lock = threading.Lock()
+
+    def add(self, peer, username):
+        with self.lock:
+            previous = self.owner.get(username)
+            if previous is not None and previous != peer:
+                self.by_peer[previous].discard(username)
+            self.owner[username] = peer
+            self.by_peer.setdefault(peer, set()).add(username)
+
+    def remove(self, peer, username):
+        """False si le username est (entre-temps) rattaché à un autre pair"""
+        with self.lock:
+            if self.owner.get(username) != peer:
+                return False
+            del self.owner[username]
+            self.by_peer[peer].discard(username)
+            return True
+
+    def drop_peer(self, peer):
+        """Pair perdu : renvoie ses usernames"""
+        with self.lock:
+            usernames = self.by_peer.pop(peer, set())
+            for username in usernames:
+                del self.owner[username]
+            return usernames
+
+    def peer_of(self, username):
+        return self.owner.get(username)
+
+    def items(self):
+        with self.lock:
+            return list(self.owner.items())
+
+    def admins(self):
+        with self.lock:
+            return sum(1 for username in self.owner if username == "ADMIN" or username.startswith("ADMIN_"))
+
+
+class Plane:
+    """Maillage complet entre serveurs : une connexion sortante par pair, vidée par un thread
+
+    Tout message vers un autre serveur fait un seul saut. send() ne bloque jamais le thread
+    appelant (boucle asyncio, thread de connexion) : le paquet est mis en file pour le pair.
+    Les sous-classes fournissent le transport : listen() (objet avec accept() et close())
+    et connect(peer) (socket connectée). token : secret partagé, vérifié à la connexion.
+    Un pair silencieux pendant 3 * keepalive secondes (machine arrêtée net) est considéré perdu.
+    """
+
+    def __init__(self, peer_id, peers, token=None, keepalive=5.0):
+        self.peer_id = peer_id
+        self.peers = [peer for peer in peers if peer != peer_id]
+        self.token = token
+        self.keepalive = keepalive
+        self.queues = {peer: queue.SimpleQueue() for peer in self.peers}
+        self.connected = set()
+        self.readers = {}        # pair -> connexion entrante courante
+        self.sockets = {}        # pair -> connexion sortante courante
+        self.server = None
+        self.closed = False
+        self.lock = threading.Lock()
+        self.on_packet = None    # on_packet(pair, type, en-tête, charge utile), appelé par le thread de lecture
+        self.on_peer_up = None   # on_peer_up(pair) : connexion sortante établie (envoyer l'état complet)
+        self.on_peer_down = None
+        self.log = get_logger("plane")
+
+    def start(self, on_packet, on_peer_up=None, on_peer_down=None):
+        self.on_packet = on_packet
+        self.on_peer_up = on_peer_up
+        self.on_peer_down = on_peer_down
+        self.server = self.listen()
+        threading.Thread(target=self.accept_loop, args=(self.server,), daemon=True).start()
+        for peer in self.peers:
+            threading.Thread(target=self.writer_loop, args=(peer,), daemon=True).start()
+
+    def send(self, peer, kind, header, payload=b""):
+        if peer in self.connected:
+            self.queues[peer].put(encode_packet(kind, header, payload))
+
+    def broadcast(self, kind, header, payload=b""):
+        if not self.connected:
+            return
+        packet = encode_packet(kind, header, payload)
+        for peer in tuple(self.connected):
+            self.queues[peer].put(packet)
+
+    def close(self):
+        """Arrête le plan : les pairs voient ce serveur disparaître"""
+        self.closed = True
+        with self.lock:
+            connections = list(self.sockets.values()) + list(self.readers.values())
+        for peer in self.peers:
+            self.queues[peer].put(None)
+        for conn in connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self.server is not None:
+            self.server.close()
+
+    def writer_loop(self, peer):
+        """Connexion sortante vers peer (reconnectée si besoin), vidage de sa file"""
+        while not self.closed:
+            try:
+                sock = self.connect(peer)
+            except OSError:
+                time.sleep(0.2)
+                continue
+            with self.lock:
+                self.sockets[peer] = sock
+            sock.settimeout(3 * self.keepalive)
+            try:
+                sock.sendall(encode_packet(HELLO, {'peer': self.peer_id, 'token': self.token}))
+                self.connected.add(peer)
+                self.log.info("pair connecté", extra={'fields': {'peer': peer}})
+                if self.on_peer_up:
+                    self.on_peer_up(peer)
+                while True:
+                    try:
+                        packet = self.queues[peer].get(timeout=self.keepalive)
+                    except queue.Empty:
+                        packet = encode_packet(KEEPALIVE, {})
+                    if packet is None:
+                        # Le pair a coupé sa connexion vers nous : il a sans doute redémarré, on se reconnecte
+                        break
+                    sock.sendall(packet)
+            except OSError:
+                pass
+            self.connected.discard(peer)
+            with self.lock:
+                self.sockets.pop(peer, None)
+            sock.close()
+            # Ce qui restait en file était pour une connexion perdue : le pair resynchronisera
+            self.queues[peer] = queue.SimpleQueue()
+            time.sleep(0.2)
+
+    def accept_loop(self, server):
+        while not self.closed:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.reader_loop, args=(conn,), daemon=True).start()
+
+    def authorized(self, header):
+        """Jeton du HELLO : exigé dès que le plan en a un (toujours pour TcpPlane) ; un plan sans jeton
+        n'accepte que des pairs sans jeton"""
+        token = header.get('token')
+        if self.token is None:
+            return token is None
+        return isinstance(token, str) and hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8"))
+
+    def reader_loop(self, conn):
+        peer = None
+        conn.settimeout(3 * self.keepalive)
+        try:
+            try:
+                header = read_hello(conn)
+            except ValueError as e:
+                self.log.warning("connexion refusée sur le plan", extra={'fields': {'error': str(e)}})
+                return
+            if not self.authorized(header):
+                self.log.warning("connexion refusée sur le plan", extra={'fields': {'peer': header.get('peer')}})
+                return
+            peer = header['peer']
+            with self.lock:
+                self.readers[peer] = conn
+            while True:
+                kind, header, payload = read_packet(conn)
+                if kind != KEEPALIVE:
+                    self.on_packet(peer, kind, header, payload)
+        except (OSError, ConnectionError, ValueError):
+            pass
+        finally:
+            conn.close()
+            with self.lock:
+                # Une connexion remplacée entre-temps par une nouvelle ne fait pas perdre le pair
+                current = peer is not None and self.readers.get(peer) is conn
+                if current:
+                    del self.readers[peer]
+            if current:
+                self.log.info("pair perdu", extra={'fields': {'peer': peer}})
+                if peer in self.connected:
+                    self.queues[peer].put(None)
+                if self.on_peer_down:
+                    self.on_peer_down(peer)
+
+
+class UnixPlane(Plane):
+    """Plan de routage entre processus d'une même machine, par sockets Unix"""
+
+    def __init__(self, index, count, name="ws", directory=None, keepalive=5.0, token=None):
+        super().__init__(index, range(count), token, keepalive)
+        self.directory = directory or tempfile.gettempdir()
+        self.name = name
+
+    def path(self, peer):
+        return os.path.join(self.directory, f"{self.name}-{peer}.sock")
+
+    def listen(self):
+        path = self.path(self.peer_id)
+        if os.path.exists(path):
+            os.remove(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen()
+        return server
+
+    def connect(self, peer):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path(peer))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+
+class LoopbackHub:
+    """Bus en mémoire : plusieurs serveurs d'un même processus reliés par des socketpair (tests)"""
+
+    def __init__(self):
+        self.listeners = {}      # pair -> LoopbackListener
+        self.lock = threading.Lock()
+
+    def listen(self, peer):
+        with self.lock:
+            listener = self.listeners[peer] = LoopbackListener(self, peer)
+            return listener
+
+    def connect(self, peer):
+        listener = self.listeners.get(peer)
+        if listener is None:
+            raise ConnectionRefusedError(f"pair {peer} absent du bus")
+        local, remote = socket.socketpair()
+        listener.pending.put(remote)
+        return local
+
+
+class LoopbackListener:
+    def __init__(self, hub, peer):
+        self.hub = hub
+        self.peer = peer
+        self.pending = queue.SimpleQueue()
+
+    def accept(self):
+        conn = self.pending.get()
+        if conn is None:
+            raise OSError("bus fermé")
+        return conn, None
+
+    def close(self):
+        with self.hub.lock:
+            if self.hub.listeners.get(self.peer) is self:
+                del self.hub.listeners[self.peer]
+        self.pending.put(None)
+
+
+class LoopbackPlane(Plane):
+    """Plan de routage en mémoire, pour faire tourner un cluster de serveurs dans un seul processus"""
+
+    def __init__(self, hub, peer_id, peers, token=None, keepalive=5.0):
+        super().__init__(peer_id, peers, token, keepalive)
+        self.hub = hub
+
+    def listen(self):
+        return self.hub.listen(self.peer_id)
+
+    def connect(self, peer):
+        return self.hub.connect(peer)
+
+
+class TcpPlane(Plane):
+    """Bus entre machines d'un cluster : nodes = {nom du nœud: (hôte, port du bus)}
+
+    Un pair du bus injecte messages et présence comme un serveur : token (secret partagé) est obligatoire.
+    """
+
+    def __init__(self, node_id, nodes, token, keepalive=5.0, connect_timeout=2.0):
+        if not isinstance(token, str) or not token:
+            raise ValueError("TcpPlane : token (secret partagé du cluster) obligatoire")
+        super().__init__(node_id, nodes, token, keepalive)
+        self.nodes = nodes
+        self.connect_timeout = connect_timeout
+
+    @staticmethod
+    def from_env():
+        """Cluster décrit par WS_CLUSTER_NODE=a et WS_CLUSTER_NODES=a=10.0.0.1:9100,b=10.0.0.2:9100
+        (WS_CLUSTER_TOKEN : secret partagé, obligatoire) ; None si WS_CLUSTER_NODES n'est pas défini"""
+        spec = os.environ.get("WS_CLUSTER_NODES")
+        if not spec:
+            return None
+        if not os.environ.get("WS_CLUSTER_TOKEN"):
+            raise ValueError("WS_CLUSTER_NODES défini sans WS_CLUSTER_TOKEN : le bus du cluster refuse de démarrer")
+        nodes = {}
+        for item in spec.split(","):
+            name, address = item.strip().split("=", 1)
+            host, port = address.rsplit(":", 1)
+            nodes[name] = (host, int(port))
+        return TcpPlane(os.environ["WS_CLUSTER_NODE"], nodes, os.environ.get("WS_CLUSTER_TOKEN"))
+
+    def listen(self):
+        return socket.create_server(self.nodes[self.peer_id])
+
+    def connect(self, peer):
+        sock = socket.create_connection(self.nodes[peer], timeout=self.connect_timeout)
+        sock.settimeout(None)
+        # Petits paquets (présence, SENSOR) : pas d'attente de Nagle
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
@@ -0,0 +1,168 @@
+import threading
+import time
+from datetime import datetime
+
+
+class ConnectionRegistry:
+    """Connexions déclarées : username -> client, id de socket -> username, admins et métadonnées
+
+    Ajout, retrait et recherche en O(1) sous un verrou. Les diffusions lisent des instantanés
+    (tuples) reconstruits au plus une fois après chaque modification : le fan-out itère sans
+    verrou pendant que les threads de connexion continuent d'ajouter ou de retirer des clients.
+
+    Une passerelle (plusieurs appareils sur une seule connexion) déclare son username, puis
+    rattache ses appareils comme usernames supplémentaires de la même connexion : ils sont
+    adressables comme les autres, mais la connexion ne compte qu'une fois dans les diffusions.
+    """
+
+    def __init__(self):
+        self.by_name = {}        # username -> client
+        self.by_id = {}          # client['id'] -> username
+        self.admin_ids = {}      # client['id'] -> client admin
+        self.metadata = {}       # username -> {connected_at, last_activity} (clients réguliers)
+        self.activity = {}       # username -> time.time() du dernier message, formaté seulement à la lecture
+        self.devices = {}        # client['id'] d'une passerelle -> {username de l'appareil}
+        self.gateway_of = {}     # username de l'appareil -> client['id'] de sa passerelle
+        self.lock = threading.Lock()
+        self.clients_snapshot = None
+        self.admins_snapshot = None
+
+    def add(self, username, client, admin=False):
+        """Enregistre la connexion sous ce username ; renvoie l'ancien client remplacé (reconnexion) ou None"""
+        with self.lock:
+            self.release(username)
+            previous = self.by_name.get(username)
+            if previous is not None and previous['id'] != client['id']:
+                self.by_id.pop(previous['id'], None)
+                self.admin_ids.pop(previous['id'], None)
+            else:
+                previous = None
+            self.by_name[username] = client
+            self.by_id[client['id']] = username
+            if admin:
+                self.admin_ids[client['id']] = client
+                self.admins_snapshot = None
+            else:
+                now = datetime.now().isoformat()
+                self.metadata[username] = {'connected_at': now, 'last_activity': now}
+                self.activity.pop(username, None)
+            self.clients_snapshot = None
+            return previous
+
+    def remove(self, client):
+        """Retire la connexion ; renvoie son username, ou None si elle n'avait pas été déclarée"""
+        with self.lock:
+            if self.admin_ids.pop(client['id'], None) is not None:
+                self.admins_snapshot = None
+            username = self.by_id.pop(client['id'], None)
+            if username is None:
+                return None
+            del self.by_name[username]
+            self.metadata.pop(username, None)
+            self.activity.pop(username, None)
+            self.clients_snapshot = None
+            return username
+
+    def attach(self, username, client):
+        """Rattache l'appareil username à la connexion de la passerelle (remplace une connexion directe existante)"""
+        with self.lock:
+            self.release(username)
+            previous = self.by_name.get(username)
+            if previous is not None and self.by_id.get(previous['id']) == username:
+                self.by_id.pop(previous['id'], None)
+                self.admin_ids.pop(previous['id'], None)
+            self.by_name[username] = client
+            self.devices.setdefault(client['id'], set()).add(username)
+            self.gateway_of[username] = client['id']
+            now = datetime.now().isoformat()
+            self.metadata[username] = {'connected_at': now, 'last_activity': now}
+            self.activity.pop(username, None)
+            self.clients_snapshot = None
+
+    def detach(self, client, usernames=None):
+        """Retire des appareils de la passerelle (tous si usernames est None) ; renvoie ceux retirés"""
+        with self.lock:
+            devices = self.devices.get(client['id'], set())
+            removed = [u for u in (list(devices) if usernames is None else usernames) if u in devices]
+            for username in removed:
+                self.release(username)
+            return removed
+
+    def release(self, username):
+        """Détache username de sa passerelle éventuelle (sous le verrou)"""
+        gateway_id = self.gateway_of.pop(username, None)
+        if gateway_id is None:
+            return
+        devices = self.devices[gateway_id]
+        devices.discard(username)
+        if not devices:
+            del self.devices[gateway_id]
+        del self.by_name[username]
+        self.metadata.pop(username, None)
+        self.activity.pop(username, None)
+        self.clients_snapshot = None
+
+    def devices_of(self, client):
+        with self.lock:
+            return sorted(self.devices.get(client['id'], ()))
+
+    def gateway(self, username):
+        """Username de la passerelle qui porte cet appareil, ou None"""
+        gateway_id = self.gateway_of.get(username)
+        return None if gateway_id is None else self.by_id.get(gateway_id)
+
+    def get(self, username):
+        return self.by_name.get(username)
+
+    def username_of(self, client):
+        return self.by_id.get(client['id'])
+
+    def lookup(self, usernames):
+        """Clients connectés parmi ces usernames ; une passerelle une seule fois pour tous ses appareils"""
+        by_name = self.by_name
+        clients = {}
+        for username in usernames:
+            client = by_name.get(username)
+            if client is not None:
+                clients[client['id']] = client
+        return list(clients.values())
+
+    def clients(self):
+        """Instantané des connexions déclarées (une par passerelle), sûr à itérer pendant les connexions/déconnexions"""
+        snapshot = self.clients_snapshot
+        if snapshot is None:
+            with self.lock:
+                snapshot = self.clients_snapshot = tuple(self.by_name[u] for u in self.by_id.values())
+        return snapshot
+
+    def admins(self):
+        snapshot = self.admins_snapshot
+        if snapshot is None:
+            with self.lock:
+                snapshot = self.admins_snapshot = tuple(self.admin_ids.values())
+        return snapshot
+
+    def usernames(self):
+        with self.lock:
+            return list(self.by_name)
+
+    def items(self):
+        with self.lock:
+            return list(self.by_name.items())
+
+    def touch(self, username):
+        """Met à jour last_activity d'un client régulier : un float, sans formatage de date par message"""
+        if username in self.metadata:
+            self.activity[username] = time.time()
+
+    def metadata_snapshot(self):
+        with self.lock:
+            snapshot = {username: dict(metadata) for username, metadata in self.metadata.items()}
+            activity = dict(self.activity)
+        for username, last_activity in activity.items():
+            if username in snapshot:
+                snapshot[username]['last_activity'] = datetime.fromtimestamp(last_activity).isoformat()
+        return snapshot
+
+    def __len__(self):
+        return len(self.by_name)
@@ -0,0 +1,123 @@
+import itertools
+import threading
+import time
+from collections import deque
+
+
+class ReplayBuffer:
+    """Dernières trames numérotées d'un username, pour combler le trou après une reconnexion
+
+    Les trames sont celles écrites sur la socket (voir Outbox.pop), dans l'ordre : la trame
+    n° last_seq est la dernière ajoutée, les numéros sont contigus. Bornée en nombre, en
+    octets et en âge ; les trames elles-mêmes sont partagées avec les autres destinataires.
+    """
+
+    def __init__(self, max_frames, max_bytes, max_age):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.entries = deque()   # (instant d'ajout, trame, classe de trafic)
+        self.bytes = 0
+        self.last_seq = 0
+        self.owner = None        # Outbox de la connexion courante, None pendant une coupure
+        self.binary = False      # format des trames mises de côté pendant une coupure
+        self.detached_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def first_seq(self):
+        return self.last_seq - len(self.entries) + 1
+
+    def append(self, frame, kind, owner=None):
+        """Ajoute une trame (numéro last_seq + 1) ; ignorée si owner n'est plus la connexion courante"""
+        with self.lock:
+            if owner is not self.owner:
+                return
+            now = time.monotonic()
+            self.entries.append((now, frame, kind))
+            self.bytes += len(frame)
+            self.last_seq += 1
+            self.trim(now)
+
+    def release(self, seq, owner):
+        """Le client a reçu jusqu'à seq : ces trames ne seront plus rejouées"""
+        with self.lock:
+            if owner is not self.owner:
+                return
+            entries = self.entries
+            for _ in range(min(seq - self.first_seq + 1, len(entries))):
+                self.bytes -= len(entries.popleft()[1])
+
+    def trim(self, now):
+        entries = self.entries
+        while entries and (len(entries) > self.max_frames or self.bytes > self.max_bytes
+                           or now - entries[0][0] > self.max_age):
+            self.bytes -= len(entries.popleft()[1])
+
+    def since(self, seq):
+        """Trames [(trame, classe)] après seq, ou None si une partie du trou est déjà sortie du tampon"""
+        with self.lock:
+            self.trim(time.monotonic())
+            if seq >= self.last_seq:
+                return []
+            if seq < self.first_seq - 1:
+                return None
+            return [(frame, kind) for _, frame, kind in itertools.islice(self.entries, seq + 1 - self.first_seq, None)]
+
+
+class ReplayStore:
+    """Tampons de rejeu par username, conservés max_age secondes après la déconnexion"""
+
+    def __init__(self, max_frames=256, max_bytes=4 * 1024 * 1024, max_age=60.0):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.buffers = {}        # username -> ReplayBuffer
+        self.lock = threading.Lock()
+
+    def attach(self, username, outbox, binary=False):
+        """Tampon du username, qui enregistre désormais ce qu'écrit cette Outbox ; renvoie (tampon, offset)
+
+        Numéro dans le flux du username = offset + numéro sur la connexion (Outbox.delivered).
+        """
+        with self.lock:
+            self.expire()
+            buffer = self.buffers.get(username)
+            if buffer is None:
+                buffer = self.buffers[username] = ReplayBuffer(self.max_frames, self.max_bytes, self.max_age)
+        buffer.binary = binary
+        buffer.detached_at = None
+        return buffer, outbox.attach_replay(buffer)
+
+    def detach(self, username, outbox):
+        """Fin de la connexion : le tampon reste disponible max_age secondes pour une reconnexion"""
+        with self.lock:
+            buffer = self.buffers.get(username)
+        if buffer is None:
+            return
+        outbox.release_replay()
+        with buffer.lock:
+            if buffer.owner is outbox:
+                buffer.owner = None
+                buffer.detached_at = time.monotonic()
+
+    def held(self, username):
+        """Tampon d'un username déconnecté depuis moins de max_age (les messages directs y sont mis de côté)"""
+        buffer = self.buffers.get(username)
+        if buffer is not None and buffer.detached_at is not None \
+                and time.monotonic() - buffer.detached_at <= self.max_age:
+            return buffer
+        return None
+
+    def expire(self):
+        now = time.monotonic()
+        expired = [username for username, buffer in self.buffers.items()
+                   if buffer.detached_at is not None and now - buffer.detached_at > self.max_age]
+        for username in expired:
+            del self.buffers[username]
+
+    def stats(self):
+        with self.lock:
+            return {username: {'frames': len(buffer.entries), 'bytes': buffer.bytes, 'last_seq': buffer.last_seq,
+                               'connected': buffer.owner is not None}
+                    for username, buffer in self.buffers.items()}
@@ -0,0 +1,71 @@
+import threading
+
+# Un destinataire "#lab-A" désigne le salon "lab-A"
+ROOM_PREFIX = "#"
+
+
+def room_name(receiver):
+    """Nom du salon si le destinataire est une adresse de salon, sinon None"""
+    if isinstance(receiver, str) and receiver.startswith(ROOM_PREFIX) and len(receiver) > 1:
+        return receiver[len(ROOM_PREFIX):]
+    return None
+
+
+class RoomIndex:
+    """Salons nommés : salon -> membres et membre -> salons
+
+    L'appartenance est rattachée au username : un ESP32 qui se reconnecte retrouve ses
+    salons sans les rejoindre à nouveau. À l'envoi, seuls les membres connectés reçoivent.
+    """
+
+    def __init__(self):
+        self.rooms = {}          # salon -> set(username)
+        self.member_of = {}      # username -> set(salon)
+        self.lock = threading.Lock()
+
+    def create(self, room, username):
+        with self.lock:
+            created = room not in self.rooms
+            self.rooms.setdefault(room, set())
+        self.join(room, username)
+        return created
+
+    def join(self, room, username):
+        with self.lock:
+            if room not in self.rooms:
+                return False
+            self.rooms[room].add(username)
+            self.member_of.setdefault(username, set()).add(room)
+            return True
+
+    def leave(self, room, username):
+        with self.lock:
+            self.rooms.get(room, set()).discard(username)
+            rooms = self.member_of.get(username)
+            if rooms is not None:
+                rooms.discard(room)
+                if not rooms:
+                    del self.member_of[username]
+
+    def exists(self, room):
+        return room in self.rooms
+
+    def members(self, room):
+        with self.lock:
+            return set(self.rooms.get(room, ()))
+
+    def rooms_of(self, username):
+        with self.lock:
+            return sorted(self.member_of.get(username, ()))
+
+    def snapshot(self):
+        with self.lock:
+            return {room: sorted(members) for room, members in self.rooms.items()}
+
+    def merge(self, rooms):
+        """Ajoute les salons et membres d'un instantané (état d'un autre serveur)"""
+        with self.lock:
+            for room, members in rooms.items():
+                self.rooms.setdefault(room, set()).update(members)
+                for username in members:
+                    self.member_of.setdefault(username, set()).add(room)
@@ -0,0 +1,142 @@
+import json
+import os
+import struct
+
+# Valeurs des capteurs en binaire, déduites de sensor_value_schemas (standard.json) : les
+# propriétés dans l'ordre du schéma, chacune à taille fixe (sauf les chaînes : len(1) | UTF-8).
+# La largeur vient de "binary" sur la propriété, sinon de sensor_encoding.defaults selon son type.
+# Toute modification d'un schéma qui change une disposition doit incrémenter sensor_encoding.version.
+STANDARD_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "standard.json")
+
+FORMATS = {
+    "bool": "?",
+    "int8": "b",
+    "uint8": "B",
+    "int16": "h",
+    "uint16": "H",
+    "int32": "i",
+    "uint32": "I",
+    "float32": "f",
+    "float64": "d",
+    "string": None,
+}
+STRING_LENGTH = struct.Struct("!B")
+
+
+def check(kind, value):
+    """Vrai si value a le type JSON attendu (un booléen n'est pas un entier)"""
+    if kind == "boolean":
+        return isinstance(value, bool)
+    if kind == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if kind == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if kind == "string":
+        return isinstance(value, str)
+    return False
+
+
+class SensorLayout:
+    """Disposition d'un capteur : champs (nom, type JSON, format struct ou None pour une chaîne)"""
+
+    __slots__ = ("sensor_id", "code", "fields", "names", "fixed")
+
+    def __init__(self, sensor_id, code, schema, defaults):
+        self.sensor_id = sensor_id
+        self.code = code
+        self.fields = []
+        for name, prop in schema.get('properties', {}).items():
+            width = prop.get('binary', defaults[prop['type']])
+            if width not in FORMATS:
+                raise ValueError(f"Largeur binaire inconnue pour {sensor_id}.{name} : {width}")
+            self.fields.append((name, prop['type'], FORMATS[width]))
+        self.names = frozenset(name for name, _, _ in self.fields)
+        # Sans chaîne, toute la valeur tient dans un seul struct
+        if all(fmt is not None for _, _, fmt in self.fields):
+            self.fixed = struct.Struct("!" + "".join(fmt for _, _, fmt in self.fields))
+        else:
+            self.fixed = None
+
+    def pack(self, value):
+        if not isinstance(value, dict) or value.keys() != self.names:
+            return None
+        for name, kind, _ in self.fields:
+            if not check(kind, value[name]):
+                return None
+        try:
+            if self.fixed is not None:
+                return self.fixed.pack(*(value[name] for name, _, _ in self.fields))
+            parts = []
+            for name, _, fmt in self.fields:
+                if fmt is None:
+                    text = value[name].encode("utf-8")
+                    parts.append(STRING_LENGTH.pack(len(text)))
+                    parts.append(text)
+                else:
+                    parts.append(struct.pack("!" + fmt, value[name]))
+            return b"".join(parts)
+        except (struct.error, OverflowError):
+            # Hors de la largeur prévue par le schéma (ou chaîne de plus de 255 octets) : reste en JSON
+            return None
+
+    def unpack(self, data, offset=0, length=None):
+        end = len(data) if length is None else offset + length
+        if self.fixed is not None:
+            if end - offset != self.fixed.size:
+                raise ValueError(f"Valeur {self.sensor_id} de taille invalide ({end - offset} octets)")
+            return dict(zip((name for name, _, _ in self.fields), self.fixed.unpack_from(data, offset)))
+        value = {}
+        for name, _, fmt in self.fields:
+            if fmt is None:
+                size = STRING_LENGTH.unpack_from(data, offset)[0]
+                offset += STRING_LENGTH.size
+                if offset + size > end:
+                    raise ValueError(f"Chaîne {self.sensor_id}.{name} tronquée")
+                value[name] = bytes(data[offset:offset + size]).decode("utf-8")
+                offset += size
+            else:
+                value[name] = struct.unpack_from("!" + fmt, data, offset)[0]
+                offset += struct.calcsize("!" + fmt)
+        if offset != end:
+            raise ValueError(f"Valeur {self.sensor_id} de taille invalide")
+        return value
+
+
+def load(path=STANDARD_PATH):
+    """(version, {sensor_id: SensorLayout}) d'après standard.json"""
+    with open(path, encoding="utf-8") as f:
+        standard = json.load(f)
+    encoding = standard['sensor_encoding']
+    layouts = {}
+    # Code du capteur : sa position dans sensor_id.enum (à partir de 1), l'ordre de l'énumération est donc figé
+    for index, sensor_id in enumerate(standard['sensor_id']['enum']):
+        schema = standard['sensor_value_schemas'].get(sensor_id)
+        if schema is not None:
+            layouts[sensor_id] = SensorLayout(sensor_id, index + 1, schema, encoding['defaults'])
+    return encoding['version'], layouts
+
+
+VERSION, LAYOUTS = load()
+SENSOR_CODES = {sensor_id: layout.code for sensor_id, layout in LAYOUTS.items()}
+SENSORS_BY_CODE = {layout.code: sensor_id for sensor_id, layout in LAYOUTS.items()}
+
+
+def pack(sensor_id, value):
+    """Octets de la valeur, ou None si elle ne suit pas exactement le schéma (elle part alors en JSON)"""
+    layout = LAYOUTS.get(sensor_id)
+    return None if layout is None else layout.pack(value)
+
+
+def can_pack(sensor_id, value):
+    return pack(sensor_id, value) is not None
+
+
+def unpack(sensor_id, data, offset=0, length=None):
+    """Valeur (dict) d'après ses octets ; ValueError si la taille ne correspond pas à la disposition"""
+    layout = LAYOUTS.get(sensor_id)
+    if layout is None:
+        raise ValueError(f"Capteur sans schéma : {sensor_id}")
+    try:
+        return layout.unpack(data, offset, length)
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(str(e)) from None
@@ -0,0 +1,69 @@
+import threading
+
+ANY = "*"
+
+
+class SubscriptionIndex:
+    """Index des abonnements aux flux capteurs : (émetteur, sensor_id) -> usernames
+
+    Un client qui n'a jamais envoyé d'ENVOI_SUBSCRIBE reste « non filtré » et reçoit toutes
+    les mesures adressées à ALL (comportement historique). Dès son premier abonnement, il ne
+    reçoit plus que les mesures qui correspondent à ses sujets. Une mesure est donc routée
+    en O(abonnés) : 4 recherches dans l'index + l'ensemble des clients non filtrés.
+    """
+
+    def __init__(self):
+        self.index = {}          # (émetteur | ANY, sensor_id | ANY) -> set(username)
+        self.topics = {}         # username -> set((émetteur, sensor_id))
+        self.unfiltered = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def expand(emitters, sensor_ids):
+        return {(e, s) for e in (emitters or [ANY]) for s in (sensor_ids or [ANY])}
+
+    def add_client(self, username):
+        with self.lock:
+            if username not in self.topics:
+                self.unfiltered.add(username)
+
+    def remove_client(self, username):
+        with self.lock:
+            self.unfiltered.discard(username)
+            for topic in self.topics.pop(username, ()):
+                self.discard(topic, username)
+
+    def subscribe(self, username, emitters=None, sensor_ids=None):
+        """Passe le client en mode filtré et ajoute les sujets ; renvoie ses sujets courants"""
+        with self.lock:
+            self.unfiltered.discard(username)
+            topics = self.topics.setdefault(username, set())
+            if emitters or sensor_ids:
+                for topic in self.expand(emitters, sensor_ids):
+                    topics.add(topic)
+                    self.index.setdefault(topic, set()).add(username)
+            return sorted(topics)
+
+    def unsubscribe(self, username, emitters=None, sensor_ids=None):
+        with self.lock:
+            topics = self.topics.get(username, set())
+            for topic in self.expand(emitters, sensor_ids):
+                if topic in topics:
+                    topics.discard(topic)
+                    self.discard(topic, username)
+            return sorted(topics)
+
+    def discard(self, topic, username):
+        subscribers = self.index.get(topic)
+        if subscribers is not None:
+            subscribers.discard(username)
+            if not subscribers:
+                del self.index[topic]
+
+    def recipients(self, emitter, sensor_id):
+        """Usernames à qui relayer une mesure (émetteur, sensor_id) adressée à ALL"""
+        with self.lock:
+            result = set(self.unfiltered)
+            for topic in ((emitter, sensor_id), (emitter, ANY), (ANY, sensor_id), (ANY, ANY)):
+                result.update(self.index.get(topic, ()))
+            return result
@@ -0,0 +1,242 @@
+"""Télémétrie UDP : mesures des capteurs en datagrammes, relayées comme des ENVOI_SENSOR
+
+Modèle de confiance : un datagramme n'est pas authentifié. L'appareil (l'émetteur du message) est
+écrit dans le datagramme lui-même et l'adresse source UDP peut être usurpée ; ce port est donc
+réservé à un réseau de confiance (le Wi-Fi des ESP32).
+- allowed (ou WS_TELEMETRY_ALLOW=esp32-1,esp32-2) : seuls ces appareils sont acceptés. Obligatoire
+  dès que le port écoute ailleurs que sur la boucle locale : sans liste, le port n'est pas ouvert.
+- max_sources_per_ip : sources (port, appareil) suivies par adresse IP, pour qu'un hôte ne remplisse
+  pas la table (max_sources) aux dépens des vrais appareils ; max_rate borne le débit de chacune.
+Un appareil de la liste peut toujours être imité par un hôte du réseau : pour des mesures qui
+engagent quelque chose (RFID, commandes), passer par une connexion WebSocket.
+"""
+import ipaddress
+import os
+import socket
+import struct
+import threading
+import time
+
+import SensorCodec
+from Log import get_logger
+from Message import Message, MessageType
+
+# Datagramme : version(1) capteur(1) numéro(2) len(appareil)(1) | appareil (UTF-8) | valeurs empaquetées
+# Version, codes et valeurs sont ceux de SensorCodec (standard.json), comme dans les trames binaires
+# Le numéro (modulo 2^16) sert seulement à compter les pertes : rien n'est retransmis
+DATAGRAM_HEADER = struct.Struct("!BBHB")
+MAX_DATAGRAM = 512
+
+
+def encode_datagram(device, sensor_id, value, seq):
+    packed = SensorCodec.pack(sensor_id, value)
+    if packed is None:
+        raise ValueError(f"Valeur {sensor_id} non conforme à son schéma : {value!r}")
+    device = device.encode("utf-8")
+    return b"".join((DATAGRAM_HEADER.pack(SensorCodec.VERSION, SensorCodec.SENSOR_CODES[sensor_id], seq & 0xFFFF, len(device)),
+                     device, packed))
+
+
+def decode_datagram(data):
+    """(appareil, sensor_id, numéro, valeur) ; ValueError si le datagramme est invalide"""
+    try:
+        version, code, seq, device_len = DATAGRAM_HEADER.unpack_from(data)
+        if version != SensorCodec.VERSION or code not in SensorCodec.SENSORS_BY_CODE:
+            raise ValueError(f"Datagramme invalide (version={version}, capteur={code})")
+        sensor_id = SensorCodec.SENSORS_BY_CODE[code]
+        offset = DATAGRAM_HEADER.size + device_len
+        if not device_len:
+            raise ValueError("Datagramme sans appareil")
+        device = bytes(data[DATAGRAM_HEADER.size:offset]).decode("utf-8")
+        return device, sensor_id, seq, SensorCodec.unpack(sensor_id, data, offset)
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(str(e)) from None
+
+
+class SourceStats:
+    """Comptes d'une source (adresse, appareil) : débit, pertes d'après les numéros, limitation"""
+
+    __slots__ = ("max_rate", "tokens", "refilled_at", "packets", "bytes", "lost", "reordered", "limited",
+                 "last_seq", "window_start", "window_packets", "rate", "last_seen")
+
+    def __init__(self, max_rate, now):
+        self.max_rate = max_rate
+        self.tokens = float(max_rate)
+        self.refilled_at = now
+        self.packets = 0
+        self.bytes = 0
+        self.lost = 0
+        self.reordered = 0
+        self.limited = 0
+        self.last_seq = None
+        self.window_start = now
+        self.window_packets = 0
+        self.rate = 0.0          # datagrammes/s sur la dernière seconde complète
+        self.last_seen = now
+
+    def admit(self, now, size, seq):
+        """Compte le datagramme ; False s'il dépasse max_rate (seau à jetons, rafale d'une seconde)"""
+        self.last_seen = now
+        if now - self.window_start >= 1.0:
+            self.rate = self.window_packets / (now - self.window_start)
+            self.window_start = now
+            self.window_packets = 0
+        self.window_packets += 1
+        if self.last_seq is not None:
+            gap = (seq - self.last_seq - 1) & 0xFFFF
+            if gap < 0x8000:
+                self.lost += gap
+            else:
+                # En retard ou en double : compté, mais on ne recule pas le numéro de référence
+                self.reordered += 1
+                seq = self.last_seq
+        self.last_seq = seq
+        if self.max_rate:
+            self.tokens = min(self.max_rate, self.tokens + (now - self.refilled_at) * self.max_rate)
+            self.refilled_at = now
+            if self.tokens < 1.0:
+                self.limited += 1
+                return False
+            self.tokens -= 1.0
+        self.packets += 1
+        self.bytes += size
+        return True
+
+    def snapshot(self):
+        return {'packets': self.packets, 'bytes': self.bytes, 'rate': round(self.rate, 1), 'lost': self.lost,
+                'reordered': self.reordered, 'limited': self.limited}
+
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+def allowed_from_env():
+    """Appareils de WS_TELEMETRY_ALLOW (séparés par des virgules), ou None si la variable n'est pas définie"""
+    spec = os.environ.get("WS_TELEMETRY_ALLOW")
+    if spec is None:
+        return None
+    return [device.strip() for device in spec.split(",") if device.strip()]
+
+
+class TelemetryListener:
+    """Port UDP de télémétrie : chaque datagramme devient un ENVOI_SENSOR de l'appareil
+
+    Pour les mesures fréquentes et tolérantes aux pertes (ACCELEROMETER, JOYSTICK...) : pas de
+    connexion ni de JSON côté ESP32, un datagramme de quelques octets par mesure. Chaque source
+    (adresse, appareil) a ses comptes et son débit maximal (max_rate datagrammes/s, 0 : illimité) ;
+    au-delà de max_sources sources suivies, ou de max_sources_per_ip pour une même adresse, les
+    nouvelles sont ignorées. allowed : appareils acceptés (None : WS_TELEMETRY_ALLOW, sinon tous,
+    seulement sur la boucle locale ; voir le modèle de confiance en tête du module).
+    reuse_port : port partagé entre processus (WSServer.sharded), une source reste sur le même.
+    """
+
+    def __init__(self, host, port, deliver, receiver="ALL", max_rate=500, max_sources=4096, allowed=None, idle_timeout=300,
+                 reuse_port=False, max_sources_per_ip=16):
+        self.host = host
+        self.port = port
+        self.deliver = deliver   # deliver(message) : routage de WSServer
+        self.receiver = receiver
+        self.max_rate = max_rate
+        self.max_sources = max_sources
+        self.max_sources_per_ip = max_sources_per_ip
+        if allowed is None:
+            allowed = allowed_from_env()
+        self.allowed = set(allowed) if allowed is not None else None
+        if self.allowed is None and not is_loopback(host):
+            raise ValueError(f"Télémétrie UDP sur {host} sans liste d'appareils : définir allowed ou WS_TELEMETRY_ALLOW")
+        self.idle_timeout = idle_timeout
+        self.reuse_port = reuse_port
+        self.sources = {}        # (ip, port, appareil) -> SourceStats
+        self.per_ip = {}         # ip -> nombre de sources suivies
+        self.invalid = 0
+        self.rejected = 0        # appareil non autorisé ou trop de sources
+        self.sock = None
+        self.thread = None
+        self.log = get_logger("telemetry")
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        if self.reuse_port:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.bind((self.host, self.port))
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.log.info("télémétrie UDP", extra={'fields': {'host': self.host, 'port': self.port}})
+
+    def run(self):
+        expire_at = time.monotonic() + self.idle_timeout
+        while True:
+            try:
+                data, address = self.sock.recvfrom(MAX_DATAGRAM)
+            except OSError:
+                break
+            now = time.monotonic()
+            self.handle(data, address, now)
+            if now >= expire_at:
+                self.expire(now)
+                expire_at = now + self.idle_timeout
+
+    def handle(self, data, address, now):
+        try:
+            device, sensor_id, seq, value = decode_datagram(data)
+        except ValueError:
+            self.invalid += 1
+            return
+        key = (address[0], address[1], device)
+        source = self.sources.get(key)
+        if source is None:
+            ip_sources = self.per_ip.get(address[0], 0)
+            if (self.allowed is not None and device not in self.allowed) or len(self.sources) >= self.max_sources \
+                    or ip_sources >= self.max_sources_per_ip:
+                self.rejected += 1
+                return
+            source = self.sources[key] = SourceStats(self.max_rate, now)
+            self.per_ip[address[0]] = ip_sources + 1
+        if not source.admit(now, len(data), seq):
+            return
+        message = Message(MessageType.ENVOI.SENSOR, emitter=device, receiver=self.receiver, value=value, sensor_id=sensor_id)
+        try:
+            self.deliver(message)
+        except Exception:
+            self.log.exception("routage d'une mesure UDP", extra={'fields': {'device': device, 'sensor_id': sensor_id}})
+
+    def expire(self, now):
+        """Oublie les sources muettes depuis idle_timeout secondes"""
+        for key in [key for key, source in self.sources.items() if now - source.last_seen > self.idle_timeout]:
+            del self.sources[key]
+            remaining = self.per_ip[key[0]] - 1
+            if remaining:
+                self.per_ip[key[0]] = remaining
+            else:
+                del self.per_ip[key[0]]
+
+    def stats(self):
+        sources = {f"{device}@{ip}:{port}": source.snapshot() for (ip, port, device), source in list(self.sources.items())}
+        return {'port': self.port, 'sources': sources, 'invalid': self.invalid, 'rejected': self.rejected}
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+
+
+class TelemetrySender:
+    """Côté appareil (ou banc de test) : envoie des mesures en datagrammes vers un TelemetryListener"""
+
+    def __init__(self, host, port, device):
+        self.address = (host, port)
+        self.device = device
+        self.seq = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, sensor_id, value):
+        self.sock.sendto(encode_datagram(self.device, sensor_id, value, self.seq), self.address)
+        self.seq = (self.seq + 1) & 0xFFFF
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,68 @@
+import socket
+import threading
+
+from websocket_server import WebsocketServer
+
+from Outbox import TEXT, Outbox
+from WSFrame import OPCODE_TEXT, encode_frame
+
+
+class ThreadedWebsocketServer(WebsocketServer):
+    """websocket_server.WebsocketServer (un thread par connexion) + file sortante bornée par client"""
+
+    # websocket_server ignore les trames binaires reçues : les clients restent en JSON
+    supports_binary = False
+
+    def __init__(self, *args, outbox_options=None, reuse_port=False, **kwargs):
+        # Lu par server_bind, appelé depuis le constructeur de TCPServer
+        self.reuse_port = reuse_port
+        super().__init__(*args, **kwargs)
+        self.outbox_options = outbox_options or {}
+        self.outbox_lock = threading.Lock()
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def send_message(self, client, msg, kind=TEXT):
+        self.send_frame(client, encode_frame(msg, OPCODE_TEXT), kind)
+
+    def send_frame(self, client, frame, kind=TEXT, sequenced=False):
+        """Met une trame déjà construite dans la file sortante du client (thread-safe)"""
+        outbox = client.get('outbox')
+        if outbox is None:
+            outbox = self.attach_outbox(client)
+        outbox.put(frame, kind, sequenced=sequenced)
+
+    def attach_outbox(self, client):
+        """Crée la file sortante du client et le thread d'écriture qui la vide"""
+        with self.outbox_lock:
+            if 'outbox' not in client:
+                outbox = Outbox(**self.outbox_options)
+                outbox.on_laggard = lambda: self.drop_client(client)
+                client['outbox'] = outbox
+                threading.Thread(target=self.drain, args=(client,), daemon=True).start()
+            return client['outbox']
+
+    def drain(self, client):
+        outbox = client['outbox']
+        handler = client['handler']
+        while not outbox.closed and handler.keep_alive:
+            frame = outbox.pop(timeout=1.0)
+            if frame is None:
+                continue
+            try:
+                handler.request.sendall(frame)
+            except OSError:
+                break
+        outbox.close()
+
+    def drop_client(self, client):
+        """Client trop lent : ferme la socket, websocket_server appellera fn_client_left"""
+        handler = client['handler']
+        handler.keep_alive = False
+        try:
+            handler.request.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
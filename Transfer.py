@@ -0,0 +1,225 @@
+import json
+import mimetypes
+import os
+import tempfile
+import threading
+import uuid
+import zlib
+
+from Message import Message, MessageType, transfer_error
+
+CHUNK_SIZE = 256 * 1024          # taille d'un morceau lu sur le disque
+CHUNK_THRESHOLD = 1024 * 1024    # au-delà, send_image/audio/video passent en transfert découpé
+WINDOW = 8                       # morceaux envoyés d'avance sans accusé de réception
+ACK_TIMEOUT = 10                 # secondes sans ACK avant de renvoyer depuis le dernier morceau acquitté
+
+MEDIA_RECEPTION = {
+    MessageType.ENVOI.IMAGE: MessageType.RECEPTION.IMAGE,
+    MessageType.ENVOI.AUDIO: MessageType.RECEPTION.AUDIO,
+    MessageType.ENVOI.VIDEO: MessageType.RECEPTION.VIDEO,
+}
+
+
+class OutgoingTransfer:
+    """Fichier en cours d'envoi, lu morceau par morceau depuis le disque"""
+
+    def __init__(self, filepath, dest, media, mime):
+        self.id = uuid.uuid4().hex
+        self.filepath = filepath
+        self.dest = dest
+        self.media = media
+        self.mime = mime
+        self.size = os.path.getsize(filepath)
+        self.count = max(1, -(-self.size // CHUNK_SIZE))
+        # Vers ALL il n'y a pas un destinataire unique pour acquitter : envoi en flux sans fenêtre
+        self.needs_ack = dest != "ALL"
+        self.acked = -1          # dernier index acquitté (cumulatif)
+        self.next_index = 0
+        self.paused = False
+        self.generation = 0      # incrémenté à chaque (re)démarrage : l'ancien thread d'envoi s'arrête
+
+    def done(self):
+        if self.needs_ack:
+            return self.acked >= self.count - 1
+        return self.next_index >= self.count
+
+
+class IncomingTransfer:
+    """Fichier en cours de réception, réassemblé directement sur le disque"""
+
+    def __init__(self, directory, emitter, transfer, mime):
+        error = transfer_error(transfer)
+        if error:
+            # id devient un nom de fichier : jamais de chemin fourni par l'émetteur
+            raise ValueError(error)
+        self.id = transfer['id']
+        self.emitter = emitter
+        self.media = transfer['media']
+        self.size = transfer['size']
+        self.count = transfer['count']
+        self.chunk_size = transfer['chunk_size']
+        self.mime = mime
+        self.part_path = os.path.join(directory, f"{self.id}.part")
+        self.state_path = os.path.join(directory, f"{self.id}.json")
+        self.contiguous = -1     # dernier index reçu sans trou
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.contiguous = json.load(f)['contiguous']
+        if not os.path.exists(self.part_path):
+            with open(self.part_path, "wb"):
+                pass
+
+    def write(self, index, data):
+        with open(self.part_path, "r+b") as f:
+            f.seek(index * self.chunk_size)
+            f.write(data)
+        if index == self.contiguous + 1:
+            self.contiguous = index
+            with open(self.state_path, "w") as f:
+                json.dump({'contiguous': self.contiguous}, f)
+
+    def complete(self):
+        return self.contiguous >= self.count - 1
+
+
+class TransferManager:
+    """Envoi en flux et réception des transferts découpés pour un WSClient
+
+    Protocole : ENVOI_CHUNK (transfer = id, index, count, chunk_size, size, crc, media) relayé
+    par le serveur en RECEPTION_CHUNK, puis ENVOI_CHUNK_ACK cumulatif du destinataire
+    ({'id', 'index', 'status'}). Après une reconnexion, l'envoi reprend après le dernier
+    morceau acquitté ; le destinataire réécrit à l'offset, donc un doublon est sans effet.
+    """
+
+    def __init__(self, client, directory=None):
+        self.client = client
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "ws_transfers")
+        os.makedirs(self.directory, exist_ok=True)
+        self.outgoing = {}
+        self.incoming = {}
+        self.completed = set()
+        self.lock = threading.Condition()
+
+    # --- Envoi ---
+
+    def send_file(self, filepath, dest, media, mime=None):
+        transfer = OutgoingTransfer(filepath, dest, media, mime)
+        with self.lock:
+            self.outgoing[transfer.id] = transfer
+        self.start(transfer)
+        return transfer.id
+
+    def start(self, transfer):
+        with self.lock:
+            transfer.paused = False
+            transfer.generation += 1
+            self.lock.notify_all()
+        threading.Thread(target=self.stream, args=(transfer, transfer.generation), daemon=True).start()
+
+    def next_index(self, transfer, generation):
+        """Attend une place dans la fenêtre ; None si le transfert est fini, en pause ou remplacé"""
+        while True:
+            if transfer.paused or not self.client.connected or generation != transfer.generation:
+                return None
+            if transfer.done():
+                self.outgoing.pop(transfer.id, None)
+                return None
+            in_window = not transfer.needs_ack or transfer.next_index - transfer.acked <= WINDOW
+            if transfer.next_index < transfer.count and in_window:
+                transfer.next_index += 1
+                return transfer.next_index - 1
+            if not self.lock.wait(ACK_TIMEOUT):
+                # Pas d'ACK : on renvoie depuis le dernier morceau acquitté
+                transfer.next_index = transfer.acked + 1
+
+    def stream(self, transfer, generation):
+        with open(transfer.filepath, "rb") as f:
+            while True:
+                with self.lock:
+                    index = self.next_index(transfer, generation)
+                if index is None:
+                    return
+                f.seek(index * CHUNK_SIZE)
+                data = f.read(CHUNK_SIZE)
+                message = Message(MessageType.ENVOI.CHUNK, emitter=self.client.username, receiver=transfer.dest,
+                                  value=data, mime=transfer.mime, transfer={
+                                      'id': transfer.id, 'index': index, 'count': transfer.count,
+                                      'chunk_size': CHUNK_SIZE, 'size': transfer.size,
+                                      'crc': zlib.crc32(data), 'media': transfer.media})
+                self.client.send_message(message)
+
+    def on_ack(self, message):
+        ack = message.value
+        with self.lock:
+            transfer = self.outgoing.get(ack['id'])
+            if transfer is None:
+                return
+            status = ack.get('status', 'ok')
+            if status == 'receiver_offline':
+                # Reprise quand le destinataire réapparaît dans la liste des clients
+                transfer.paused = True
+            else:
+                transfer.acked = max(transfer.acked, ack['index'])
+                if status == 'retry':
+                    transfer.next_index = transfer.acked + 1
+            self.lock.notify_all()
+
+    def resume(self, connected_users=None):
+        """Relance les transferts interrompus (reconnexion ou destinataire revenu)"""
+        with self.lock:
+            pending = list(self.outgoing.values())
+        for transfer in pending:
+            if connected_users is not None and (not transfer.paused or transfer.dest not in connected_users):
+                continue
+            with self.lock:
+                transfer.next_index = transfer.acked + 1
+            self.start(transfer)
+
+    def pause_all(self):
+        with self.lock:
+            for transfer in self.outgoing.values():
+                transfer.paused = True
+            self.lock.notify_all()
+
+    # --- Réception ---
+
+    def on_chunk(self, message):
+        """Écrit le morceau sur le disque, acquitte, et renvoie le message média final une fois complet"""
+        info = message.transfer
+        if transfer_error(info) or not isinstance(message.value, (bytes, bytearray)):
+            # Métadonnées invalides (id hors uuid4().hex, bornes...) : ignoré avant toute écriture
+            return None
+        if info['id'] in self.completed:
+            # Doublon renvoyé après une reconnexion : déjà reçu en entier
+            if message.receiver != "ALL":
+                self.client.send_message(Message(MessageType.ENVOI.CHUNK_ACK, emitter=self.client.username, receiver=message.emitter,
+                                                 value={'id': info['id'], 'index': info['count'] - 1, 'status': 'ok'}))
+            return None
+        transfer = self.incoming.get(info['id'])
+        if transfer is None:
+            transfer = self.incoming[info['id']] = IncomingTransfer(self.directory, message.emitter, info, message.mime)
+        index = info['index']
+        status = 'ok'
+        if zlib.crc32(message.value) != info['crc']:
+            status = 'retry'
+        elif index > transfer.contiguous + 1:
+            # Trou après un morceau corrompu : l'émetteur renverra à partir du manquant
+            return None
+        else:
+            transfer.write(index, message.value)
+
+        if message.receiver != "ALL":
+            ack = Message(MessageType.ENVOI.CHUNK_ACK, emitter=self.client.username, receiver=message.emitter,
+                          value={'id': transfer.id, 'index': transfer.contiguous, 'status': status})
+            self.client.send_message(ack)
+
+        if not transfer.complete():
+            return None
+        del self.incoming[transfer.id]
+        self.completed.add(transfer.id)
+        extension = (transfer.mime and mimetypes.guess_extension(transfer.mime)) or ""
+        path = os.path.join(self.directory, transfer.id + extension)
+        os.replace(transfer.part_path, path)
+        os.remove(transfer.state_path)
+        return Message(MEDIA_RECEPTION[transfer.media], value=None, emitter=transfer.emitter, receiver=message.receiver,
+                       mime=transfer.mime, transfer={'id': transfer.id, 'size': transfer.size, 'path': path})
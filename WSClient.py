@@ -1,9 +1,13 @@
 import websocket
 import threading
-import base64
+import mimetypes
+import os
+import logging
 
 from Context import Context
-from Message import Message, MessageType
+from Log import get_logger, truncate
+from Message import CAPABILITY, SEQUENCED_TYPES, Message, MessageType
+from Transfer import CHUNK_THRESHOLD, TransferManager
 
 
 try:
@@ -18,16 +22,39 @@ class WSClient(QObject):
     if HAS_PYQT:
         message_received = pyqtSignal(object)
 
-    def __init__(self, ctx, username="Client", on_connect_callback=None, on_message_callback=None, on_users_list_callback=None):
+    def __init__(self, ctx, username="Client", on_connect_callback=None, on_message_callback=None, on_users_list_callback=None, binary=True,
+                 ack_every=32, ack_interval=1.0, devices=None):
         if HAS_PYQT:
             super().__init__()
         self.username = username
+        self.log = get_logger("client")
         self.connected = False
         self.on_connect_callback = on_connect_callback
         self.on_message_callback = on_message_callback
         self.on_users_list_callback = on_users_list_callback
         self.known_users = set()
         self.connected_users = []
+        self.membership_version = None  # version de connected_users (deltas RECEPTION_MEMBERSHIP)
+        # Capacités demandées à la DECLARATION et celles acceptées par le serveur
+        self.capabilities = [CAPABILITY.MEMBERSHIP, CAPABILITY.ACK, CAPABILITY.REPLAY] + ([CAPABILITY.BINARY] if binary else [])
+        self.server_capabilities = set()
+        # Passerelle : appareils portés par cette connexion (usernames à part entière pour les autres clients)
+        self.devices = list(devices or [])
+        if devices is not None:
+            self.capabilities.append(CAPABILITY.GATEWAY)
+        self.subscriptions = []  # sujets (émetteur, sensor_id) confirmés par le serveur
+        self.rooms = []          # salons dont on est membre (adresse "#nom")
+        # Accusés cumulés : un {'ack': n} tous les ack_every messages numérotés, ou après ack_interval s
+        self.ack_every = ack_every
+        self.ack_interval = ack_interval
+        self.received_seq = 0    # messages numérotés reçus sur cette connexion (voir SEQUENCED_TYPES)
+        self.acked_seq = 0
+        self.ack_timer = None
+        self.ack_lock = threading.Lock()
+        # Reprise après coupure : numéro dans le flux du username = stream_offset + received_seq
+        self.stream_offset = None
+        self.resume_seq = None   # dernier numéro vu, présenté à la prochaine DECLARATION
+        self.transfers = TransferManager(self)
         self.ws = websocket.WebSocketApp(
             ctx.url(),
             on_open=self.on_open,
@@ -37,7 +64,48 @@ class WSClient(QObject):
         )
 
     def on_message(self, ws, message):
-        received_msg = Message.from_json(message)
+        if isinstance(message, bytes):
+            received_msg = Message.from_binary(message)
+        else:
+            received_msg = Message.from_json(message)
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug("message reçu", extra={'fields': {'type': received_msg.message_type, 'emitter': received_msg.emitter, 'size': len(message)}})
+        # Compté dans l'ordre d'arrivée, comme le serveur à l'écriture
+        sequenced = received_msg.message_type in SEQUENCED_TYPES
+        if sequenced:
+            self.received_seq += 1
+
+        # Réponse du serveur à la négociation des capacités
+        if received_msg.message_type == MessageType.SYS_MESSAGE and isinstance(received_msg.value, dict) and 'capabilities' in received_msg.value:
+            self.server_capabilities = set(received_msg.value['capabilities'])
+            return
+        if received_msg.message_type == MessageType.SYS_MESSAGE and isinstance(received_msg.value, dict) and 'subscriptions' in received_msg.value:
+            self.subscriptions = received_msg.value['subscriptions']
+            return
+        if received_msg.message_type == MessageType.SYS_MESSAGE and isinstance(received_msg.value, dict) and 'rooms' in received_msg.value:
+            self.rooms = received_msg.value['rooms']
+            return
+        if received_msg.message_type == MessageType.SYS_MESSAGE and isinstance(received_msg.value, dict) and 'devices' in received_msg.value:
+            self.devices = received_msg.value['devices']
+            return
+        if received_msg.message_type == MessageType.SYS_MESSAGE and isinstance(received_msg.value, dict) and 'resume' in received_msg.value:
+            self.on_resume(received_msg.value['resume'])
+            return
+
+        # Transferts découpés : ACK pour l'émetteur, morceaux réassemblés sur disque pour le destinataire
+        if received_msg.message_type == MessageType.RECEPTION.CHUNK_ACK:
+            self.transfers.on_ack(received_msg)
+            return
+        if received_msg.message_type == MessageType.RECEPTION.CHUNK:
+            received_msg = self.transfers.on_chunk(received_msg)
+            if received_msg is None:
+                return
+
+        # Deltas de la liste des clients : appliqués ici, l'UI reçoit toujours la liste complète
+        if received_msg.message_type == MessageType.RECEPTION.MEMBERSHIP:
+            received_msg = self.apply_membership(received_msg)
+            if received_msg is None:
+                return
 
         # Répondre au ping du serveur
         if received_msg.message_type == MessageType.SYS_MESSAGE and received_msg.value == "ping":
@@ -48,6 +116,7 @@ class WSClient(QObject):
         # Gérer la liste des utilisateurs connectés
         if received_msg.message_type == MessageType.RECEPTION.CLIENT_LIST:
             self.connected_users = received_msg.value
+            self.transfers.resume(self.connected_users)
             if self.on_users_list_callback:
                 self.on_users_list_callback(self.connected_users)
             
@@ -67,32 +136,97 @@ class WSClient(QObject):
             self.on_message_callback(received_msg)
         else:
             # Affichage console par défaut (si pas de callback)
-            print(f"\n[{received_msg.emitter}] {received_msg.value}")
+            if isinstance(received_msg.value, bytes):
+                print(f"\n[{received_msg.emitter}] <{received_msg.message_type} {received_msg.mime} {len(received_msg.value)} octets>")
+            elif received_msg.transfer:
+                print(f"\n[{received_msg.emitter}] <{received_msg.message_type} {received_msg.transfer['path']}>")
+            else:
+                # Média JSON historique ("IMG:<base64>") : seulement le début et la taille
+                print(f"\n[{received_msg.emitter}] {truncate(received_msg.value)}")
             print(f"[{self.username}] > ", end="", flush=True)
 
         # Accusé de réception pour les messages RECEPTION
-        if received_msg.message_type in [MessageType.RECEPTION.TEXT, MessageType.RECEPTION.IMAGE, MessageType.RECEPTION.AUDIO, MessageType.RECEPTION.VIDEO]:
+        if sequenced:
+            self.acknowledge()
+
+    def on_resume(self, resume):
+        self.stream_offset = resume['offset']
+        if resume['complete']:
+            if resume['replayed']:
+                self.log.info("reprise", extra={'fields': {'username': self.username, 'replayed': resume['replayed']}})
+            return
+        # Une partie du trou n'est plus dans le tampon du serveur : on redemande l'état
+        self.log.warning("reprise incomplète, messages perdus", extra={'fields': {'username': self.username, 'last_seen': self.resume_seq}})
+        self.on_client_list()
+
+    def last_seen_seq(self):
+        """Dernier numéro vu dans le flux du username (les trames de cette connexion suivent celles déjà vues)"""
+        if self.stream_offset is None:
+            return self.resume_seq
+        return max(self.resume_seq or 0, self.stream_offset + self.received_seq)
+
+    def acknowledge(self):
+        """Accusé cumulé si le serveur l'accepte (regroupé), sinon un "MESSAGE OK" par message"""
+        if CAPABILITY.ACK not in self.server_capabilities:
             ack_msg = Message(MessageType.SYS_MESSAGE, emitter=self.username, receiver="", value="MESSAGE OK")
-            ws.send(ack_msg.to_json())
+            self.ws.send(ack_msg.to_json())
+            return
+        with self.ack_lock:
+            if self.received_seq - self.acked_seq < self.ack_every:
+                if self.ack_timer is None:
+                    self.ack_timer = threading.Timer(self.ack_interval, self.send_ack)
+                    self.ack_timer.daemon = True
+                    self.ack_timer.start()
+                return
+        self.send_ack()
+
+    def send_ack(self):
+        with self.ack_lock:
+            if self.ack_timer is not None:
+                self.ack_timer.cancel()
+                self.ack_timer = None
+            seq = self.received_seq
+            if seq <= self.acked_seq or not self.connected:
+                return
+            self.acked_seq = seq
+        ack_msg = Message(MessageType.SYS_MESSAGE, emitter=self.username, receiver="SERVER", value={'ack': seq})
+        self.ws.send(ack_msg.to_json())
 
     def on_error(self, ws, error):
-        print(f"\n[error] {error}")
+        self.log.warning("erreur websocket", extra={'fields': {'username': self.username, 'error': error}})
 
     def on_close(self, ws, close_status_code, close_msg):
-        print(f"\n[close] code={close_status_code} msg={close_msg}")
+        self.log.info("déconnecté", extra={'fields': {'username': self.username, 'code': close_status_code, 'msg': close_msg}})
         self.connected = False
+        self.server_capabilities = set()
+        self.resume_seq = self.last_seen_seq()
+        self.stream_offset = None
+        with self.ack_lock:
+            if self.ack_timer is not None:
+                self.ack_timer.cancel()
+                self.ack_timer = None
+        self.transfers.pause_all()
 
     def on_open(self, ws):
-        print("[open] connecté")
+        self.log.info("connecté", extra={'fields': {'username': self.username}})
         self.connected = True
+        # Nouvelle connexion : le serveur recommence la numérotation
+        self.received_seq = 0
+        self.acked_seq = 0
         message = Message(
             message_type=MessageType.DECLARATION,
             emitter=self.username,
             receiver="SERVER",
-            value="hello je suis connecté"
+            value={'text': "hello je suis connecté", 'capabilities': self.capabilities}
         )
+        if self.resume_seq is not None:
+            message.value['resume'] = self.resume_seq
+        if CAPABILITY.GATEWAY in self.capabilities:
+            message.value['devices'] = self.devices
         ws.send(message.to_json())
         self.on_client_list()
+        # Après une reconnexion : reprend les envois après le dernier morceau acquitté
+        self.transfers.resume()
 
         if self.on_connect_callback:
             self.on_connect_callback()
@@ -150,42 +284,108 @@ class WSClient(QObject):
             except EOFError:
                 break
 
-    def connect(self):
-        self.ws.run_forever()
+    def connect(self, reconnect=0):
+        """reconnect > 0 : délai en secondes avant de se reconnecter automatiquement après une coupure"""
+        self.ws.run_forever(reconnect=reconnect)
+
+    def send_message(self, message):
+        """Envoie un Message : trame binaire pour un média brut ou une mesure si le serveur l'accepte, sinon JSON"""
+        if message.is_binary() and CAPABILITY.BINARY in self.server_capabilities:
+            self.ws.send(message.to_binary(), opcode=websocket.ABNF.OPCODE_BINARY)
+        else:
+            self.ws.send(message.to_json())
+
+    def apply_membership(self, received_msg):
+        """Met à jour connected_users ; renvoie l'équivalent RECEPTION_CLIENT_LIST, ou None (trou : resynchronisation)"""
+        feed = received_msg.value
+        if 'users' in feed:
+            self.connected_users = list(feed['users'])
+        elif self.membership_version is not None and feed['version'] == self.membership_version + 1:
+            users = [u for u in self.connected_users if u not in feed['left']]
+            self.connected_users = users + [u for u in feed['joined'] if u not in users]
+        else:
+            if self.membership_version is not None and feed['version'] > self.membership_version:
+                # Delta manqué : on redemande un instantané
+                self.membership_version = None
+                self.on_client_list()
+            return None
+        self.membership_version = feed['version']
+        return Message(MessageType.RECEPTION.CLIENT_LIST, emitter="SERVER", receiver=self.username, value=self.connected_users)
 
     def on_client_list(self):
         message = Message(MessageType.ENVOI.CLIENT_LIST, emitter=self.username, receiver="SERVER", value="")
         self.ws.send(message.to_json())
 
-    def send(self, value, dest):
-        message = Message(MessageType.ENVOI.TEXT, emitter=self.username, receiver=dest, value=value)
+    def send(self, value, dest, emitter=None):
+        """emitter : un appareil de la passerelle, sinon le username de la connexion"""
+        message = Message(MessageType.ENVOI.TEXT, emitter=emitter or self.username, receiver=dest, value=value)
         self.ws.send(message.to_json())
 
-    def send_image(self, filepath, dest):
+    def send_media(self, message_type, filepath, dest):
+        """Envoie un fichier en un seul message, ou en flux par morceaux au-delà de CHUNK_THRESHOLD"""
+        mime = mimetypes.guess_type(filepath)[0]
+        if os.path.getsize(filepath) > CHUNK_THRESHOLD:
+            return self.transfers.send_file(filepath, dest, message_type, mime)
         with open(filepath, "rb") as f:
-            img_base64 = base64.b64encode(f.read()).decode("utf-8")
-        value = f"IMG:{img_base64}"
-        message = Message(MessageType.ENVOI.IMAGE, emitter=self.username, receiver=dest, value=value)
-        self.ws.send(message.to_json())
+            data = f.read()
+        message = Message(message_type, emitter=self.username, receiver=dest, value=data, mime=mime)
+        self.send_message(message)
+
+    def send_image(self, filepath, dest):
+        self.send_media(MessageType.ENVOI.IMAGE, filepath, dest)
 
     def send_video(self, filepath, dest):
-        with open(filepath, "rb") as f:
-            video_base64 = base64.b64encode(f.read()).decode("utf-8")
-        value = f"VIDEO:{video_base64}"
-        message = Message(MessageType.ENVOI.VIDEO, emitter=self.username, receiver=dest, value=value)
-        self.ws.send(message.to_json())
+        self.send_media(MessageType.ENVOI.VIDEO, filepath, dest)
 
     def send_audio(self, filepath, dest):
-        with open(filepath, "rb") as f:
-            audio_base64 = base64.b64encode(f.read()).decode("utf-8")
-        value = f"AUDIO:{audio_base64}"
-        message = Message(MessageType.ENVOI.AUDIO, emitter=self.username, receiver=dest, value=value)
+        self.send_media(MessageType.ENVOI.AUDIO, filepath, dest)
+
+    def subscribe(self, sensor_ids=None, emitters=None):
+        """S'abonne à des flux capteurs : on ne reçoit plus que ceux-là parmi les mesures envoyées à ALL"""
+        value = {'sensor_ids': sensor_ids or [], 'emitters': emitters or []}
+        message = Message(MessageType.ENVOI.SUBSCRIBE, emitter=self.username, receiver="SERVER", value=value)
+        self.ws.send(message.to_json())
+
+    def unsubscribe(self, sensor_ids=None, emitters=None):
+        value = {'sensor_ids': sensor_ids or [], 'emitters': emitters or []}
+        message = Message(MessageType.ENVOI.UNSUBSCRIBE, emitter=self.username, receiver="SERVER", value=value)
         self.ws.send(message.to_json())
 
-    def send_sensor(self, sensor_id, value, dest="ALL"):
-        message = Message(MessageType.ENVOI.SENSOR, emitter=self.username, receiver=dest, value=value, sensor_id=sensor_id)
+    def create_room(self, room):
+        """Crée un salon (et le rejoint) ; on lui écrit ensuite avec dest "#nom"."""
+        self.send_room_request(MessageType.ENVOI.ROOM_CREATE, room)
+
+    def join_room(self, room):
+        self.send_room_request(MessageType.ENVOI.ROOM_JOIN, room)
+
+    def leave_room(self, room):
+        self.send_room_request(MessageType.ENVOI.ROOM_LEAVE, room)
+
+    def send_room_request(self, message_type, room):
+        message = Message(message_type, emitter=self.username, receiver="SERVER", value=room)
+        self.ws.send(message.to_json())
+
+    def set_admin_filter(self, message_types=None, emitters=None, sample=1.0):
+        """Admin : ne recevoir que les logs de routage de ces types / émetteurs, échantillonnés (ex. 0.1)"""
+        value = {'message_types': message_types or [], 'emitters': emitters or [], 'sample': sample}
+        message = Message(MessageType.ADMIN.FILTER, emitter=self.username, receiver="SERVER", value=value)
         self.ws.send(message.to_json())
 
+    def attach_devices(self, devices):
+        """Passerelle : ajoute des appareils à la connexion (le serveur renvoie la liste courante)"""
+        message = Message(MessageType.SYS_MESSAGE, emitter=self.username, receiver="SERVER", value={'attach': list(devices)})
+        self.ws.send(message.to_json())
+
+    def detach_devices(self, devices):
+        message = Message(MessageType.SYS_MESSAGE, emitter=self.username, receiver="SERVER", value={'detach': list(devices)})
+        self.ws.send(message.to_json())
+
+    def send_sensor(self, sensor_id, value, dest="ALL", emitter=None):
+        """Mesure d'un capteur : trame binaire compacte (voir SensorCodec) si la valeur suit son schéma
+        et que le serveur l'accepte, sinon JSON"""
+        message = Message(MessageType.ENVOI.SENSOR, emitter=emitter or self.username, receiver=dest, value=value, sensor_id=sensor_id)
+        self.send_message(message)
+
     @staticmethod
     def dev(username="Client"):
         return WSClient(Context.dev(), username)
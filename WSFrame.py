@@ -0,0 +1,44 @@
+import base64
+import hashlib
+import struct
+
+# Opcodes RFC 6455
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def accept_key(key):
+    """Calcule la valeur Sec-WebSocket-Accept à partir de Sec-WebSocket-Key"""
+    digest = hashlib.sha1((key + GUID).encode("ascii")).digest()
+    return base64.b64encode(digest).decode("ascii")
+
+
+def encode_frame(payload, opcode=OPCODE_TEXT):
+    """Construit une trame serveur -> client (non masquée, FIN=1)"""
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    length = len(payload)
+    first = 0x80 | opcode
+    if length <= 125:
+        header = struct.pack("!BB", first, length)
+    elif length <= 0xFFFF:
+        header = struct.pack("!BBH", first, 126, length)
+    else:
+        header = struct.pack("!BBQ", first, 127, length)
+    return header + payload
+
+
+def unmask(payload, mask):
+    """Démasque le payload d'une trame client"""
+    if not payload:
+        return payload
+    # XOR sur un entier : beaucoup plus rapide qu'une boucle octet par octet
+    length = len(payload)
+    key = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(key, "big")).to_bytes(length, "big")
@@ -1,232 +1,860 @@
-from websocket_server import WebsocketServer
+import os
+import sys
+import logging
+import secrets
 import threading
-import base64
+import mimetypes
+import multiprocessing
 from datetime import datetime
 
 from Context import Context
-from Message import Message, MessageType
+from Message import CAPABILITY, RECEPTION_FOR, SEQUENCED_TYPES, Envelope, Message, MessageType, transfer_error
+from AsyncWebsocketServer import AsyncWebsocketServer
+from Outbox import traffic_class
+from Conflator import SensorConflator
+from Subscriptions import SubscriptionIndex
+from Rooms import ROOM_PREFIX, RoomIndex, room_name
+from Membership import MembershipFeed
+from Registry import ConnectionRegistry
+from AdminFeed import RoutingFeed
+from Heartbeat import Heartbeat
+from Replay import ReplayStore
+from OfflineStore import DEFAULT_DIRECTORY, OfflineStore
+from Telemetry import TelemetryListener
+import Plane
+from WSFrame import OPCODE_BINARY, OPCODE_TEXT, encode_frame
+from Log import get_logger, truncate
+
+
+ENGINES = ("threaded", "asyncio")
+
+# Relayés tels quels d'après leur seul en-tête (voir Envelope) : le contenu n'est jamais décodé
+RELAYED_TYPES = (MessageType.ENVOI.TEXT, MessageType.ENVOI.IMAGE, MessageType.ENVOI.AUDIO, MessageType.ENVOI.VIDEO, MessageType.ENVOI.CHUNK)
+
+# Adresses du protocole qui ne désignent jamais un username
+RESERVED_NAMES = ("SERVER", "ALL", "ADMIN")
+
+
+def is_username(name):
+    """Vrai si name peut être le username d'un client (ni adresse réservée, ni salon, ni admin)"""
+    return isinstance(name, str) and bool(name) and name not in RESERVED_NAMES \
+        and not name.startswith("ADMIN_") and not name.startswith(ROOM_PREFIX)
 
 
 class WSServer:
-    def __init__(self, ctx):
+    def __init__(self, ctx, engine="threaded", outbox_options=None, conflation_window=None, membership_window=0.05,
+                 routing_window=0.2, routing_batch=100, heartbeat_interval=30, heartbeat_timeout=10, replay_options=None,
+                 offline_options=None, plane=None, reuse_port=False, telemetry_port=None, telemetry_options=None):
         self.host = ctx.host
         self.port = ctx.port
-        self.server = WebsocketServer(host=self.host, port=self.port, loglevel=1)
+        self.log = get_logger("server")
+        self.engine = engine
+        # Réglages des files sortantes par client (voir Outbox : max_frames, max_bytes, policies, laggard_limit)
+        self.outbox_options = outbox_options or {}
+        self.reuse_port = reuse_port
+        self.server = self.create_engine(engine)
         self.server.set_fn_new_client(self.on_new_client)
         self.server.set_fn_client_left(self.on_client_left)
         self.server.set_fn_message_received(self.on_message_received)
 
-        self.clients = {}
-        self.client_metadata = {}  # {username: {connected_at, last_activity}}
-        self.admin_clients = []    # List of admin websockets
+        self.registry = ConnectionRegistry()  # username <-> connexion, admins, métadonnées
         self.running = False
+        self.subscriptions = SubscriptionIndex()
+        self.rooms = RoomIndex()
+        # Conflation des capteurs continus (opt-in) : fenêtre en secondes, ex. 0.1
+        self.conflator = SensorConflator(conflation_window, self.forward) if conflation_window else None
+        # Arrivées/départs regroupés pendant membership_window secondes (0 : publication immédiate)
+        self.membership = MembershipFeed(membership_window, self.publish_membership)
+        # Registre et liste publiée changent ensemble : join après add seulement si le username désigne
+        # toujours cette connexion, leave dans la même section que remove (deux connexions du même username)
+        self.roster_lock = threading.Lock()
+        # Notifications de routage : un lot toutes les routing_window secondes ou routing_batch événements
+        self.routing = RoutingFeed(routing_window, routing_batch, self.publish_routing)
+        # Ping des connexions muettes depuis heartbeat_interval s, fermeture après heartbeat_timeout s sans réponse
+        self.heartbeat = Heartbeat(heartbeat_interval, heartbeat_timeout, self.send_ping, self.reap_client, self.notify_admins_reaped)
+        # Tampons de rejeu par username (voir Replay.ReplayStore : max_frames, max_bytes, max_age)
+        self.replays = ReplayStore(**(replay_options or {}))
+        # Messages directs pour les absents, sur disque (opt-in, voir OfflineStore : directory, fsync, rétention) ; None : désactivé
+        self.offline = OfflineStore(**offline_options) if offline_options not in (None, False) else None
+        self.draining = set()    # usernames dont le journal hors ligne est en cours de livraison
+        # Plan de routage vers les autres processus ou nœuds (voir Plane, WSServer.sharded) ; None : serveur seul
+        self.plane = plane
+        self.presence = Plane.Presence()   # usernames connectés chez les autres serveurs
+        # Arrivées/départs locaux annoncés aux autres serveurs, regroupés comme pour les clients
+        self.announce = MembershipFeed(membership_window, self.publish_presence) if plane else None
+        # Mesures capteurs en UDP (voir Telemetry : receiver, max_rate, allowed...) ; None : pas de port UDP
+        self.telemetry = TelemetryListener(self.host, telemetry_port, self.on_telemetry, reuse_port=reuse_port, **(telemetry_options or {})) \
+            if telemetry_port is not None else None
+        # Type reçu -> traitement : tout ENVOI_* qui a son RECEPTION_* est relayé par on_envoi
+        self.handlers = {message_type: self.on_envoi for message_type in RECEPTION_FOR}
+        self.handlers.update({
+            MessageType.DECLARATION: self.on_declaration,
+            MessageType.SYS_MESSAGE: self.on_sys_message,
+            MessageType.ENVOI.CLIENT_LIST: self.on_client_list_request,
+            MessageType.ENVOI.SUBSCRIBE: self.update_subscriptions,
+            MessageType.ENVOI.UNSUBSCRIBE: self.update_subscriptions,
+            MessageType.ENVOI.ROOM_CREATE: self.update_rooms,
+            MessageType.ENVOI.ROOM_JOIN: self.update_rooms,
+            MessageType.ENVOI.ROOM_LEAVE: self.update_rooms,
+            MessageType.ADMIN.FILTER: self.set_admin_filter,
+        })
+
+    def create_engine(self, engine):
+        """Instancie le moteur réseau : 'threaded' (un thread par connexion) ou 'asyncio' (une seule boucle)"""
+        if engine == "asyncio":
+            return AsyncWebsocketServer(host=self.host, port=self.port, outbox_options=self.outbox_options, reuse_port=self.reuse_port)
+        if engine == "threaded":
+            from ThreadedWebsocketServer import ThreadedWebsocketServer
+            return ThreadedWebsocketServer(host=self.host, port=self.port, loglevel=1, outbox_options=self.outbox_options, reuse_port=self.reuse_port)
+        raise ValueError(f"Moteur inconnu '{engine}', attendu parmi {ENGINES}")
 
     def on_new_client(self, client, server):
-        print(f"\n[+] Client connecté: id={client['id']} addr={client['address']}")
+        self.log.info("client connecté", extra={'fields': {'id': client['id'], 'addr': client['address']}})
         welcome_msg = Message(MessageType.RECEPTION.TEXT, emitter="SERVER", receiver="", value="Bienvenue !")
-        server.send_message(client, welcome_msg.to_json())
-        self.broadcast_clients_list()
-        print("[SERVER] > ", end="", flush=True)
+        self.send_to(client, welcome_msg)
+        # La liste courante pour ce seul client ; les autres ne sont prévenus qu'à sa DECLARATION
+        self.broadcast_clients_list([client])
+        self.heartbeat.add(client)
 
     def on_client_left(self, client, server):
-        print(f"\n[-] Client déconnecté: id={client['id']}")
-        disconnected_username = None
-
-        for name, c in list(self.clients.items()):
-            if c['id'] == client['id']:
-                disconnected_username = name
-                del self.clients[name]
-                # Nettoie les métadonnées
-                if name in self.client_metadata:
-                    del self.client_metadata[name]
-                break
+        self.log.info("client déconnecté", extra={'fields': {'id': client['id']}})
+        # Appareils portés par une passerelle : partis avec elle
+        self.detach_devices(client, None)
+        # Retire aussi l'admin et les métadonnées ; None si la socket ne s'était pas déclarée (ou a été remplacée)
+        with self.roster_lock:
+            disconnected_username = self.registry.remove(client)
+            if disconnected_username:
+                # Delta pour les clients, événement pour les admins (regroupés en cas de rafale)
+                event = None
+                if not disconnected_username.startswith("ADMIN"):
+                    event = self.client_event('disconnected', disconnected_username)
+                self.membership.leave(disconnected_username, event)
+                if self.announce:
+                    self.announce.leave(disconnected_username, event)
+        self.routing.forget(client['id'])
+        self.heartbeat.remove(client)
+        if disconnected_username:
+            self.subscriptions.remove_client(disconnected_username)
+            if 'outbox' in client:
+                self.replays.detach(disconnected_username, client['outbox'])
+
+        if disconnected_username and self.conflator:
+            self.conflator.forget(disconnected_username)
+
+    def send_to_all(self, message, clients=None):
+        """Sérialise le message une seule fois par format et écrit la même trame à chaque destinataire"""
+        if clients is None:
+            clients = self.registry.clients()
+        if not clients:
+            return
+        binary = message.is_binary()
+        kind = traffic_class(message.message_type)
+        sequenced = message.message_type in SEQUENCED_TYPES
+        frames = {}
+        for client in clients:
+            # Média brut : trame binaire si le client l'a négociée, sinon JSON base64 (clients historiques)
+            use_binary = binary and CAPABILITY.BINARY in client.get('capabilities', ())
+            frame = frames.get(use_binary)
+            if frame is None:
+                if use_binary:
+                    frame = encode_frame(message.to_binary(), OPCODE_BINARY)
+                else:
+                    frame = encode_frame(message.to_json())
+                frames[use_binary] = frame
+            self.server.send_frame(client, frame, kind, sequenced)
+
+    def send_to(self, client, message):
+        """Envoie un message à un seul client dans le format qu'il a négocié"""
+        self.send_to_all(message, [client])
 
-        # Nettoie la liste des admins si c'était un admin
-        self.admin_clients = [a for a in self.admin_clients if a.get('id') != client.get('id')]
+    def negotiate_capabilities(self, client, username, value):
+        """Retient les capacités annoncées à la DECLARATION et répond avec celles acceptées"""
+        if not isinstance(value, dict) or 'capabilities' not in value:
+            return
+        supported = {CAPABILITY.MEMBERSHIP, CAPABILITY.ACK, CAPABILITY.REPLAY, CAPABILITY.GATEWAY}
+        if getattr(self.server, 'supports_binary', False):
+            supported.add(CAPABILITY.BINARY)
+        accepted = [c for c in value['capabilities'] if c in supported]
+        client['capabilities'] = set(accepted)
+        response = Message(MessageType.SYS_MESSAGE, emitter="SERVER", receiver=username, value={'capabilities': accepted})
+        self.send_to(client, response)
 
-        # Notifie les admins de la déconnexion
-        if disconnected_username and not disconnected_username.startswith("ADMIN"):
-            self.notify_admins_client_disconnected(disconnected_username)
+    def resume(self, client, username, value):
+        """Rattache la connexion au tampon de rejeu du username et rejoue ce qui suit le dernier numéro vu"""
+        buffer, offset = self.replays.attach(username, client['outbox'], CAPABILITY.BINARY in client['capabilities'])
+        last_seen = value.get('resume')
+        frames = buffer.since(last_seen) if isinstance(last_seen, int) else []
+        # offset : numéro dans le flux du username = offset + numéro sur cette connexion
+        response = Message(MessageType.SYS_MESSAGE, emitter="SERVER", receiver=username,
+                           value={'resume': {'offset': offset, 'replayed': len(frames or ()), 'complete': frames is not None}})
+        self.send_to(client, response)
+        if frames is None:
+            self.log.info("rejeu incomplet", extra={'fields': {'username': username, 'last_seen': last_seen, 'first_kept': buffer.first_seq}})
+            return
+        for frame, kind in frames:
+            self.server.send_frame(client, frame, kind, True)
+        if frames:
+            self.log.info("rejeu", extra={'fields': {'username': username, 'from': last_seen + 1, 'count': len(frames)}})
 
-        self.broadcast_clients_list()
+    def hold(self, received_msg):
+        """Message direct pour un username en coupure courte : gardé dans son tampon, rejoué à la reconnexion"""
+        message_type = RECEPTION_FOR.get(received_msg.message_type)
+        buffer = self.replays.held(received_msg.receiver) if message_type in SEQUENCED_TYPES else None
+        if buffer is None:
+            return False
+        payload, binary = self.reception_payload(received_msg, message_type, buffer.binary)
+        buffer.append(encode_frame(payload, OPCODE_BINARY if binary else OPCODE_TEXT), traffic_class(message_type))
+        return True
 
-        print("[SERVER] > ", end="", flush=True)
+    def store_offline(self, received_msg, client):
+        """Message direct pour un absent : écrit dans le journal, livré à sa prochaine DECLARATION"""
+        message_type = RECEPTION_FOR.get(received_msg.message_type)
+        if self.offline is None or message_type not in SEQUENCED_TYPES or not is_username(received_msg.receiver):
+            # SERVER, salon, destinataire manquant... : réponse d'erreur habituelle
+            return False
+        # Stocké en binaire quand c'est possible (converti à la livraison pour un client JSON)
+        payload, binary = self.reception_payload(received_msg, message_type, True)
+        with self.offline.lock:
+            # Sous le verrou du journal : deliver_offline ne peut pas finir la livraison entre-temps
+            receiver_client = self.direct_client(received_msg.receiver)
+            if receiver_client is None:
+                self.offline.append(received_msg.receiver, payload.encode("utf-8") if isinstance(payload, str) else payload, binary)
+                first = self.offline.pending(received_msg.receiver) == 1
+        if receiver_client is not None:
+            self.send_stored(receiver_client, payload, binary)
+        elif first and self.registry.get(received_msg.receiver) is None:
+            # Un seul avis par absence, pas un par message
+            info_msg = Message(MessageType.RECEPTION.TEXT, emitter="SERVER", receiver=received_msg.emitter, value=f"{received_msg.receiver} hors ligne : messages conservés.")
+            self.send_to(client, info_msg)
+        return True
 
-    def broadcast_clients_list(self):
-        """Envoie la liste des clients à tous"""
-        clients_ids = list(self.clients.keys())
+    def direct_client(self, username):
+        """Client à qui écrire directement, ou None (absent, ou journal hors ligne pas encore livré : on passe derrière)"""
+        if username in self.draining:
+            return None
+        return self.registry.get(username)
+
+    def deliver_offline(self, client, username, peer=None):
+        """Vide le journal du username par lots ; les messages directs arrivés entre-temps y sont ajoutés et suivent dans l'ordre
+
+        Avec peer, le username est connecté chez cet autre serveur : les messages lui sont remis par le plan de routage.
+        """
+        delivered = 0
+        try:
+            while (not client['outbox'].closed) if peer is None else self.presence.peer_of(username) == peer:
+                with self.offline.lock:
+                    batch = self.offline.take(username)
+                    if not batch:
+                        break
+                for payload, binary in batch:
+                    if peer is None:
+                        self.send_stored(client, payload, binary)
+                    else:
+                        self.plane.send(peer, Plane.DELIVER, {'receiver': username, 'binary': binary}, payload)
+                delivered += len(batch)
+        finally:
+            with self.offline.lock:
+                self.draining.discard(username)
+        self.log.info("messages hors ligne livrés", extra={'fields': {'username': username, 'count': delivered}})
+
+    def send_stored(self, client, payload, binary):
+        if binary and CAPABILITY.BINARY not in client.get('capabilities', ()):
+            payload, binary = Message.from_binary(payload).to_json(), False
+        envelope = Envelope.peek(payload if binary or isinstance(payload, str) else bytes(payload).decode("utf-8"))
+        kind = traffic_class(envelope.message_type) if envelope else traffic_class(None)
+        self.server.send_frame(client, encode_frame(payload, OPCODE_BINARY if binary else OPCODE_TEXT), kind, True)
+
+    def reception_payload(self, received_msg, message_type, binary):
+        """Charge utile RECEPTION_* du message : (octets bruts, True) si binary et média brut, sinon (JSON, False)"""
+        if isinstance(received_msg, Envelope):
+            if received_msg.is_binary() == binary:
+                return received_msg.retyped(message_type), binary
+            received_msg = received_msg.to_message()
+        message = Message(message_type, emitter=received_msg.emitter, receiver=received_msg.receiver, value=received_msg.value,
+                          sensor_id=received_msg.sensor_id, mime=received_msg.mime, transfer=received_msg.transfer)
+        if binary and message.is_binary():
+            return message.to_binary(), True
+        return message.to_json(), False
+
+    def broadcast_clients_list(self, clients=None):
+        """Envoie la liste complète des clients (clients historiques, sans deltas)"""
+        clients_ids = self.membership.snapshot()['users']
 
         msg = Message(
             MessageType.RECEPTION.CLIENT_LIST,
             emitter="SERVER",
             receiver="ALL",
             value=clients_ids
-        ).to_json()
+        )
+        self.send_to_all(msg, clients)
 
-        for client in self.clients.values():
-            self.server.send_message(client, msg)
+    def send_membership_snapshot(self, client, username):
+        msg = Message(MessageType.RECEPTION.MEMBERSHIP, emitter="SERVER", receiver=username, value=self.membership.snapshot())
+        self.send_to(client, msg)
+
+    def publish_membership(self, delta, events):
+        """Diffuse un lot de MembershipFeed : delta versionné, ou liste complète pour les clients historiques"""
+        if delta:
+            clients = self.registry.clients()
+            delta_clients = [c for c in clients if CAPABILITY.MEMBERSHIP in c.get('capabilities', ())]
+            legacy_clients = [c for c in clients if CAPABILITY.MEMBERSHIP not in c.get('capabilities', ())]
+            msg = Message(MessageType.RECEPTION.MEMBERSHIP, emitter="SERVER", receiver="ALL", value=delta)
+            self.send_to_all(msg, delta_clients)
+            self.broadcast_clients_list(legacy_clients)
+        if events:
+            self.notify_admins_client_events(events)
 
     def notify_admins_routing(self, emitter, receiver, msg_type):
-        """Envoie une notification de routage à tous les admins (sans contenu)"""
+        """Met en tampon une notification de routage (sans contenu) pour le prochain lot admin"""
+        nb_admins = len(self.registry.admins()) + self.presence.admins()
+        if not nb_admins:
+            return
         log_data = {
             'emitter': emitter,
             'receiver': receiver,
             'message_type': msg_type,
-            'timestamp': datetime.now().isoformat()
         }
-        msg = Message(MessageType.ADMIN.ROUTING_LOG, emitter="SERVER", receiver="ADMIN", value=log_data)
-        for admin in self.admin_clients:
-            try:
-                self.server.send_message(admin, msg.to_json())
-            except:
-                pass
+        if not self.routing.interested(log_data, nb_admins):
+            return
+        log_data['timestamp'] = datetime.now().isoformat()
+        self.routing.add(log_data)
 
-    def notify_admins_client_connected(self, username):
-        """Notifie les admins d'une nouvelle connexion"""
-        event_data = {
-            'username': username,
-            'connected_at': self.client_metadata[username]['connected_at'],
-            'timestamp': datetime.now().isoformat()
-        }
-        msg = Message(MessageType.ADMIN.CLIENT_CONNECTED, emitter="SERVER", receiver="ADMIN", value=event_data)
-        for admin in self.admin_clients:
-            try:
-                self.server.send_message(admin, msg.to_json())
-            except:
-                pass
+    def publish_routing(self, events, admin_ids):
+        """Envoie un lot de RoutingFeed aux admins sans filtre (admin_ids None) ou à ceux d'un même filtre"""
+        if admin_ids is None and self.plane and self.presence.admins():
+            # Lot complet pour les admins des autres serveurs, qui appliquent leurs propres filtres
+            self.plane.broadcast(Plane.ROUTING, {'events': events})
+        self.send_routing(events, admin_ids)
+
+    def send_routing(self, events, admin_ids):
+        admins = self.registry.admins()
+        if admin_ids is None:
+            targets = [a for a in admins if a['id'] not in self.routing.filters]
+        else:
+            targets = [a for a in admins if a['id'] in admin_ids]
+        msg = Message(MessageType.ADMIN.ROUTING_BATCH, emitter="SERVER", receiver="ADMIN", value=events)
+        self.send_to_all(msg, targets)
+
+    def set_admin_filter(self, client, received_msg):
+        """ADMIN_FILTER : ce que ce dashboard veut recevoir (types, émetteurs, échantillonnage)"""
+        if client['id'] not in self.registry.admin_ids:
+            return
+        value = received_msg.value if isinstance(received_msg.value, dict) else {}
+        admin_filter = self.routing.set_filter(client['id'], value.get('message_types'), value.get('emitters'), value.get('sample', 1.0))
+        response = Message(MessageType.SYS_MESSAGE, emitter="SERVER", receiver=received_msg.emitter, value={'admin_filter': {
+            'message_types': sorted(admin_filter.message_types),
+            'emitters': sorted(admin_filter.emitters),
+            'sample': admin_filter.sample,
+        }})
+        self.send_to(client, response)
 
-    def notify_admins_client_disconnected(self, username):
-        """Notifie les admins d'une déconnexion"""
+    def client_event(self, event, username):
+        """Événement admin 'connected' / 'disconnected' d'un client"""
         event_data = {
+            'event': event,
             'username': username,
             'timestamp': datetime.now().isoformat()
         }
-        msg = Message(MessageType.ADMIN.CLIENT_DISCONNECTED, emitter="SERVER", receiver="ADMIN", value=event_data)
-        for admin in self.admin_clients:
-            try:
-                self.server.send_message(admin, msg.to_json())
-            except:
-                pass
+        if event == 'connected':
+            event_data['connected_at'] = self.registry.metadata[username]['connected_at']
+        return event_data
+
+    def notify_admins_client_events(self, events):
+        """Notifie les admins des connexions/déconnexions : un message par événement, ou un lot pendant une rafale"""
+        if len(events) == 1:
+            message_type = MessageType.ADMIN.CLIENT_CONNECTED if events[0]['event'] == 'connected' else MessageType.ADMIN.CLIENT_DISCONNECTED
+            msg = Message(message_type, emitter="SERVER", receiver="ADMIN", value=events[0])
+        else:
+            msg = Message(MessageType.ADMIN.CLIENT_EVENTS, emitter="SERVER", receiver="ADMIN", value=events)
+        self.send_to_all(msg, self.registry.admins())
+
+    def send_ping(self, client):
+        ping_msg = Message(MessageType.SYS_MESSAGE, emitter="SERVER", receiver=self.registry.username_of(client) or "", value="ping")
+        self.send_to(client, ping_msg)
+
+    def reap_client(self, client):
+        """Connexion restée muette après un ping : fermée, le moteur appellera on_client_left"""
+        self.log.warning("connexion inactive fermée", extra={'fields': {'id': client['id'], 'username': self.registry.username_of(client)}})
+        self.server.drop_client(client)
+
+    def notify_admins_reaped(self, clients):
+        """Un seul ADMIN_REAPED par tick du heartbeat, quel que soit le nombre de connexions fermées"""
+        usernames = [username for username in map(self.registry.username_of, clients) if username]
+        msg = Message(MessageType.ADMIN.REAPED, emitter="SERVER", receiver="ADMIN",
+                      value={'count': len(clients), 'usernames': usernames, 'total': self.heartbeat.reaped})
+        self.send_to_all(msg, self.registry.admins())
+
+    def outbound_stats(self):
+        """Profondeur de file et trames abandonnées par client"""
+        return {username: client['outbox'].stats() for username, client in self.registry.items() if 'outbox' in client}
 
     def send_admin_client_list(self, admin_client):
         """Envoie la liste complète des clients avec métadonnées à un admin"""
         clients_data = []
-        for username, metadata in self.client_metadata.items():
+        stats = self.outbound_stats()
+        for username, metadata in self.registry.metadata_snapshot().items():
             clients_data.append({
                 'username': username,
                 'connected_at': metadata['connected_at'],
                 'last_activity': metadata['last_activity'],
-                'status': 'active'
+                'status': 'active',
+                'gateway': self.registry.gateway(username),
+                'rooms': self.rooms.rooms_of(username),
+                'outbox': stats.get(username)
+            })
+        for username, peer in self.presence.items():
+            clients_data.append({
+                'username': username,
+                'connected_at': None,
+                'last_activity': None,
+                'status': 'remote',
+                'node': peer,
+                'rooms': self.rooms.rooms_of(username),
             })
         msg = Message(MessageType.ADMIN.CLIENT_LIST_FULL, emitter="SERVER", receiver="ADMIN", value=clients_data)
         self.server.send_message(admin_client, msg.to_json())
 
     def on_message_received(self, client, server, message):
-        print(f"\n[message reçu] {message}")
-        received_msg = Message.from_json(message)
-        if received_msg.message_type == MessageType.DECLARATION:
-            username = received_msg.emitter
-
-            # Détection des clients admin
-            if username == "ADMIN" or username.startswith("ADMIN_"):
-                self.admin_clients.append(client)
-                print(f"[info] Admin '{username}' connecté")
-                # Envoie la liste complète des clients à l'admin
-                self.send_admin_client_list(client)
-            else:
-                # Client régulier - stocke les métadonnées
-                self.client_metadata[username] = {
-                    'connected_at': datetime.now().isoformat(),
-                    'last_activity': datetime.now().isoformat()
-                }
-                # Notifie tous les admins de la nouvelle connexion
-                self.notify_admins_client_connected(username)
-
-            response = Message(MessageType.RECEPTION.TEXT, emitter="SERVER", receiver=username, value=f"Déclaration reçue de {username}")
-            server.send_message(client, response.to_json())
-            self.clients[username] = client
-            print(f"[info] Client '{username}' enregistré")
-            self.broadcast_clients_list()
-        
-        elif received_msg.message_type == MessageType.ENVOI.CLIENT_LIST:
-            users_list = list(self.clients.keys())
-            response = Message(MessageType.RECEPTION.CLIENT_LIST, emitter="SERVER", receiver=received_msg.receiver, value=users_list)
-            server.send_message(client, response.to_json())
-            print(f"CLIENTS = {users_list}")
-
-        elif received_msg.message_type in [MessageType.ENVOI.TEXT, MessageType.ENVOI.IMAGE, MessageType.ENVOI.AUDIO, MessageType.ENVOI.VIDEO, MessageType.ENVOI.SENSOR]:
-            # Met à jour last_activity pour l'émetteur
-            if received_msg.emitter in self.client_metadata:
-                self.client_metadata[received_msg.emitter]['last_activity'] = datetime.now().isoformat()
-
-            # Détermine le type de message pour le log
-            msg_type_simple = 'TEXT'
-            if received_msg.message_type == MessageType.ENVOI.IMAGE:
-                msg_type_simple = 'IMAGE'
-            elif received_msg.message_type == MessageType.ENVOI.AUDIO:
-                msg_type_simple = 'AUDIO'
-            elif received_msg.message_type == MessageType.ENVOI.VIDEO:
-                msg_type_simple = 'VIDEO'
-
-            # Notifie les admins du routage (sans contenu)
-            self.notify_admins_routing(received_msg.emitter, received_msg.receiver, msg_type_simple)
-
-            if received_msg.receiver == "SERVER":
-                print(f"[{received_msg.emitter}] {received_msg.value}")
-            if received_msg.receiver == "SERVER" and received_msg.message_type == MessageType.SYS_MESSAGE:
-                ack_msg = Message(MessageType.SYS_MESSAGE, emitter="SERVER", receiver="", value="VU")
-                server.send_message(client, ack_msg.to_json())
-            if received_msg.receiver == "ALL":
-                reception_type = MessageType.RECEPTION.TEXT
-                if received_msg.message_type == MessageType.ENVOI.IMAGE:
-                    reception_type = MessageType.RECEPTION.IMAGE
-                elif received_msg.message_type == MessageType.ENVOI.AUDIO:
-                    reception_type = MessageType.RECEPTION.AUDIO
-                elif received_msg.message_type == MessageType.ENVOI.VIDEO:
-                    reception_type = MessageType.RECEPTION.VIDEO
-                elif received_msg.message_type == MessageType.ENVOI.SENSOR:
-                    reception_type = MessageType.RECEPTION.SENSOR
-                
-                for client in self.clients.values():
-                    # if sensor_id is present, add it to the message
-                    if received_msg.sensor_id:
-                        message = Message(reception_type, emitter=received_msg.emitter, receiver="ALL", value=received_msg.value, sensor_id=received_msg.sensor_id)
-                    else:
-                        message = Message(reception_type, emitter=received_msg.emitter, receiver="ALL", value=received_msg.value)
-                    self.server.send_message(client, message.to_json())
+        envelope = Envelope.peek(message)
+        if envelope is not None and envelope.message_type in RELAYED_TYPES and envelope.receiver != "SERVER" \
+                and (envelope.message_type != MessageType.ENVOI.CHUNK or envelope.transfer):
+            received_msg = envelope
+        elif isinstance(message, (bytes, bytearray)):
+            received_msg = Message.from_binary(message)
+        else:
+            received_msg = Message.from_json(message)
+        # Résumé tronqué, construit seulement si le niveau DEBUG est actif
+        if self.log.isEnabledFor(logging.DEBUG):
+            fields = {'type': received_msg.message_type, 'emitter': received_msg.emitter, 'receiver': received_msg.receiver, 'size': len(message)}
+            if received_msg is not envelope:
+                fields['value'] = truncate(received_msg.value)
+            self.log.debug("message reçu", extra={'fields': fields})
+        self.heartbeat.seen(client)
+        handler = self.handlers.get(received_msg.message_type)
+        if handler:
+            handler(client, received_msg)
+
+    def on_declaration(self, client, received_msg):
+        username = received_msg.emitter
+
+        event = None
+        # Détection des clients admin
+        is_admin = username == "ADMIN" or username.startswith("ADMIN_")
+        self.negotiate_capabilities(client, username, received_msg.value)
+        if CAPABILITY.REPLAY in client.get('capabilities', ()):
+            # Avant l'enregistrement : le rejeu passe devant les nouveaux messages
+            self.resume(client, username, received_msg.value)
+        # Messages reçus hors ligne : livrés par un thread (la file sortante freine la lecture du
+        # journal) ; jusqu'à la fin, les nouveaux messages directs passent derrière, par le journal
+        backlog = False
+        if self.offline is not None:
+            with self.offline.lock:
+                backlog = self.offline.has(username)
+                if backlog:
+                    self.draining.add(username)
+        # Client régulier : le registre stocke aussi ses métadonnées
+        self.registry.add(username, client, admin=is_admin)
+        if backlog:
+            threading.Thread(target=self.deliver_offline, args=(client, username), daemon=True).start()
+        if is_admin:
+            self.log.info("admin connecté", extra={'fields': {'username': username}})
+            # Envoie la liste complète des clients à l'admin
+            self.send_admin_client_list(client)
+        else:
+            event = self.client_event('connected', username)
+
+        response = Message(MessageType.RECEPTION.TEXT, emitter="SERVER", receiver=username, value=f"Déclaration reçue de {username}")
+        self.send_to(client, response)
+        self.subscriptions.add_client(username)
+        if CAPABILITY.MEMBERSHIP in client.get('capabilities', ()):
+            self.send_membership_snapshot(client, username)
+        # Les autres clients et les admins sont prévenus au prochain lot
+        self.join_roster(username, client, event)
+        self.log.info("client enregistré", extra={'fields': {'username': username}})
+        if CAPABILITY.GATEWAY in client.get('capabilities', ()) and not is_admin:
+            self.attach_devices(client, received_msg.value.get('devices', ()))
+
+    def attach_devices(self, client, devices):
+        """Passerelle : chaque appareil devient un username de sa connexion (routage, listes, salons, abonnements)"""
+        gateway = self.registry.username_of(client)
+        if gateway is None:
+            return
+        for device in devices:
+            if not is_username(device) or device == gateway or self.registry.get(device) is client:
+                continue
+            backlog = False
+            if self.offline is not None:
+                with self.offline.lock:
+                    backlog = self.offline.has(device)
+                    if backlog:
+                        self.draining.add(device)
+            self.registry.attach(device, client)
+            if backlog:
+                threading.Thread(target=self.deliver_offline, args=(client, device), daemon=True).start()
+            self.subscriptions.add_client(device)
+            event = self.client_event('connected', device)
+            event['gateway'] = gateway
+            self.join_roster(device, client, event)
+        self.send_devices(client)
+
+    def join_roster(self, username, client, event):
+        """Publie l'arrivée, sauf si une autre connexion a pris ce username entre-temps (elle s'en charge)"""
+        with self.roster_lock:
+            if self.registry.get(username) is not client:
+                return
+            self.membership.join(username, event)
+            if self.announce:
+                self.announce.join(username, event)
+
+    def detach_devices(self, client, devices):
+        """Appareils retirés de la passerelle (devices None : tous, à la fermeture de la connexion)"""
+        with self.roster_lock:
+            removed = self.registry.detach(client, devices)
+            for device in removed:
+                event = self.client_event('disconnected', device)
+                self.membership.leave(device, event)
+                if self.announce:
+                    self.announce.leave(device, event)
+        for device in removed:
+            self.subscriptions.remove_client(device)
+            if self.conflator:
+                self.conflator.forget(device)
+        if removed and devices is not None:
+            self.send_devices(client)
+
+    def send_devices(self, client):
+        gateway = self.registry.username_of(client)
+        response = Message(MessageType.SYS_MESSAGE, emitter="SERVER", receiver=gateway, value={'devices': self.registry.devices_of(client)})
+        self.send_to(client, response)
+
+    def on_client_list_request(self, client, received_msg):
+        if CAPABILITY.MEMBERSHIP in client.get('capabilities', ()):
+            # Resynchronisation demandée après un trou dans les versions
+            self.send_membership_snapshot(client, received_msg.emitter)
+            return
+        users_list = self.membership.snapshot()['users']
+        response = Message(MessageType.RECEPTION.CLIENT_LIST, emitter="SERVER", receiver=received_msg.receiver, value=users_list)
+        self.server.send_message(client, response.to_json())
+        self.log.debug("liste des clients envoyée", extra={'fields': {'count': len(users_list)}})
+
+    def on_envoi(self, client, received_msg):
+        """ENVOI_* à relayer (TEXT, médias, SENSOR, morceaux...) vers son type RECEPTION_*"""
+        if received_msg.message_type == MessageType.ENVOI.CHUNK:
+            error = transfer_error(received_msg.transfer)
+            if error:
+                # Métadonnées fournies par l'émetteur : refusées ici plutôt que chez le destinataire
+                self.log.warning("morceau refusé", extra={'fields': {'emitter': received_msg.emitter, 'error': error}})
+                self.send_to(client, Message(MessageType.SYS_MESSAGE, emitter="SERVER", receiver=received_msg.emitter,
+                                             value={'error': f"ENVOI_CHUNK refusé : {error}"}))
+                return
+        # Met à jour last_activity pour l'émetteur
+        self.registry.touch(received_msg.emitter)
+
+        # Notifie les admins du routage (sans contenu), une seule fois par transfert découpé
+        if received_msg.message_type == MessageType.ENVOI.CHUNK:
+            if received_msg.transfer['index'] == 0:
+                self.notify_admins_routing(received_msg.emitter, received_msg.receiver, received_msg.transfer['media'].replace("ENVOI_", ""))
+        elif received_msg.message_type != MessageType.ENVOI.CHUNK_ACK:
+            self.notify_admins_routing(received_msg.emitter, received_msg.receiver, received_msg.message_type.replace("ENVOI_", ""))
+
+        if received_msg.receiver == "SERVER":
+            self.log.info("message pour SERVER", extra={'fields': {'emitter': received_msg.emitter, 'value': truncate(received_msg.value)}})
+        # Capteurs continus : seule la dernière valeur de la fenêtre est relayée (si activé)
+        if not (self.conflator and self.conflator.offer(received_msg, client)):
+            self.forward(received_msg, client)
+
+    def on_telemetry(self, message):
+        """Mesure reçue en UDP : même chemin qu'un ENVOI_SENSOR (conflation, abonnements, autres serveurs)"""
+        self.registry.touch(message.emitter)
+        self.notify_admins_routing(message.emitter, message.receiver, "SENSOR")
+        if not (self.conflator and self.conflator.offer(message, None)):
+            self.forward(message, None)
+
+    def on_sys_message(self, client, received_msg):
+        # Accusés de réception : cumulés ({'ack': n}) ou un "MESSAGE OK" par message (clients historiques)
+        if isinstance(received_msg.value, dict) and 'ack' in received_msg.value:
+            seq = received_msg.value['ack']
+            if isinstance(seq, int) and not isinstance(seq, bool):
+                client['outbox'].ack(seq)
             else:
-                receiver_client = self.clients.get(received_msg.receiver, None)
+                self.log.warning("accusé refusé", extra={'fields': {'emitter': received_msg.emitter, 'ack': truncate(seq)}})
+                self.send_to(client, Message(MessageType.SYS_MESSAGE, emitter="SERVER", receiver=received_msg.emitter,
+                                             value={'error': "accusé refusé : 'ack' doit être un entier"}))
+            return
+        if received_msg.value == "MESSAGE OK":
+            client['outbox'].ack(client['outbox'].acked + 1)
+            return
+        if isinstance(received_msg.value, dict) and ('attach' in received_msg.value or 'detach' in received_msg.value) \
+                and CAPABILITY.GATEWAY in client.get('capabilities', ()):
+            if 'attach' in received_msg.value:
+                self.attach_devices(client, received_msg.value['attach'])
+            if 'detach' in received_msg.value:
+                self.detach_devices(client, received_msg.value['detach'])
+            return
+        # Forward SYS_MESSAGE (like VU) to the target receiver
+        target = received_msg.receiver
+        if target and target != "SERVER" and target != "ALL":
+            receiver_client = self.registry.get(target)
+            peer = self.presence.peer_of(target) if receiver_client is None else None
+            if receiver_client or peer is not None:
+                forward_msg = Message(MessageType.SYS_MESSAGE, emitter=received_msg.emitter, receiver=target, value=received_msg.value)
                 if receiver_client:
-                    reception_type = MessageType.RECEPTION.TEXT
-                    if received_msg.message_type == MessageType.ENVOI.IMAGE:
-                        reception_type = MessageType.RECEPTION.IMAGE
-                    elif received_msg.message_type == MessageType.ENVOI.AUDIO:
-                        reception_type = MessageType.RECEPTION.AUDIO
-                    elif received_msg.message_type == MessageType.ENVOI.VIDEO:
-                        reception_type = MessageType.RECEPTION.VIDEO
-                    
-                    forward_msg = Message(reception_type, emitter=received_msg.emitter, receiver=received_msg.receiver, value=received_msg.value)
-                    server.send_message(receiver_client, forward_msg.to_json())
+                    self.server.send_message(receiver_client, forward_msg.to_json())
                 else:
-                    error_msg = Message(MessageType.RECEPTION.TEXT, emitter="SERVER", receiver=received_msg.emitter, value=f"Erreur: destinataire {received_msg.receiver} non trouvé.")
-                    server.send_message(client, error_msg.to_json())
-        elif received_msg.message_type == MessageType.SYS_MESSAGE:
-             # Forward SYS_MESSAGE (like VU) to the target receiver
-             target = received_msg.receiver
-             if target and target != "SERVER" and target != "ALL":
-                 receiver_client = self.clients.get(target, None)
-                 if receiver_client:
-                     forward_msg = Message(MessageType.SYS_MESSAGE, emitter=received_msg.emitter, receiver=target, value=received_msg.value)
-                     server.send_message(receiver_client, forward_msg.to_json())
-
-        print("[SERVER] > ", end="", flush=True)
+                    self.plane.send(peer, Plane.DELIVER, {'receiver': target, 'binary': False}, forward_msg.to_json())
+
+    def update_subscriptions(self, client, received_msg):
+        """ENVOI_SUBSCRIBE / ENVOI_UNSUBSCRIBE : met à jour l'index et renvoie les sujets courants"""
+        username = received_msg.emitter
+        value = received_msg.value if isinstance(received_msg.value, dict) else {}
+        emitters = value.get('emitters')
+        sensor_ids = value.get('sensor_ids')
+        if received_msg.message_type == MessageType.ENVOI.SUBSCRIBE:
+            topics = self.subscriptions.subscribe(username, emitters, sensor_ids)
+        else:
+            topics = self.subscriptions.unsubscribe(username, emitters, sensor_ids)
+        response = Message(MessageType.SYS_MESSAGE, emitter="SERVER", receiver=username, value={'subscriptions': topics})
+        self.send_to(client, response)
+
+    def update_rooms(self, client, received_msg):
+        """ENVOI_ROOM_CREATE / JOIN / LEAVE : met à jour les salons et renvoie ceux du client"""
+        username = received_msg.emitter
+        room = str(received_msg.value or "").lstrip("#")
+        if not room:
+            return
+        if received_msg.message_type == MessageType.ENVOI.ROOM_CREATE:
+            self.rooms.create(room, username)
+            op = 'create'
+        elif received_msg.message_type == MessageType.ENVOI.ROOM_JOIN:
+            if not self.rooms.join(room, username):
+                error_msg = Message(MessageType.RECEPTION.TEXT, emitter="SERVER", receiver=username, value=f"Erreur: salon {room} inexistant.")
+                self.send_to(client, error_msg)
+                return
+            op = 'join'
+        else:
+            self.rooms.leave(room, username)
+            op = 'leave'
+        if self.plane:
+            # Chaque serveur garde tous les salons : les membres sont répartis entre les processus
+            self.plane.broadcast(Plane.ROOM, {'op': op, 'room': room, 'username': username})
+        response = Message(MessageType.SYS_MESSAGE, emitter="SERVER", receiver=username, value={'rooms': self.rooms.rooms_of(username)})
+        self.send_to(client, response)
+
+    def relay(self, envelope, client):
+        """Relaie la charge utile reçue telle quelle, seul le type passe de ENVOI_* à RECEPTION_*"""
+        if envelope.receiver == "ALL":
+            recipients = self.registry.clients()
+            self.share(envelope)
+        elif room_name(envelope.receiver):
+            room = room_name(envelope.receiver)
+            if not self.rooms.exists(room):
+                error_msg = Message(MessageType.RECEPTION.TEXT, emitter="SERVER", receiver=envelope.emitter, value=f"Erreur: salon {room} inexistant.")
+                self.send_to(client, error_msg)
+                return
+            recipients = self.registry.lookup(self.rooms.members(room))
+            self.share(envelope)
+        else:
+            receiver_client = self.direct_client(envelope.receiver)
+            if receiver_client is None:
+                self.receiver_missing(envelope, client)
+                return
+            recipients = [receiver_client]
+        self.send_raw(envelope, RECEPTION_FOR[envelope.message_type], recipients)
+
+    def send_raw(self, envelope, message_type, clients):
+        """Comme send_to_all, à partir de la charge utile d'origine : une trame par format"""
+        if not clients:
+            return
+        kind = traffic_class(message_type)
+        sequenced = message_type in SEQUENCED_TYPES
+        raw = envelope.retyped(message_type)
+        if not envelope.is_binary():
+            frame = encode_frame(raw)
+            for client in clients:
+                self.server.send_frame(client, frame, kind, sequenced)
+            return
+        frames = {}
+        for client in clients:
+            use_binary = CAPABILITY.BINARY in client.get('capabilities', ())
+            frame = frames.get(use_binary)
+            if frame is None:
+                if use_binary:
+                    frame = encode_frame(raw, OPCODE_BINARY)
+                else:
+                    # Client historique : seul cas où le média est décodé (JSON base64)
+                    frame = encode_frame(Message.from_binary(raw).to_json())
+                frames[use_binary] = frame
+            self.server.send_frame(client, frame, kind, sequenced)
+
+    def receiver_missing(self, received_msg, client):
+        """Destinataire direct introuvable ici : connecté à un autre serveur, en coupure courte ou hors ligne"""
+        if self.send_remote(received_msg) or self.hold(received_msg) or self.store_offline(received_msg, client):
+            return
+        if client is None:
+            # Mesure UDP (voir on_telemetry) : pas de connexion à prévenir
+            return
+        if received_msg.message_type == MessageType.ENVOI.CHUNK:
+            # Destinataire absent : l'émetteur met le transfert en pause jusqu'à son retour
+            offline_msg = Message(MessageType.RECEPTION.CHUNK_ACK, emitter="SERVER", receiver=received_msg.emitter, value={'id': received_msg.transfer['id'], 'index': -1, 'status': 'receiver_offline'})
+            self.send_to(client, offline_msg)
+        elif received_msg.message_type == MessageType.ENVOI.CHUNK_ACK:
+            pass
+        else:
+            error_msg = Message(MessageType.RECEPTION.TEXT, emitter="SERVER", receiver=received_msg.emitter, value=f"Erreur: destinataire {received_msg.receiver} non trouvé.")
+            self.send_to(client, error_msg)
+
+    def forward(self, received_msg, client):
+        """Relaie un message ENVOI_* vers ALL, un salon ou son destinataire (type RECEPTION_* correspondant)"""
+        if isinstance(received_msg, Envelope):
+            self.relay(received_msg, client)
+            return
+        # Même message pour tous les destinataires : encodé une seule fois par format
+        message = Message(RECEPTION_FOR[received_msg.message_type], emitter=received_msg.emitter, receiver=received_msg.receiver, value=received_msg.value, sensor_id=received_msg.sensor_id, mime=received_msg.mime, transfer=received_msg.transfer)
+        if received_msg.receiver == "ALL":
+            self.share(received_msg)
+            if message.message_type == MessageType.RECEPTION.SENSOR:
+                # Uniquement les clients abonnés à ce flux (et ceux qui n'ont pas d'abonnement)
+                usernames = self.subscriptions.recipients(received_msg.emitter, received_msg.sensor_id)
+                self.send_to_all(message, self.registry.lookup(usernames))
+            else:
+                self.send_to_all(message)
+        elif room_name(received_msg.receiver):
+            room = room_name(received_msg.receiver)
+            if self.rooms.exists(room):
+                self.share(received_msg)
+                # Membres connectés du salon, même trame pour tous
+                self.send_to_all(message, self.registry.lookup(self.rooms.members(room)))
+            elif client is not None:
+                error_msg = Message(MessageType.RECEPTION.TEXT, emitter="SERVER", receiver=received_msg.emitter, value=f"Erreur: salon {room} inexistant.")
+                self.send_to(client, error_msg)
+        else:
+            # Les morceaux sont relayés dès leur arrivée, sans réassembler le fichier
+            receiver_client = self.direct_client(received_msg.receiver)
+            if receiver_client:
+                self.send_to(receiver_client, message)
+            else:
+                self.receiver_missing(received_msg, client)
+
+    # --- Plan de routage entre serveurs (voir Plane) ---
+
+    def share(self, received_msg):
+        """ALL ou salon : le même message pour les clients des autres serveurs, en un seul paquet par pair"""
+        if self.plane is None or not self.plane.connected:
+            return
+        payload, binary = self.reception_payload(received_msg, RECEPTION_FOR[received_msg.message_type], received_msg.is_binary())
+        self.plane.broadcast(Plane.DELIVER, {'receiver': received_msg.receiver, 'binary': binary}, payload)
+
+    def send_remote(self, received_msg):
+        """Message direct pour un username connecté à un autre serveur : un seul saut par le plan"""
+        if self.plane is None or received_msg.receiver in self.draining:
+            # Journal hors ligne en cours de livraison vers ce username : on passe derrière
+            return False
+        peer = self.presence.peer_of(received_msg.receiver)
+        if peer is None:
+            return False
+        payload, binary = self.reception_payload(received_msg, RECEPTION_FOR[received_msg.message_type], received_msg.is_binary())
+        self.plane.send(peer, Plane.DELIVER, {'receiver': received_msg.receiver, 'binary': binary}, payload)
+        return True
+
+    def on_plane_packet(self, peer, kind, header, payload):
+        """Paquet d'un autre serveur (thread de lecture du plan)"""
+        if kind == Plane.DELIVER:
+            self.deliver_remote(header, payload)
+        elif kind == Plane.PRESENCE:
+            self.update_presence(peer, header)
+        elif kind == Plane.ROOM:
+            self.apply_room(header)
+        elif kind == Plane.ROUTING:
+            for events, admin_ids in self.routing.batches(header['events']):
+                self.send_routing(events, admin_ids)
+
+    def deliver_remote(self, header, payload):
+        """Livre aux clients locaux un message relayé par un autre serveur, tel qu'il a été encodé là-bas"""
+        binary = header['binary']
+        envelope = Envelope.peek(payload if binary else payload.decode("utf-8"))
+        if envelope is None:
+            self.log.warning("paquet du plan illisible", extra={'fields': {'receiver': header['receiver'], 'size': len(payload)}})
+            return
+        receiver = header['receiver']
+        if receiver == "ALL":
+            if envelope.message_type == MessageType.RECEPTION.SENSOR:
+                recipients = self.registry.lookup(self.subscriptions.recipients(envelope.emitter, envelope.sensor_id))
+            else:
+                recipients = self.registry.clients()
+        elif room_name(receiver):
+            recipients = self.registry.lookup(self.rooms.members(room_name(receiver)))
+        else:
+            receiver_client = self.direct_client(receiver)
+            if receiver_client is None and self.offline is not None and envelope.message_type in SEQUENCED_TYPES:
+                # Parti entre-temps (ou journal en cours de livraison) : conservé ici, livré à sa prochaine connexion
+                with self.offline.lock:
+                    receiver_client = self.direct_client(receiver)
+                    if receiver_client is None:
+                        self.offline.append(receiver, payload, binary)
+            if receiver_client is None:
+                return
+            recipients = [receiver_client]
+        self.send_raw(envelope, envelope.message_type, recipients)
+
+    def publish_presence(self, delta, events):
+        """Lot d'arrivées/départs locaux (self.announce) pour les autres serveurs"""
+        header = {'events': events}
+        if delta:
+            header.update(joined=delta['joined'], left=delta['left'])
+        self.plane.broadcast(Plane.PRESENCE, header)
+
+    def sync_peer(self, peer):
+        """Connexion établie vers un pair : état complet (usernames locaux, salons), les lots suivants s'y ajoutent"""
+        with self.announce.lock:
+            # Sous le verrou : aucun lot ne peut passer entre l'instantané et la suite
+            self.plane.send(peer, Plane.PRESENCE, {'reset': True, 'joined': self.announce.snapshot()['users']})
+        self.plane.send(peer, Plane.ROOM, {'op': 'sync', 'rooms': self.rooms.snapshot()})
+
+    def update_presence(self, peer, header):
+        """Arrivées/départs chez un pair : même liste des clients partout, même lots d'événements admin"""
+        if header.get('reset'):
+            for username in self.presence.drop_peer(peer):
+                self.membership.leave(username)
+        for username in header.get('joined', ()):
+            self.presence.add(peer, username)
+            self.membership.join(username)
+            if self.offline is not None:
+                # Messages gardés ici pendant son absence : remis au serveur où il s'est connecté
+                with self.offline.lock:
+                    backlog = self.offline.has(username) and username not in self.draining
+                    if backlog:
+                        self.draining.add(username)
+                if backlog:
+                    threading.Thread(target=self.deliver_offline, args=(None, username, peer), daemon=True).start()
+        for username in header.get('left', ()):
+            if self.presence.remove(peer, username):
+                self.membership.leave(username)
+        for event in header.get('events', ()):
+            self.membership.event(event)
+
+    def on_peer_down(self, peer):
+        """Pair perdu (processus arrêté) : ses clients sont déconnectés pour tout le monde"""
+        for username in self.presence.drop_peer(peer):
+            event = None if username == "ADMIN" or username.startswith("ADMIN_") else self.client_event('disconnected', username)
+            self.membership.leave(username, event)
+
+    def apply_room(self, header):
+        room = header.get('room')
+        if header['op'] == 'sync':
+            self.rooms.merge(header['rooms'])
+        elif header['op'] == 'create':
+            self.rooms.create(room, header['username'])
+        elif header['op'] == 'join':
+            self.rooms.join(room, header['username'])
+        else:
+            self.rooms.leave(room, header['username'])
 
     def input_loop(self):
         print("\nChat serveur démarré. Tapez 'dest:message' pour envoyer (ex: Client:bonjour)")
         print("Tapez 'img:dest:chemin' pour envoyer une image (ex: img:Client:/path/image.png)")
         print("Tapez 'audio:dest:chemin' pour envoyer un audio (ex: audio:Client:/path/audio.mp3)")
         print("Tapez 'video:dest:chemin' pour envoyer une video (ex: video:Client:/path/video.mp4)")
-        print("Tapez 'list' pour voir les clients connectés, 'disconnect' pour quitter.\n")
+        print("Tapez 'list' pour voir les clients connectés, 'stats' pour les files sortantes, 'disconnect' pour quitter.\n")
         while self.running:
             try:
                 print("[SERVER] > ", end="", flush=True)
@@ -236,7 +864,16 @@ class WSServer:
                     self.server.shutdown_gracefully()
                     break
                 elif user_input.lower() == "list":
-                    print(f"Clients connectés: {list(self.clients.keys())}")
+                    print(f"Clients connectés: {self.registry.usernames()}")
+                elif user_input.lower() == "stats":
+                    for name, stats in self.outbound_stats().items():
+                        print(f"  {name}: {stats}")
+                    if self.conflator:
+                        print(f"  conflation: {self.conflator.stats()}")
+                    if self.offline:
+                        print(f"  hors ligne: {self.offline.stats()}")
+                    if self.telemetry:
+                        print(f"  télémétrie: {self.telemetry.stats()}")
                 elif user_input.lower().startswith("img:"):
                     parts = user_input[4:].split(":", 1)
                     if len(parts) == 2:
@@ -265,16 +902,15 @@ class WSServer:
                     dest, value = user_input.split(":", 1)
                     dest = dest.strip()
                     value = value.strip()
-                    if dest.lower() == "ALL":
-                        for name, client in self.clients.items():
-                            msg = Message(MessageType.RECEPTION.TEXT, emitter="SERVER", receiver=name, value=value)
-                            self.server.send_message(client, msg.to_json())
+                    if dest.upper() == "ALL":
+                        msg = Message(MessageType.RECEPTION.TEXT, emitter="SERVER", receiver="ALL", value=value)
+                        self.send_to_all(msg)
                         print(f"[envoyé à tous] {value}")
                     else:
-                        receiver_client = self.clients.get(dest, None)
+                        receiver_client = self.registry.get(dest)
                         if receiver_client:
                             msg = Message(MessageType.RECEPTION.TEXT, emitter="SERVER", receiver=dest, value=value)
-                            self.server.send_message(receiver_client, msg.to_json())
+                            self.send_to(receiver_client, msg)
                             print(f"[envoyé à {dest}] {value}")
                         else:
                             print(f"[erreur] Client '{dest}' non trouvé")
@@ -283,77 +919,126 @@ class WSServer:
             except EOFError:
                 break
 
-    def start(self):
-        print(f"Serveur WS sur ws://{self.host}:{self.port}")
+    def start(self, interactive=True):
+        """interactive : console sur l'entrée standard (désactivée pour les processus de WSServer.sharded)"""
+        print(f"Serveur WS sur ws://{self.host}:{self.port} (moteur {self.engine})")
         self.running = True
+        if self.plane:
+            self.plane.start(self.on_plane_packet, self.sync_peer, self.on_peer_down)
+        if self.telemetry:
+            self.telemetry.start()
 
-        input_thread = threading.Thread(target=self.input_loop, daemon=True)
-        input_thread.start()
+        if interactive:
+            input_thread = threading.Thread(target=self.input_loop, daemon=True)
+            input_thread.start()
 
         self.server.run_forever()
+        if self.plane:
+            self.plane.close()
+        if self.telemetry:
+            self.telemetry.close()
+        if self.offline:
+            self.offline.close()
 
     def send_image(self, filepath, dest):
         with open(filepath, "rb") as f:
-            img_base64 = base64.b64encode(f.read()).decode("utf-8")
-        value = f"IMG:{img_base64}"
-        if dest.lower() == "ALL":
-            for name, client in self.clients.items():
-                msg = Message(MessageType.RECEPTION.IMAGE, emitter="SERVER", receiver=name, value=value)
-                self.server.send_message(client, msg.to_json())
+            value = f.read()
+        mime = mimetypes.guess_type(filepath)[0]
+        if dest.upper() == "ALL":
+            msg = Message(MessageType.RECEPTION.IMAGE, emitter="SERVER", receiver="ALL", value=value, mime=mime)
+            self.send_to_all(msg)
             print(f"[image envoyée à tous]")
         else:
-            receiver_client = self.clients.get(dest, None)
+            receiver_client = self.registry.get(dest)
             if receiver_client:
-                msg = Message(MessageType.RECEPTION.IMAGE, emitter="SERVER", receiver=dest, value=value)
-                self.server.send_message(receiver_client, msg.to_json())
+                msg = Message(MessageType.RECEPTION.IMAGE, emitter="SERVER", receiver=dest, value=value, mime=mime)
+                self.send_to(receiver_client, msg)
                 print(f"[image envoyée à {dest}]")
             else:
                 print(f"[erreur] Client '{dest}' non trouvé")
 
     def send_audio(self, filepath, dest):
         with open(filepath, "rb") as f:
-            audio_base64 = base64.b64encode(f.read()).decode("utf-8")
-        value = f"AUDIO:{audio_base64}"
-        if dest.lower() == "ALL":
-            for name, client in self.clients.items():
-                msg = Message(MessageType.RECEPTION.AUDIO, emitter="SERVER", receiver=name, value=value)
-                self.server.send_message(client, msg.to_json())
+            value = f.read()
+        mime = mimetypes.guess_type(filepath)[0]
+        if dest.upper() == "ALL":
+            msg = Message(MessageType.RECEPTION.AUDIO, emitter="SERVER", receiver="ALL", value=value, mime=mime)
+            self.send_to_all(msg)
             print(f"[audio envoyé à tous]")
         else:
-            receiver_client = self.clients.get(dest, None)
+            receiver_client = self.registry.get(dest)
             if receiver_client:
-                msg = Message(MessageType.RECEPTION.AUDIO, emitter="SERVER", receiver=dest, value=value)
-                self.server.send_message(receiver_client, msg.to_json())
+                msg = Message(MessageType.RECEPTION.AUDIO, emitter="SERVER", receiver=dest, value=value, mime=mime)
+                self.send_to(receiver_client, msg)
                 print(f"[audio envoyé à {dest}]")
             else:
                 print(f"[erreur] Client '{dest}' non trouvé")
 
     def send_video(self, filepath, dest):
         with open(filepath, "rb") as f:
-            video_base64 = base64.b64encode(f.read()).decode("utf-8")
-        value = f"VIDEO:{video_base64}"
-        if dest.lower() == "ALL":
-            for name, client in self.clients.items():
-                msg = Message(MessageType.RECEPTION.VIDEO, emitter="SERVER", receiver=name, value=value)
-                self.server.send_message(client, msg.to_json())
+            value = f.read()
+        mime = mimetypes.guess_type(filepath)[0]
+        if dest.upper() == "ALL":
+            msg = Message(MessageType.RECEPTION.VIDEO, emitter="SERVER", receiver="ALL", value=value, mime=mime)
+            self.send_to_all(msg)
             print(f"[video envoyée à tous]")
         else:
-            receiver_client = self.clients.get(dest, None)
+            receiver_client = self.registry.get(dest)
             if receiver_client:
-                msg = Message(MessageType.RECEPTION.VIDEO, emitter="SERVER", receiver=dest, value=value)
-                self.server.send_message(receiver_client, msg.to_json())
+                msg = Message(MessageType.RECEPTION.VIDEO, emitter="SERVER", receiver=dest, value=value, mime=mime)
+                self.send_to(receiver_client, msg)
                 print(f"[video envoyée à {dest}]")
             else:
                 print(f"[erreur] Client '{dest}' non trouvé")
 
     @staticmethod
-    def dev():
-        return WSServer(Context.dev())
+    def dev(engine="threaded", **options):
+        return WSServer(Context.dev(), engine, **options)
 
     @staticmethod
-    def prod():
-        return WSServer(Context.prod())
+    def prod(engine="threaded", **options):
+        return WSServer(Context.prod(), engine, **options)
+
+    @staticmethod
+    def sharded(ctx, workers=None, engine="asyncio", **options):
+        """workers processus serveurs sur le même port (SO_REUSEPORT, le noyau répartit les connexions),
+        reliés par un plan de routage sur sockets Unix : un seul saut vers le serveur du destinataire"""
+        workers = workers or os.cpu_count()
+        # Les sockets Unix du plan sont dans un répertoire partagé : seuls les processus lancés ici ont le jeton
+        token = secrets.token_hex(16)
+        processes = [multiprocessing.Process(target=run_worker, args=(ctx, index, workers, engine, options, token), name=f"ws-worker-{index}")
+                     for index in range(workers)]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+
+
+def run_worker(ctx, index, workers, engine, options, token=None):
+    """Processus n° index de WSServer.sharded"""
+    offline_options = options.get('offline_options')
+    if offline_options not in (None, False):
+        # Un journal hors ligne par processus (chaque répertoire est verrouillé par son OfflineStore)
+        offline_options = dict(offline_options)
+        directory = offline_options.get('directory') or DEFAULT_DIRECTORY
+        offline_options['directory'] = os.path.join(directory, f"worker-{index}")
+    options = dict(options, offline_options=offline_options)
+    plane = Plane.UnixPlane(index, workers, name=f"ws-{ctx.port}", token=token)
+    WSServer(ctx, engine, plane=plane, reuse_port=True, **options).start(interactive=False)
+
 
 if __name__ == "__main__":
-    ws_server = WSServer.prod()
-    ws_server.start()
\ No newline at end of file
+    engine = sys.argv[1] if len(sys.argv) > 1 else "threaded"
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    # Journal hors ligne si WS_OFFLINE_DIR est défini (répertoire privé, un seul processus à la fois)
+    offline_options = {'directory': os.environ["WS_OFFLINE_DIR"]} if os.environ.get("WS_OFFLINE_DIR") else None
+    if workers > 1:
+        WSServer.sharded(Context.prod(), workers, engine, offline_options=offline_options)
+    else:
+        # Nœud d'un cluster si WS_CLUSTER_NODES est défini (voir Plane.TcpPlane.from_env)
+        ws_server = WSServer.prod(engine, plane=Plane.TcpPlane.from_env(), offline_options=offline_options)
+        ws_server.start()
\ No newline at end of file
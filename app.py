@@ -12,6 +12,7 @@ import datetime
 from Message import MessageType
 import base64
 import tempfile
+import mimetypes
 import os
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtGui import QPixmap
@@ -48,22 +49,31 @@ class ChatWindow(QMainWindow):
             if content == "VU":
                 self.add_mock_message(emitter, receiver, time_str, "Le message à bien été reçu")
         if message_type == MessageType.RECEPTION.IMAGE:
-            # decode image + add in ui
-            content = content.split(":")[1]
-            content = base64.b64decode(content)
+            # trame binaire : octets bruts, transfert découpé : fichier sur disque, sinon "IMG:base64" à décoder
+            if message.transfer:
+                with open(message.transfer['path'], "rb") as f:
+                    content = f.read()
+            elif not message.is_binary():
+                content = base64.b64decode(content.split(":")[1])
             self.update_media_panel(content)
 
         elif message_type == MessageType.RECEPTION.AUDIO:
             # split header if present (e.g. AUDIO:base64...)
-            if ":" in content:
-                content = content.split(":")[1]
-            
-            self.play_media(content, is_video=False)
+            if message.transfer:
+                self.play_file(message.transfer['path'])
+                return
+            if not message.is_binary():
+                content = base64.b64decode(content.split(":")[1] if ":" in content else content)
+            self.play_media(content, is_video=False, mime=message.mime)
         
         elif message_type == MessageType.RECEPTION.VIDEO:
             print("Video received client")
-            content = content.split(":")[1]
-            self.play_media(content, is_video=True)
+            if message.transfer:
+                self.play_file(message.transfer['path'])
+                return
+            if not message.is_binary():
+                content = base64.b64decode(content.split(":")[1])
+            self.play_media(content, is_video=True, mime=message.mime)
 
         elif message_type == MessageType.RECEPTION.TEXT:
             if receiver == "ALL" and emitter != self.client.username:
@@ -459,30 +469,31 @@ class ChatWindow(QMainWindow):
             self.image_label.setStyleSheet("background-color: transparent;")
             self.media_stack.setCurrentWidget(self.image_label)
 
-    def play_media(self, base64_content, is_video=True):
-        # Decode and save to temp file
+    def play_media(self, data, is_video=True, mime=None):
+        # Save raw bytes to temp file
         try:
-            data = base64.b64decode(base64_content)
             # Create a temp file with appropriate extension
-            suffix = ".mp4" if is_video else ".mp3"
+            suffix = (mime and mimetypes.guess_extension(mime)) or (".mp4" if is_video else ".mp3")
             
             # Note: In a real app we might want to manage these files better (clean up)
             # For now, we create a temp file that persists at least until played
             fd, path = tempfile.mkstemp(suffix=suffix)
             with os.fdopen(fd, 'wb') as tmp:
                 tmp.write(data)
-            
-            url = QUrl.fromLocalFile(path)
-            content = QMediaContent(url)
-            self.media_player.setMedia(content)
-            
-            self.media_stack.setCurrentWidget(self.video_container)
-            self.media_player.play()
-            print(f"Playing media from: {path}")
+            self.play_file(path)
             
         except Exception as e:
             print(f"Error playing media: {e}")
 
+    def play_file(self, path):
+        url = QUrl.fromLocalFile(path)
+        content = QMediaContent(url)
+        self.media_player.setMedia(content)
+        
+        self.media_stack.setCurrentWidget(self.video_container)
+        self.media_player.play()
+        print(f"Playing media from: {path}")
+
     def add_mock_message(self, sender, target, time, message):
         item_widget = QWidget()
         item_layout = QVBoxLayout(item_widget)
@@ -0,0 +1,84 @@
+"""
+Benchmark du broadcast "ALL" : encodage par destinataire (ancien chemin) vs encodage unique.
+
+Les files sortantes des clients ne sont pas vidées (pas de socket), pour isoler le coût CPU
+du routage. On compare ensuite au coût d'une mise en file seule (trame déjà construite) :
+avec l'encodage unique, le coût par destinataire doit s'en approcher.
+
+    python3 bench/bench_broadcast.py [nb_clients] [taille_image_octets]
+"""
+import base64
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Context import Context
+from Message import Message, MessageType
+from Outbox import Outbox
+from WSFrame import encode_frame
+from WSServer import WSServer
+
+
+def make_server(nb_clients):
+    """WSServer (moteur asyncio, non démarré) avec nb_clients factices"""
+    ws = WSServer(Context("127.0.0.1", 0), engine="asyncio")
+    for i in range(nb_clients):
+        outbox = Outbox(max_frames=10 ** 9, max_bytes=10 ** 15)
+        ws.registry.add(f"client_{i}", {'id': i, 'handler': None, 'address': None, 'outbox': outbox})
+    return ws
+
+
+def reset(ws):
+    for client in ws.registry.clients():
+        client['outbox'].close()
+        client['outbox'].closed = False
+
+
+def bench(ws, fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        reset(ws)
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    nb_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 2 * 1024 * 1024
+    value = "IMG:" + base64.b64encode(os.urandom(size)).decode("utf-8")
+    ws = make_server(nb_clients)
+    clients = ws.registry.clients()
+
+    def per_recipient():
+        # Ancien chemin : un Message + to_json + trame par client
+        for client in clients:
+            msg = Message(MessageType.RECEPTION.IMAGE, emitter="A", receiver="ALL", value=value)
+            ws.server.send_message(client, msg.to_json())
+
+    def encode_once():
+        msg = Message(MessageType.RECEPTION.IMAGE, emitter="A", receiver="ALL", value=value)
+        ws.send_to_all(msg)
+
+    frame = encode_frame(Message(MessageType.RECEPTION.IMAGE, emitter="A", receiver="ALL", value=value).to_json())
+
+    def enqueue_only():
+        for client in clients:
+            ws.server.send_frame(client, frame)
+
+    t_old = bench(ws, per_recipient)
+    t_new = bench(ws, encode_once)
+    t_write = bench(ws, enqueue_only)
+
+    print(f"{nb_clients} clients, image {size} octets (JSON {len(frame)} octets)")
+    print(f"  encodage par destinataire : {t_old * 1000:9.2f} ms  ({t_old / nb_clients * 1e6:9.1f} us / client)")
+    print(f"  encodage unique           : {t_new * 1000:9.2f} ms  ({t_new / nb_clients * 1e6:9.1f} us / client)")
+    print(f"  mise en file seule        : {t_write * 1000:9.2f} ms  ({t_write / nb_clients * 1e6:9.1f} us / client)")
+    print(f"  coût d'encodage unique amorti : {(t_new - t_write) / nb_clients * 1e6:.1f} us / client")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Benchmark des codecs JSON de Message (voir Codec.py) : encodage et décodage d'un TEXT,
+d'une mesure SENSOR et d'une IMAGE de 1 Mo (base64), pour chaque codec installé.
+
+    python3 bench/bench_codec.py
+"""
+import base64
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Codec
+from Message import Message, MessageType, SENSOR_ID
+
+
+def bench(fn, budget=0.3):
+    """Meilleur temps par appel (s) sur environ budget secondes"""
+    n = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= budget / 5:
+            break
+        n *= 2
+    best = elapsed
+    for _ in range(4):
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        best = min(best, time.perf_counter() - start)
+    return best / n
+
+
+def main():
+    messages = {
+        'TEXT': Message(MessageType.ENVOI.TEXT, emitter="Client", receiver="ALL", value="Bonjour à tous !"),
+        'SENSOR': Message(MessageType.ENVOI.SENSOR, emitter="ESP32", receiver="ALL", sensor_id=SENSOR_ID.JOYSTICK,
+                          value={'x': 512, 'y': 498, 'pressed': False}),
+        'IMAGE 1 Mo': Message(MessageType.ENVOI.IMAGE, emitter="ESP32", receiver="UI",
+                              value="IMG:" + base64.b64encode(os.urandom(1024 * 1024)).decode("utf-8")),
+    }
+    codecs = [name for name, available in Codec.AVAILABLE.items() if available]
+    print(f"Codecs installés : {', '.join(codecs)} (par défaut : {Codec.codec.name})")
+    print(f"{'message':<12} {'codec':<8} {'encodage':>12} {'décodage':>12} {'débit enc.':>12} {'débit déc.':>12}")
+    for label, message in messages.items():
+        for name in codecs:
+            Codec.set_codec(name)
+            encoded = message.to_json()
+            t_enc = bench(message.to_json)
+            t_dec = bench(lambda: Message.from_json(encoded))
+            size = len(encoded)
+            print(f"{label:<12} {name:<8} {t_enc * 1e6:>9.1f} us {t_dec * 1e6:>9.1f} us "
+                  f"{size / t_enc / 1e6:>8.0f} Mo/s {size / t_dec / 1e6:>8.0f} Mo/s")
+
+
+if __name__ == "__main__":
+    main()
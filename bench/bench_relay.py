@@ -0,0 +1,49 @@
+"""
+Benchmark du relais d'un média JSON vers un destinataire : décodage complet + ré-encodage
+(ancien chemin) vs lecture de l'en-tête seul et relais de la charge utile telle quelle.
+
+    python3 bench/bench_relay.py
+"""
+import base64
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Message import Envelope, Message, MessageType
+from WSFrame import encode_frame
+
+
+def bench(fn, repeat=20):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    print(f"{'taille':>10}  {'décodage complet':>17}  {'en-tête seul':>13}  {'dont lecture en-tête':>21}")
+    for size in (1024, 64 * 1024, 1024 * 1024, 8 * 1024 * 1024):
+        value = "VID:" + base64.b64encode(os.urandom(size)).decode("utf-8")
+        raw = Message(MessageType.ENVOI.VIDEO, emitter="ESP32", receiver="UI", value=value).to_json()
+
+        def full_parse():
+            received = Message.from_json(raw)
+            forward = Message(MessageType.RECEPTION.VIDEO, emitter=received.emitter, receiver=received.receiver, value=received.value)
+            encode_frame(forward.to_json())
+
+        def header_first():
+            envelope = Envelope.peek(raw)
+            encode_frame(envelope.retyped(MessageType.RECEPTION.VIDEO))
+
+        t_full = bench(full_parse)
+        t_fast = bench(header_first)
+        t_peek = bench(lambda: Envelope.peek(raw))
+        print(f"{size:>10}  {t_full * 1000:>14.3f} ms  {t_fast * 1000:>10.3f} ms  {t_peek * 1e6:>18.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Banc local de la télémétrie UDP : des appareils simulés envoient des mesures sur 127.0.0.1,
+WSServer (moteur asyncio, non démarré) les route comme des ENVOI_SENSOR vers un abonné factice
+dont la file sortante est vidée par un thread. Affiche le débit atteint, les comptes par source
+(pertes, limitation) et la taille d'une mesure en datagramme, en trame binaire et en JSON.
+
+    python3 bench/telemetry_loopback.py [nb_appareils] [mesures_par_seconde_par_appareil] [durée_s]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Context import Context
+from Message import Message, MessageType, SENSOR_ID
+from Outbox import Outbox
+from Telemetry import TelemetrySender, encode_datagram
+from WSServer import WSServer
+
+
+def make_server(max_rate):
+    """WSServer avec la télémétrie sur un port libre et un seul abonné, dont les trames sont comptées
+    (tous les appareils simulés partagent 127.0.0.1 : pas de limite de sources par adresse)"""
+    ws = WSServer(Context("127.0.0.1", 0), engine="asyncio", telemetry_port=0,
+                  telemetry_options={'max_rate': max_rate, 'max_sources_per_ip': 1024}, offline_options=False)
+    outbox = Outbox(max_frames=10 ** 6, max_bytes=10 ** 9)
+    ws.registry.add("subscriber", {'id': 1, 'handler': None, 'address': None, 'outbox': outbox})
+    ws.subscriptions.add_client("subscriber")
+    ws.telemetry.start()
+    return ws, outbox
+
+
+def consume(outbox, counter, stop):
+    while not stop.is_set():
+        if outbox.pop(timeout=0.1) is not None:
+            counter[0] += 1
+
+
+def main():
+    nb_devices = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 200
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 3.0
+    # Une source sur quatre envoie le double, au-delà de la limite, pour montrer la limitation
+    max_rate = int(rate * 1.2)
+    ws, outbox = make_server(max_rate)
+    received = [0]
+    stop = threading.Event()
+    threading.Thread(target=consume, args=(outbox, received, stop), daemon=True).start()
+
+    senders = [TelemetrySender("127.0.0.1", ws.telemetry.port, f"esp32-{i}") for i in range(nb_devices)]
+    sent = 0
+    start = time.perf_counter()
+    tick = 0
+    while time.perf_counter() - start < duration:
+        tick += 1
+        value = {'x': tick % 1000, 'y': -tick % 1000, 'z': 981}
+        for i, sender in enumerate(senders):
+            for _ in range(2 if i % 4 == 0 else 1):
+                sender.send(SENSOR_ID.ACCELEROMETER, value)
+                sent += 1
+        # Rythme moyen : rate mesures/s par appareil
+        delay = start + tick / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    elapsed = time.perf_counter() - start
+    time.sleep(0.5)
+    stop.set()
+
+    stats = ws.telemetry.stats()
+    sources = stats['sources'].values()
+    admitted = sum(s['packets'] for s in sources)
+    print(f"{nb_devices} appareils, {rate:.0f} mesures/s chacun (limite {max_rate}/s), {elapsed:.1f} s")
+    print(f"  envoyés        : {sent} ({sent / elapsed:.0f}/s)")
+    print(f"  admis          : {admitted}   limités : {sum(s['limited'] for s in sources)}   "
+          f"perdus (numéros) : {sum(s['lost'] for s in sources)}   invalides : {stats['invalid']}")
+    print(f"  trames livrées : {received[0]}")
+    for name, source in list(stats['sources'].items())[:4]:
+        print(f"    {name}: {source}")
+    value = {'x': 12, 'y': -340, 'z': 981}
+    message = Message(MessageType.ENVOI.SENSOR, emitter="esp32-0", receiver="ALL", value=value,
+                      sensor_id=SENSOR_ID.ACCELEROMETER)
+    print(f"  taille d'une mesure : datagramme {len(encode_datagram('esp32-0', SENSOR_ID.ACCELEROMETER, value, 0))} octets, "
+          f"ENVOI_SENSOR binaire {len(message.to_binary())} octets, JSON {len(message.to_json())} octets")
+    ws.telemetry.close()
+
+
+if __name__ == "__main__":
+    main()
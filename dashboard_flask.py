@@ -12,6 +12,9 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from Context import Context
 from WSClient import WSClient
 from Message import MessageType
+from Log import get_logger
+
+log = get_logger("dashboard")
 
 app = Flask(__name__)
 
@@ -37,31 +40,50 @@ def on_message(msg):
     # Log de routage (message envoyé entre clients)
     if msg.message_type == MessageType.ADMIN.ROUTING_LOG:
         routing_logs.append(msg.value)
-        print(f"[ROUTING] {msg.value['emitter']} -> {msg.value['receiver']} ({msg.value['message_type']})")
+        log.debug("routage", extra={'fields': msg.value})
         push_to_sse("routing", msg.value)
 
+    # Lot de logs de routage (un message toutes les ~200 ms)
+    elif msg.message_type == MessageType.ADMIN.ROUTING_BATCH:
+        routing_logs.extend(msg.value)
+        del routing_logs[:-1000]
+        log.debug("routage", extra={'fields': {'count': len(msg.value)}})
+        for event in msg.value:
+            push_to_sse("routing", event)
+
+    # Connexions fermées par le heartbeat (pas de réponse au ping)
+    elif msg.message_type == MessageType.ADMIN.REAPED:
+        log.info("connexions inactives fermées", extra={'fields': {'count': msg.value['count'], 'usernames': msg.value['usernames']}})
+        push_to_sse("reaped", msg.value)
+
     # Nouveau client connecté
     elif msg.message_type == MessageType.ADMIN.CLIENT_CONNECTED:
-        print(f"[+] Client connecté: {msg.value['username']}")
+        log.info("client connecté", extra={'fields': {'username': msg.value['username']}})
         push_to_sse("client_connected", msg.value)
 
     # Client déconnecté
     elif msg.message_type == MessageType.ADMIN.CLIENT_DISCONNECTED:
-        print(f"[-] Client déconnecté: {msg.value['username']}")
+        log.info("client déconnecté", extra={'fields': {'username': msg.value['username']}})
         push_to_sse("client_disconnected", msg.value)
 
+    # Lot de connexions/déconnexions (rafale de reconnexions)
+    elif msg.message_type == MessageType.ADMIN.CLIENT_EVENTS:
+        log.info("lot d'événements clients", extra={'fields': {'count': len(msg.value)}})
+        for event in msg.value:
+            push_to_sse("client_" + event['event'], event)
+
     # Liste complète des clients (reçue à la connexion)
     elif msg.message_type == MessageType.ADMIN.CLIENT_LIST_FULL:
         global connected_clients
         connected_clients = msg.value
-        print(f"[CLIENTS] {len(msg.value)} clients connectés")
+        log.info("liste des clients", extra={'fields': {'count': len(msg.value)}})
         push_to_sse("client_list", msg.value)
 
     else:
-        print(f"[MSG] {msg.message_type}: {msg.emitter} -> {msg.receiver}")
+        log.debug("message", extra={'fields': {'type': msg.message_type, 'emitter': msg.emitter, 'receiver': msg.receiver}})
 
 def on_connect():
-    print("[ADMIN] Connecté au serveur WS")
+    log.info("connecté au serveur WS")
 
 def on_users_list(users):
     pass  # Géré par CLIENT_LIST_FULL pour les admins
@@ -98,7 +120,7 @@ def get_logs():
 @app.route('/api/stream')
 def stream():
     """SSE endpoint pour recevoir les événements en temps réel"""
-    print(f"[SSE] Nouvelle connexion client : {datetime.now()}")
+    log.info("nouvelle connexion SSE")
     def event_stream():
         q = queue.Queue()
         sse_queues.append(q)
@@ -109,7 +131,7 @@ def stream():
                 event = q.get()
                 yield f"data: {json.dumps(event)}\n\n"
         finally:
-            print(f"[SSE] Client déconnecté")
+            log.info("connexion SSE fermée")
             sse_queues.remove(q)
 
     return Response(event_stream(), mimetype='text/event-stream')
@@ -0,0 +1,69 @@
+"""Outils communs des tests : WSServer non démarré (moteur asyncio) et connexions factices"""
+import itertools
+import json
+import os
+import struct
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Context import Context
+from Message import Message, MessageType
+from Outbox import Outbox
+from WSFrame import OPCODE_TEXT
+from WSServer import WSServer
+
+ids = itertools.count(1)
+
+
+def make_server(**options):
+    """Serveur sans socket ni threads : les trames restent dans l'Outbox de chaque client"""
+    options.setdefault('membership_window', 0)
+    options.setdefault('offline_options', {'directory': tempfile.mkdtemp()})
+    return WSServer(Context("127.0.0.1", 0), engine="asyncio", **options)
+
+
+def make_client(**outbox_options):
+    return {'id': next(ids), 'handler': None, 'address': ("127.0.0.1", 0), 'outbox': Outbox(**outbox_options)}
+
+
+def connect(ws, username, capabilities=None, **declaration):
+    """Nouvelle connexion déclarée sous username ; les trames de bienvenue sont vidées"""
+    client = make_client()
+    ws.on_new_client(client, ws.server)
+    value = dict(declaration, capabilities=capabilities) if capabilities is not None else "declaration"
+    send(ws, client, MessageType.DECLARATION, value, username, "SERVER")
+    received(client)
+    return client
+
+
+def send(ws, client, message_type, value, emitter, receiver, **fields):
+    raw = Message(message_type, value, emitter, receiver, **fields).to_json()
+    # Trame texte : reçue en str par le serveur, quel que soit le codec (orjson renvoie des octets)
+    ws.on_message_received(client, ws.server, raw if isinstance(raw, str) else raw.decode("utf-8"))
+
+
+def decode_frame(frame):
+    first, length = frame[0], frame[1] & 0x7F
+    offset = 2
+    if length == 126:
+        length, offset = struct.unpack_from("!H", frame, 2)[0], 4
+    elif length == 127:
+        length, offset = struct.unpack_from("!Q", frame, 2)[0], 10
+    payload = frame[offset:offset + length]
+    return json.loads(payload) if first & 0x0F == OPCODE_TEXT else payload
+
+
+def received(client):
+    """Messages en file pour ce client, dans l'ordre d'envoi (JSON décodé, octets pour une trame binaire)"""
+    messages = []
+    while True:
+        frame = client['outbox'].pop()
+        if frame is None:
+            return messages
+        messages.append(decode_frame(frame))
+
+
+def values(messages, message_type):
+    return [m['data']['value'] for m in messages if isinstance(m, dict) and m['message_type'] == message_type]
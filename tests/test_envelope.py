@@ -0,0 +1,32 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Message import Envelope, Message, MessageType
+
+
+class PeekJsonTest(unittest.TestCase):
+    def test_header_before_value(self):
+        raw = json.dumps({'message_type': "ENVOI_TEXT", 'data': {'emitter': "a", 'receiver': "b", 'value': "hi"}})
+        envelope = Envelope.peek(raw)
+        self.assertEqual((envelope.message_type, envelope.emitter, envelope.receiver), ("ENVOI_TEXT", "a", "b"))
+        self.assertEqual(Message.from_json(envelope.retyped(MessageType.RECEPTION.TEXT)).message_type, "RECEPTION_TEXT")
+
+    def test_receiver_after_value_falls_back(self):
+        raw = '{"message_type":"ENVOI_TEXT","data":{"emitter":"a","value":"hi","receiver":"b"}}'
+        self.assertIsNone(Envelope.peek(raw))
+        self.assertEqual(Message.from_json(raw).receiver, "b")
+
+    def test_missing_emitter_falls_back(self):
+        self.assertIsNone(Envelope.peek('{"message_type":"ENVOI_TEXT","data":{"receiver":"b","value":"hi"}}'))
+
+    def test_sensor_id_after_value_falls_back(self):
+        raw = '{"message_type":"ENVOI_SENSOR","data":{"emitter":"a","receiver":"ALL","value":{"isPressed":true},"sensor_id":"BUTTON"}}'
+        self.assertIsNone(Envelope.peek(raw))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+from unittest import mock
+
+import support  # noqa: F401  (racine du dépôt dans sys.path)
+
+import Heartbeat as heartbeat_module
+from Heartbeat import Heartbeat
+
+
+class HeartbeatTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        patcher = mock.patch.object(heartbeat_module.time, "monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pings, self.reaped, self.reports = [], [], []
+        self.heartbeat = Heartbeat(2, 1, self.pings.append, self.reaped.append, self.reports.append, tick=1)
+        # La roue est avancée à la main, pas par le thread
+        self.heartbeat.start = lambda: None
+
+    def tick(self):
+        self.now += 1
+        self.heartbeat.advance()
+
+    def test_silent_client_pinged_then_reaped(self):
+        client = {'id': 1}
+        self.heartbeat.add(client)
+        self.tick()
+        self.tick()
+        self.assertEqual(self.pings, [client])
+        self.assertEqual(self.reaped, [])
+        self.tick()
+        self.assertEqual(self.reaped, [client])
+        self.assertEqual(self.reports, [[client]])
+        self.assertEqual(self.heartbeat.stats(), {'tracked': 0, 'awaiting_pong': 0, 'reaped': 1})
+
+    def test_pong_keeps_client(self):
+        client = {'id': 1}
+        self.heartbeat.add(client)
+        self.tick()
+        self.tick()
+        self.now += 0.5
+        self.heartbeat.seen(client)
+        self.tick()
+        self.assertEqual(self.reaped, [])
+        self.assertEqual(self.heartbeat.stats()['tracked'], 1)
+
+    def test_active_client_not_pinged(self):
+        client = {'id': 1}
+        self.heartbeat.add(client)
+        for _ in range(6):
+            self.tick()
+            self.heartbeat.seen(client)
+        self.assertEqual((self.pings, self.reaped), ([], []))
+
+    def test_removed_client_forgotten(self):
+        client = {'id': 1}
+        self.heartbeat.add(client)
+        self.heartbeat.remove(client)
+        for _ in range(4):
+            self.tick()
+        self.assertEqual((self.pings, self.reaped), ([], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
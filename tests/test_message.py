@@ -0,0 +1,25 @@
+import unittest
+
+import support  # noqa: F401  (racine du dépôt dans sys.path)
+
+from Message import Envelope, Message, MessageType
+
+
+class JsonRoundTripTest(unittest.TestCase):
+    def test_mime_round_trip(self):
+        message = Message(MessageType.RECEPTION.IMAGE, "IMG:iVBORw0KGgo=", "cam", "B", mime="image/png")
+        decoded = Message.from_json(message.to_json())
+        self.assertEqual((decoded.message_type, decoded.value, decoded.emitter, decoded.receiver, decoded.mime),
+                         (MessageType.RECEPTION.IMAGE, "IMG:iVBORw0KGgo=", "cam", "B", "image/png"))
+        # mime fait partie de l'en-tête : le relais rapide lit toujours le message
+        self.assertEqual(Envelope.peek(message.to_json()).receiver, "B")
+
+    def test_without_mime(self):
+        message = Message(MessageType.RECEPTION.TEXT, "hi", "A", "B")
+        raw = message.to_json()
+        self.assertNotIn(b"mime", raw if isinstance(raw, bytes) else raw.encode("utf-8"))
+        self.assertIsNone(Message.from_json(raw).mime)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+from support import connect, make_server, received, send, values
+
+from Message import MessageType
+
+
+class OfflineReceiverTest(unittest.TestCase):
+    def setUp(self):
+        self.ws = make_server()
+        self.sender = connect(self.ws, "A")
+
+    def tearDown(self):
+        self.ws.offline.close()
+
+    def test_server_address_not_stored(self):
+        send(self.ws, self.sender, MessageType.ENVOI.TEXT, "bonjour", "A", "SERVER")
+        self.assertEqual(self.ws.offline.stats()['receivers'], 0)
+        self.assertEqual(values(received(self.sender), MessageType.RECEPTION.TEXT), ["Erreur: destinataire SERVER non trouvé."])
+
+    def test_missing_receiver_answered_with_error(self):
+        send(self.ws, self.sender, MessageType.ENVOI.TEXT, "bonjour", "A", None)
+        self.assertEqual(self.ws.offline.stats()['receivers'], 0)
+        self.assertEqual(values(received(self.sender), MessageType.RECEPTION.TEXT), ["Erreur: destinataire None non trouvé."])
+        # La connexion reste utilisable
+        send(self.ws, self.sender, MessageType.ENVOI.TEXT, "bonjour", "A", "#inconnu")
+        self.assertEqual(values(received(self.sender), MessageType.RECEPTION.TEXT), ["Erreur: salon inconnu inexistant."])
+
+    def test_absent_user_stored(self):
+        send(self.ws, self.sender, MessageType.ENVOI.TEXT, "pour plus tard", "A", "B")
+        self.assertEqual(self.ws.offline.pending("B"), 1)
+        self.assertEqual(values(received(self.sender), MessageType.RECEPTION.TEXT), ["B hors ligne : messages conservés."])
+
+
+if __name__ == "__main__":
+    unittest.main()
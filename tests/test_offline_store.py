@@ -0,0 +1,128 @@
+import os
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import support  # noqa: F401  (racine du dépôt dans sys.path)
+
+import OfflineStore as offline_module
+from OfflineStore import OfflineStore
+
+
+class OfflineStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = os.path.join(tempfile.mkdtemp(), "journal")
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+
+    def open(self, **options):
+        store = OfflineStore(self.directory, **options)
+        self.stores.append(store)
+        return store
+
+    def reopen(self, store, **options):
+        store.close()
+        self.stores.remove(store)
+        return self.open(**options)
+
+    def test_append_take_in_order(self):
+        store = self.open()
+        for i in range(5):
+            store.append("B", f"m{i}".encode())
+        store.append("C", b"\x01\x02", binary=True)
+        self.assertEqual(store.pending("B"), 5)
+        self.assertEqual(store.take("B", limit=2), [(b"m0", False), (b"m1", False)])
+        self.assertEqual(store.take("B"), [(b"m2", False), (b"m3", False), (b"m4", False)])
+        self.assertFalse(store.has("B"))
+        self.assertEqual(store.take("C"), [(b"\x01\x02", True)])
+        self.assertEqual(store.stats()['pending'], 0)
+
+    def test_reload_after_restart(self):
+        store = self.open()
+        for i in range(4):
+            store.append("B", f"m{i}".encode())
+        store.take("B", limit=1)
+        store = self.reopen(store)
+        # Livré avant l'arrêt : pas relivré ; la suite reprend dans l'ordre
+        self.assertEqual([payload for payload, _ in store.take("B")], [b"m1", b"m2", b"m3"])
+        store.append("B", b"after")
+        store = self.reopen(store)
+        self.assertEqual(store.take("B"), [(b"after", False)])
+
+    def test_truncated_record_cut_on_reload(self):
+        store = self.open()
+        store.append("B", b"complete")
+        store.append("B", b"torn")
+        path = store.active.path
+        store.close()
+        self.stores.remove(store)
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 2)
+        store = self.open()
+        self.assertEqual(store.take("B"), [(b"complete", False)])
+
+    def test_delivered_segments_removed_and_sparse_compacted(self):
+        store = self.open(segment_size=200, compact_ratio=0.5)
+        for i in range(10):
+            store.append("B", b"x" * 40)
+            store.append("C", b"y" * 40)
+        segments = store.stats()['segments']
+        self.assertGreater(segments, 3)
+        # Tous les C livrés : leurs segments ne gardent que des B, minoritaires -> compactés ou supprimés
+        store.take("C", limit=100)
+        self.assertLess(store.stats()['segments'], segments)
+        self.assertEqual(store.take("B", limit=100), [(b"x" * 40, False)] * 10)
+        store = self.reopen(store, segment_size=200, compact_ratio=0.5)
+        self.assertEqual(store.stats()['pending'], 0)
+
+    def test_retention(self):
+        store = self.open(max_per_receiver=3, max_age=60)
+        for i in range(5):
+            store.append("B", f"m{i}".encode())
+        self.assertEqual(store.pending("B"), 3)
+        self.assertEqual(store.stats()['dropped'], 2)
+        with mock.patch.object(offline_module.time, "time", return_value=time.time() + 120):
+            store.maintain()
+        self.assertFalse(store.has("B"))
+        self.assertEqual(store.stats()['dropped'], 5)
+
+    def test_max_bytes_drops_oldest_first(self):
+        store = self.open(max_bytes=400)
+        store.append("old", b"a" * 100)
+        for i in range(3):
+            store.append("new", b"b" * 100)
+        self.assertFalse(store.has("old"))
+        self.assertEqual(store.pending("new"), 3)
+
+    def test_private_directory_locked(self):
+        self.open()
+        self.assertEqual(stat.S_IMODE(os.stat(self.directory).st_mode), 0o700)
+        with self.assertRaises(RuntimeError):
+            OfflineStore(self.directory)
+
+    def test_fsync_off_the_caller_thread(self):
+        threads = []
+        real_fsync = os.fsync
+
+        def fsync(fd):
+            threads.append(threading.current_thread())
+            real_fsync(fd)
+
+        with mock.patch.object(offline_module.os, "fsync", fsync):
+            store = self.open(fsync="always")
+            store.append("B", b"durable")
+            deadline = time.monotonic() + 2
+            while not threads and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertTrue(threads)
+        self.assertNotIn(threading.current_thread(), threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+import support  # noqa: F401  (racine du dépôt dans sys.path)
+
+from Outbox import CONTROL, MEDIA, SENSOR, TEXT, Outbox
+
+
+class OutboxPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.laggards = []
+        self.outbox = Outbox(max_frames=2, on_laggard=lambda: self.laggards.append(True))
+
+    def test_sensor_dropped_without_overflow_when_lane_empty(self):
+        self.assertTrue(self.outbox.put(b"t1", TEXT))
+        self.assertTrue(self.outbox.put(b"t2", TEXT))
+        for _ in range(self.outbox.laggard_limit + 2):
+            self.assertFalse(self.outbox.put(b"s", SENSOR))
+        self.assertEqual(self.outbox.lanes[SENSOR].dropped, self.outbox.laggard_limit + 2)
+        self.assertEqual(self.outbox.overflows, 0)
+        self.assertFalse(self.outbox.closed)
+        self.assertEqual(self.laggards, [])
+        self.assertEqual([self.outbox.pop(), self.outbox.pop()], [b"t1", b"t2"])
+
+    def test_sensor_replaces_oldest_of_its_lane(self):
+        self.outbox.put(b"s1", SENSOR)
+        self.outbox.put(b"s2", SENSOR)
+        self.assertTrue(self.outbox.put(b"s3", SENSOR))
+        self.assertEqual(self.outbox.lanes[SENSOR].dropped, 1)
+        self.assertEqual([self.outbox.pop(), self.outbox.pop(), self.outbox.pop()], [b"s2", b"s3", None])
+
+    def test_block_gives_up_after_timeout_and_laggard_disconnected(self):
+        self.outbox.policies[TEXT] = ("block", 0.01)
+        self.outbox.put(b"t1", TEXT)
+        self.outbox.put(b"t2", TEXT)
+        for _ in range(self.outbox.laggard_limit - 1):
+            self.assertFalse(self.outbox.put(b"late", TEXT))
+        self.assertFalse(self.outbox.closed)
+        self.assertFalse(self.outbox.put(b"late", TEXT))
+        self.assertTrue(self.outbox.closed)
+        self.assertEqual(self.laggards, [True])
+
+    def test_pop_resets_overflow_count(self):
+        self.outbox.policies[TEXT] = ("block", 0.01)
+        self.outbox.put(b"t1", TEXT)
+        self.outbox.put(b"t2", TEXT)
+        self.assertFalse(self.outbox.put(b"late", TEXT))
+        self.outbox.pop()
+        self.assertEqual(self.outbox.overflows, 0)
+        self.assertTrue(self.outbox.put(b"t3", TEXT))
+
+    def test_disconnect_policy(self):
+        self.outbox.policies[MEDIA] = ("disconnect", 0)
+        self.outbox.put(b"m1", MEDIA)
+        self.outbox.put(b"m2", MEDIA)
+        self.assertFalse(self.outbox.put(b"m3", MEDIA))
+        self.assertTrue(self.outbox.closed)
+        self.assertEqual(self.laggards, [True])
+
+    def test_priority_with_starvation_guard(self):
+        outbox = Outbox(starvation_every=4)
+        for i in range(3):
+            outbox.put(b"media%d" % i, MEDIA)
+        for i in range(6):
+            outbox.put(b"sensor%d" % i, SENSOR)
+        outbox.put(b"control", CONTROL)
+        order = [outbox.pop() for _ in range(10)]
+        self.assertEqual(order[0], b"control")
+        # Une trame sur starvation_every vient de la voie la moins prioritaire
+        self.assertEqual(order[3], b"media0")
+        self.assertEqual(order[7], b"media1")
+        self.assertEqual([f for f in order if f.startswith(b"sensor")], [b"sensor%d" % i for i in range(6)])
+
+
+if __name__ == "__main__":
+    unittest.main()
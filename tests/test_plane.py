@@ -0,0 +1,63 @@
+import queue
+import unittest
+
+import support  # noqa: F401  (racine du dépôt dans sys.path)
+
+import Plane
+from Plane import DELIVER, HELLO, PACKET_HEADER, LoopbackHub, LoopbackPlane, encode_packet
+
+
+class PlaneHelloTest(unittest.TestCase):
+    def setUp(self):
+        self.hub = LoopbackHub()
+        self.plane = LoopbackPlane(self.hub, "a", ["a"], token="secret")
+        self.packets = queue.SimpleQueue()
+        self.plane.start(lambda peer, kind, header, payload: self.packets.put((peer, kind, header, payload)))
+
+    def tearDown(self):
+        self.plane.close()
+
+    def connect(self):
+        sock = self.hub.connect("a")
+        sock.settimeout(2)
+        self.addCleanup(sock.close)
+        return sock
+
+    def assert_closed(self, sock):
+        # Le serveur ferme la connexion sans attendre la suite du paquet annoncé (RST si des octets restaient non lus)
+        try:
+            self.assertEqual(sock.recv(1), b"")
+        except ConnectionResetError:
+            pass
+        self.assertTrue(self.packets.empty())
+
+    def test_token_accepted(self):
+        sock = self.connect()
+        sock.sendall(encode_packet(HELLO, {'peer': "b", 'token': "secret"}))
+        sock.sendall(encode_packet(DELIVER, {'receiver': "X"}, b"payload"))
+        self.assertEqual(self.packets.get(timeout=2), ("b", DELIVER, {'receiver': "X"}, b"payload"))
+
+    def test_wrong_token_refused(self):
+        sock = self.connect()
+        sock.sendall(encode_packet(HELLO, {'peer': "b", 'token': "guess"})
+                     + encode_packet(DELIVER, {'receiver': "X"}, b"payload"))
+        self.assert_closed(sock)
+
+    def test_oversized_hello_refused(self):
+        sock = self.connect()
+        sock.sendall(PACKET_HEADER.pack(HELLO, 0xFFFFFFFF, 0))
+        self.assert_closed(sock)
+
+    def test_hello_with_payload_refused(self):
+        sock = self.connect()
+        sock.sendall(PACKET_HEADER.pack(HELLO, 2, Plane.MAX_HELLO) + b"{}")
+        self.assert_closed(sock)
+
+    def test_other_first_packet_refused(self):
+        sock = self.connect()
+        sock.sendall(PACKET_HEADER.pack(DELIVER, 0xFFFFFFFF, 0xFFFFFFFF))
+        self.assert_closed(sock)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import threading
+import time
+import unittest
+
+from support import make_client, make_server, send
+
+from Message import Message, MessageType
+
+THREADS = 16
+CYCLES = 100
+TIME_LIMIT = 30
+
+
+class RegistryStressTest(unittest.TestCase):
+    """Connexions, déclarations et déconnexions concurrentes (usernames partagés entre threads) pendant
+    des diffusions à ALL : à la fin, registre, abonnements et liste publiée sont vides"""
+
+    def test_concurrent_cycles_leave_nothing_behind(self):
+        ws = make_server(offline_options=None, membership_window=0.01)
+        errors = []
+        stop = threading.Event()
+
+        def cycles(worker):
+            try:
+                for i in range(CYCLES):
+                    client = make_client(max_frames=10 ** 9, max_bytes=10 ** 15)
+                    # Quelques usernames partagés : reconnexions qui remplacent une connexion vivante
+                    username = f"esp_{worker}_{i % 4}" if i % 10 else f"shared_{i % 3}"
+                    ws.on_new_client(client, ws.server)
+                    send(ws, client, MessageType.DECLARATION, "stress", username, "SERVER")
+                    ws.on_client_left(client, ws.server)
+            except Exception as e:
+                errors.append(e)
+
+        def broadcaster():
+            try:
+                while not stop.is_set():
+                    ws.send_to_all(Message(MessageType.RECEPTION.TEXT, emitter="SERVER", receiver="ALL", value="tick"))
+            except Exception as e:
+                errors.append(e)
+
+        reader = threading.Thread(target=broadcaster, daemon=True)
+        workers = [threading.Thread(target=cycles, args=(w,), daemon=True) for w in range(THREADS)]
+        deadline = time.monotonic() + TIME_LIMIT
+        reader.start()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join(max(0, deadline - time.monotonic()))
+        stop.set()
+        reader.join(5)
+        self.assertFalse(any(t.is_alive() for t in workers), f"cycles non terminés en {TIME_LIMIT} s")
+        self.assertEqual(errors, [])
+        time.sleep(0.05)
+        ws.membership.flush()
+        leftovers = {
+            'by_name': len(ws.registry.by_name),
+            'by_id': len(ws.registry.by_id),
+            'admins': len(ws.registry.admin_ids),
+            'metadata': len(ws.registry.metadata),
+            'subscriptions': len(ws.subscriptions.unfiltered),
+            'membership': len(ws.membership.users),
+        }
+        self.assertEqual(leftovers, dict.fromkeys(leftovers, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+
+from support import connect, make_client, make_server, received, send, values
+
+from Message import CAPABILITY, MessageType
+
+CAPABILITIES = [CAPABILITY.REPLAY, CAPABILITY.ACK]
+
+
+class ReplayResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.ws = make_server(offline_options=None)
+        self.sender = connect(self.ws, "B")
+
+    def text(self, value):
+        send(self.ws, self.sender, MessageType.ENVOI.TEXT, value, "B", "A")
+
+    def declare(self, last_seen=None):
+        """Connexion de A ; renvoie (client, réponse 'resume', textes reçus) ; les textes sont numérotés"""
+        client = make_client()
+        self.ws.on_new_client(client, self.ws.server)
+        value = {'capabilities': CAPABILITIES}
+        if last_seen is not None:
+            value['resume'] = last_seen
+        send(self.ws, client, MessageType.DECLARATION, value, "A", "SERVER")
+        messages = received(client)
+        resume = next(v['resume'] for v in values(messages, MessageType.SYS_MESSAGE) if isinstance(v, dict) and 'resume' in v)
+        return client, resume, values(messages, MessageType.RECEPTION.TEXT)
+
+    def test_resume_replays_gap_and_held_messages(self):
+        client, _, texts = self.declare()
+        for value in ("m1", "m2", "m3"):
+            self.text(value)
+        texts += values(received(client), MessageType.RECEPTION.TEXT)
+        self.assertEqual(texts[-3:], ["m1", "m2", "m3"])
+        seen = len(texts)
+        send(self.ws, client, MessageType.SYS_MESSAGE, {'ack': seen - 2}, "A", "SERVER")
+        self.ws.on_client_left(client, self.ws.server)
+        # Coupure courte : le message direct est gardé pour le rejeu
+        self.text("m4")
+        # m3 perdu en route : le client n'a vu que jusqu'à m2
+        _, resume, texts = self.declare(seen - 1)
+        self.assertEqual((resume['replayed'], resume['complete']), (2, True))
+        self.assertEqual([text for text in texts if text.startswith("m")], ["m3", "m4"])
+
+    def test_acked_frames_not_replayable(self):
+        client, _, texts = self.declare()
+        for value in ("m1", "m2"):
+            self.text(value)
+        texts += values(received(client), MessageType.RECEPTION.TEXT)
+        send(self.ws, client, MessageType.SYS_MESSAGE, {'ack': len(texts)}, "A", "SERVER")
+        self.ws.on_client_left(client, self.ws.server)
+        _, resume, texts = self.declare(0)
+        self.assertFalse(resume['complete'])
+        self.assertNotIn("m1", texts)
+
+
+class AckTest(unittest.TestCase):
+    def setUp(self):
+        self.ws = make_server(offline_options=None)
+        self.sender = connect(self.ws, "B")
+        self.client = connect(self.ws, "A", CAPABILITIES)
+        send(self.ws, self.sender, MessageType.ENVOI.TEXT, "m1", "B", "A")
+        received(self.client)
+
+    def test_valid_ack(self):
+        send(self.ws, self.client, MessageType.SYS_MESSAGE, {'ack': 1}, "A", "SERVER")
+        self.assertEqual(self.client['outbox'].acked, 1)
+        self.assertEqual(received(self.client), [])
+
+    def test_malformed_ack_refused(self):
+        for ack in ("abc", None, [1], 1.5, True):
+            with self.subTest(ack=ack):
+                send(self.ws, self.client, MessageType.SYS_MESSAGE, {'ack': ack}, "A", "SERVER")
+                self.assertEqual(self.client['outbox'].acked, 0)
+                errors = [v['error'] for v in values(received(self.client), MessageType.SYS_MESSAGE) if 'error' in v]
+                self.assertEqual(len(errors), 1)
+        # La connexion reste utilisable
+        send(self.ws, self.client, MessageType.SYS_MESSAGE, {'ack': 1}, "A", "SERVER")
+        self.assertEqual(self.client['outbox'].acked, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import json
+import unittest
+
+import support  # noqa: F401  (racine du dépôt dans sys.path)
+
+import SensorCodec
+from Message import Message, MessageType
+
+SAMPLES = {'boolean': True, 'integer': 7, 'number': 0.5, 'string': "ok"}
+
+
+def sample(schema):
+    return {name: SAMPLES[prop['type']] for name, prop in schema['properties'].items()}
+
+
+class SensorCodecTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(SensorCodec.STANDARD_PATH, encoding="utf-8") as f:
+            cls.standard = json.load(f)
+        cls.schemas = cls.standard['sensor_value_schemas']
+
+    def test_layouts_follow_standard(self):
+        self.assertEqual(SensorCodec.VERSION, self.standard['sensor_encoding']['version'])
+        self.assertEqual(set(SensorCodec.LAYOUTS), set(self.schemas))
+        for index, sensor_id in enumerate(self.standard['sensor_id']['enum']):
+            if sensor_id in self.schemas:
+                self.assertEqual(SensorCodec.SENSOR_CODES[sensor_id], index + 1)
+                self.assertEqual([name for name, _, _ in SensorCodec.LAYOUTS[sensor_id].fields],
+                                 list(self.schemas[sensor_id]['properties']))
+
+    def test_pack_unpack_round_trip(self):
+        for sensor_id, schema in self.schemas.items():
+            with self.subTest(sensor_id=sensor_id):
+                value = sample(schema)
+                data = SensorCodec.pack(sensor_id, value)
+                self.assertIsNotNone(data)
+                self.assertEqual(SensorCodec.unpack(sensor_id, data), value)
+
+    def test_non_conforming_values_stay_json(self):
+        for sensor_id, schema in self.schemas.items():
+            with self.subTest(sensor_id=sensor_id):
+                value = sample(schema)
+                self.assertFalse(SensorCodec.can_pack(sensor_id, dict(value, extra=1)))
+                name, prop = next(iter(schema['properties'].items()))
+                wrong = "text" if prop['type'] != "string" else 1
+                self.assertFalse(SensorCodec.can_pack(sensor_id, dict(value, **{name: wrong})))
+        self.assertIsNone(SensorCodec.pack("UNKNOWN", {}))
+
+    def test_out_of_range_stays_json(self):
+        for sensor_id, layout in SensorCodec.LAYOUTS.items():
+            for name, kind, fmt in layout.fields:
+                if kind == "integer" and fmt in ("b", "B", "h", "H"):
+                    value = dict(sample(self.schemas[sensor_id]), **{name: 1 << 16})
+                    self.assertIsNone(SensorCodec.pack(sensor_id, value), f"{sensor_id}.{name}")
+
+    def test_truncated_data_refused(self):
+        for sensor_id, schema in self.schemas.items():
+            with self.subTest(sensor_id=sensor_id):
+                data = SensorCodec.pack(sensor_id, sample(schema))
+                with self.assertRaises(ValueError):
+                    SensorCodec.unpack(sensor_id, data[:-1])
+
+    def test_binary_message_round_trip(self):
+        for sensor_id, schema in self.schemas.items():
+            with self.subTest(sensor_id=sensor_id):
+                value = sample(schema)
+                message = Message(MessageType.RECEPTION.SENSOR, value, "esp", "ALL", sensor_id=sensor_id)
+                decoded = Message.from_binary(message.to_binary())
+                self.assertEqual((decoded.sensor_id, decoded.value, decoded.emitter), (sensor_id, value, "esp"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Message import SENSOR_ID
+from Telemetry import TelemetryListener, encode_datagram
+
+VALUE = {'isPressed': True}
+
+
+class TelemetryTrustTest(unittest.TestCase):
+    def listener(self, host="127.0.0.1", **options):
+        delivered = []
+        return TelemetryListener(host, 0, delivered.append, **options), delivered
+
+    def test_non_loopback_requires_allowlist(self):
+        with mock.patch.dict(os.environ, {}, clear=True):
+            with self.assertRaises(ValueError):
+                self.listener("0.0.0.0")
+            self.listener("localhost")
+        with mock.patch.dict(os.environ, {'WS_TELEMETRY_ALLOW': "esp32-1, esp32-2"}):
+            listener, _ = self.listener("0.0.0.0")
+            self.assertEqual(listener.allowed, {"esp32-1", "esp32-2"})
+
+    def test_unlisted_device_rejected(self):
+        listener, delivered = self.listener("0.0.0.0", allowed=["esp32-1"])
+        listener.handle(encode_datagram("esp32-1", SENSOR_ID.BUTTON, VALUE, 0), ("10.0.0.2", 4000), 0.0)
+        listener.handle(encode_datagram("intrus", SENSOR_ID.BUTTON, VALUE, 0), ("10.0.0.3", 4000), 0.0)
+        self.assertEqual([m.emitter for m in delivered], ["esp32-1"])
+        self.assertEqual(listener.rejected, 1)
+
+    def test_sources_capped_per_ip(self):
+        listener, delivered = self.listener(max_sources_per_ip=2)
+        for i in range(5):
+            listener.handle(encode_datagram(f"dev{i}", SENSOR_ID.BUTTON, VALUE, 0), ("10.0.0.9", 4000 + i), 0.0)
+        listener.handle(encode_datagram("other", SENSOR_ID.BUTTON, VALUE, 0), ("10.0.0.10", 4000), 0.0)
+        self.assertEqual([m.emitter for m in delivered], ["dev0", "dev1", "other"])
+        # Sources muettes oubliées : la place se libère pour cette adresse
+        listener.expire(listener.idle_timeout + 1)
+        self.assertEqual(listener.per_ip, {})
+        listener.handle(encode_datagram("dev4", SENSOR_ID.BUTTON, VALUE, 0), ("10.0.0.9", 4004), 400.0)
+        self.assertEqual(delivered[-1].emitter, "dev4")
+
+
+if __name__ == "__main__":
+    unittest.main()
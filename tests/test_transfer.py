@@ -0,0 +1,67 @@
+import os
+import sys
+import tempfile
+import unittest
+import uuid
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Message import Message, MessageType, transfer_error
+from Transfer import IncomingTransfer, TransferManager
+
+
+class FakeClient:
+    username = "B"
+    connected = True
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, message):
+        self.sent.append(message)
+
+
+def chunk(transfer_id, data=b"abc", **overrides):
+    transfer = {'id': transfer_id, 'index': 0, 'count': 1, 'chunk_size': 256 * 1024, 'size': len(data),
+                'crc': zlib.crc32(data), 'media': MessageType.ENVOI.IMAGE}
+    transfer.update(overrides)
+    return Message(MessageType.RECEPTION.CHUNK, value=data, emitter="A", receiver="B", transfer=transfer)
+
+
+class TransferIdTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.directory = os.path.join(self.root, "transfers")
+        self.client = FakeClient()
+        self.manager = TransferManager(self.client, self.directory)
+
+    def test_traversal_id_refused(self):
+        message = chunk("../escaped_file")
+        self.assertIsNotNone(transfer_error(message.transfer))
+        self.assertIsNone(self.manager.on_chunk(message))
+        self.assertEqual(os.listdir(self.root), ["transfers"])
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(self.client.sent, [])
+        with self.assertRaises(ValueError):
+            IncomingTransfer(self.directory, "A", message.transfer, None)
+
+    def test_unbounded_fields_refused(self):
+        transfer_id = uuid.uuid4().hex
+        for overrides in ({'index': 1}, {'index': -1}, {'count': 0}, {'count': "1"}, {'chunk_size': 2 ** 40},
+                          {'index': True}, {'media': "../x"}):
+            self.assertIsNone(self.manager.on_chunk(chunk(transfer_id, **overrides)), overrides)
+        self.assertIsNotNone(transfer_error(None))
+        self.assertIsNotNone(transfer_error({'id': transfer_id.upper()}))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_valid_transfer_written_in_directory(self):
+        transfer_id = uuid.uuid4().hex
+        result = self.manager.on_chunk(chunk(transfer_id))
+        self.assertEqual(result.transfer['path'], os.path.join(self.directory, transfer_id))
+        with open(result.transfer['path'], "rb") as f:
+            self.assertEqual(f.read(), b"abc")
+
+
+if __name__ == "__main__":
+    unittest.main()